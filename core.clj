@@ -35,20 +35,6 @@
   [name args & body]
   `(def ~name ~(cons 'fn (cons args body))))
 
-(defn +
-  [& args]
-  (reduce* binary+ 0 args))
-
-(defn *
-  [& args]
-  (reduce* binary* 1 args))
-
-(defn -
-  [x & xs]
-  (if (= () xs)
-    (binary- 0 x)
-    (reduce* binary- x xs)))
-
 (defn not (x) (if x false true))
 
 (defmacro when
@@ -61,15 +47,6 @@
 
 (defmacro comment [& _] 'nil)
 
-(defn reduce* [f init coll]
-  (if (= coll ())
-    init
-    (recur f (f init (first coll)) (rest coll))))
-
-(defn count
-  [coll]
-  (reduce* (fn [acc _] (+ acc 1)) 0 coll))
-
 (defn last
   [coll]
   (reduce* (fn [_ x] x) nil coll))
@@ -130,26 +107,48 @@
        ~(cons 'and tl)
        ~hd)))
 
-(defn dec
-  [x]
-  (- x 1))
-
 (defn take
-  [n coll]
-  (if (or (= 0 n)
-          (= coll ()))
-    ()
-    (cons (first coll)
-          (take (dec n)
-                (rest coll)))))
+  ([n]
+   (fn [rf]
+     (let [left (atom n)]
+       (fn
+         ([] (rf))
+         ([result] (rf result))
+         ([result input]
+          (let [n (deref left)
+                nn (swap! left dec)
+                result (if (< 0 n)
+                         (rf result input)
+                         result)]
+            (if (< 0 nn)
+              result
+              (ensure-reduced result))))))))
+  ([n coll]
+   (if (or (= 0 n)
+           (= coll ()))
+     ()
+     (cons (first coll)
+           (take (dec n)
+                 (rest coll))))))
 
 (defn drop
-  [n coll]
-  (if (or (= 0 n)
-          (= coll ()))
-    coll
-    (drop (dec n)
-          (rest coll))))
+  ([n]
+   (fn [rf]
+     (let [left (atom n)]
+       (fn
+         ([] (rf))
+         ([result] (rf result))
+         ([result input]
+          (if (< 0 (deref left))
+            (do (swap! left dec)
+                result)
+            (rf result input)))))))
+  ([n coll]
+   (if (or (= 0 n)
+           (= coll ()))
+     coll
+     (drop (dec n)
+           (rest coll)))))
 
 (defn partition
   [n coll]
@@ -162,44 +161,33 @@
   [coll]
   `(lazy-seq* (fn [] ~coll)))
 
-(defn seq [coll]
-  (when-not (or (= {} coll)
-                (= () coll)
-                (= "" coll))
-    coll))
-
-(defn map [f coll]
-  (lazy-seq
-    (if (seq coll)
-      (cons (f (first coll))
-            (map f (rest coll)))
-      ())))
+(defn map
+  ([f]
+   (fn [rf]
+     (fn
+       ([] (rf))
+       ([result] (rf result))
+       ([result input] (rf result (f input))))))
+  ([f coll]
+   (lazy-seq
+     (let [s (seq coll)]
+       (if s
+         (if (chunked-seq? s)
+           (let [c (chunk-first s)
+                 b (chunk-buffer (count c))]
+             ((fn [i]
+                (when (< i (count c))
+                  (chunk-append b (f (nth c i)))
+                  (recur (+ i 1))))
+              0)
+             (chunk-cons (chunk b) (map f (chunk-rest s))))
+           (cons (f (first s)) (map f (rest s))))
+         ())))))
 
 (defn vec
   [coll]
   (apply vector coll))
 
-(defn reader [form]
-  (let [walk (fn [w f obj]
-               (let [rec (fn [x] (w w f x))]
-                 (f (cond (list? obj) (apply list (map rec obj))
-                          (vector? obj) (apply vector (map rec obj))
-                          :else obj))))
-        l (fn [coll]
-            (if (= (symbol "#") (first coll))
-              (let [sym (gensym)
-                    rep (fn [x]
-                           (if (= '% x)
-                             sym
-                             x))]
-                (list 'fn [sym] (walk walk rep (second coll))))
-              coll))
-        f (fn [obj]
-            (if (list? obj)
-              (l obj)
-              obj))]
-    (walk walk f form)))
-
 (defmacro loop
   [bindings & body]
   (let [pairs (partition 2 bindings)
@@ -229,16 +217,20 @@
                (reverse xs)
                ys)))))
 
-(defn conj [xs x]
-  (cond (vector? xs) (vec (concat xs [x]))
-        (map? xs) (assoc xs (first x) (second x))
-        :else (cons x xs)))
-
-(defn into [base addends]
-  (reduce conj base addends))
-
-(defn subs [s start end]
-  (reduce str "" (take (- end start) (drop start s))))
+(defn into
+  ([base addends]
+   (if (or (vector? base) (map? base))
+     (with-meta (persistent! (reduce* conj! (transient base) addends))
+                (meta base))
+     (reduce* conj base addends)))
+  ([base xform addends]
+   (if (or (vector? base) (map? base))
+     (with-meta (persistent! (transduce xform conj! (transient base) addends))
+                (meta base))
+     (transduce xform conj base addends))))
+
+(defn mapv [f coll]
+  (persistent! (reduce* (fn [v x] (conj! v (f x))) (transient []) coll)))
 
 (defmacro qquote [& args]
   (let [gensyms (atom {})
@@ -287,13 +279,6 @@
     coll
     (recur (next coll) (- n 1))))
 
-(defn nth
-  [coll n not-found]
-  (cond
-    (= 0 n) (first coll)
-    (= () coll) not-found
-    :else (recur (next coll) (- n 1) not-found)))
-
 (defn every?
   [f coll]
   (loop [xs coll]
@@ -302,10 +287,6 @@
      (f (first xs)) (recur (rest xs))
      :else false)))
 
-(defn inc
-  [n]
-  (+ 1 n))
-
 (def key first)
 (def val second)
 
@@ -348,18 +329,22 @@
     (cons x (apply list* xs))
     x))
 
-(defmacro fn-destructure
-  [args & body]
+(defn destructure-arity
+  [args body]
   (if (every? symbol? args)
-    (cons 'fn* (cons args body))
+    (cons args body)
     (let [orig-args (vec (map (fn [_] (gensym)) args))
           zip (fn [rec xs ys]
                 (if (seq xs)
                   (list* (first xs) (first ys) (rec rec (rest xs) (rest ys)))
                   ()))]
-      `(fn* ~orig-args
-            (let ~(destructure (zip zip args orig-args))
-              ~(cons 'do body))))))
+      (list orig-args
+            `(let ~(destructure (zip zip args orig-args))
+               ~(cons 'do body))))))
+
+(defmacro fn-destructure
+  [args & body]
+  (cons 'fn* (destructure-arity args body)))
 
 (defmacro fn-with-single-arity
   [& args]
@@ -369,19 +354,19 @@
                            (apply (deref storage#) args))]
        (swap! storage#
               (fn* [_]
-                ~(cons 'fn-destructure (rest args)))))
+                ~(cons 'fn (rest args)))))
     (cons 'fn-destructure args)))
 
 (defn zipmap
   [keys vals]
-  (loop [acc {}
+  (loop [acc (transient {})
          keys (seq keys)
          vals (seq vals)]
     (if (and keys vals)
-      (recur (assoc acc (first keys) (first vals))
+      (recur (assoc! acc (first keys) (first vals))
              (next keys)
              (next vals))
-      acc)))
+      (persistent! acc))))
 
 (defmacro fn
   [& args]
@@ -391,16 +376,10 @@
     (every? list? args)
     (if (= 1 (count args))
       (cons 'fn (first args))
-      (let [arities (map (comp count first) args)
-            fns (map (fn [tail] (cons 'fn tail)) args)]
-        `(let [variants# ~(zipmap arities fns)]
-           (fn-with-single-arity
-             [& coll]
-             (let [nargs (count coll)
-                   f (get variants# nargs)]
-               (if f
-                 (apply f coll)
-                 (throw (str "Incorrect arity: " nargs))))))))
+      (cons 'fn* (apply list
+                        (map (fn [arity]
+                               (destructure-arity (first arity) (rest arity)))
+                             args))))
     :else (throw "Unsupported fn form")))
 
 (defn gensym
@@ -471,9 +450,14 @@
           true
           coll))
 
+(def *flush-on-newline* true)
+
+;; Lines are flushed only to terminals, where someone may wait for them.
 (defn println [& coll]
   (apply print coll)
-  (print "\n"))
+  (print1 "\n")
+  (when (and *flush-on-newline* (tty? *out*))
+    (flush)))
 
 (defprotocol Pr
   (pr* [x]))
@@ -553,29 +537,61 @@
            nil))
       (cons 'do forms))))
 
-(defn filter [f coll]
-  (if (seq coll)
-    (lazy-seq
-      (let [[c & cs] coll]
-        (if (f c)
-          (cons c (filter f cs))
-          (filter f cs))))
-    ()))
+(defn filter
+  ([f]
+   (fn [rf]
+     (fn
+       ([] (rf))
+       ([result] (rf result))
+       ([result input]
+        (if (f input)
+          (rf result input)
+          result)))))
+  ([f coll]
+   (if (seq coll)
+     (lazy-seq
+       (let [s (seq coll)]
+         (if (chunked-seq? s)
+           (let [c (chunk-first s)
+                 b (chunk-buffer (count c))]
+             (loop [i 0]
+               (when (< i (count c))
+                 (let [x (nth c i)]
+                   (when (f x)
+                     (chunk-append b x)))
+                 (recur (inc i))))
+             (chunk-cons (chunk b) (filter f (chunk-rest s))))
+           (let [[c & cs] s]
+             (if (f c)
+               (cons c (filter f cs))
+               (filter f cs))))))
+     ())))
 
 (defn complement [f]
   (fn [& args] (not (apply f args))))
 
-(defn remove [f coll]
-  (filter (complement f) coll))
-
-(defn take-while [f coll]
-  (if (seq coll)
-    (lazy-seq
-      (let [[c & cs] coll]
-        (if (f c)
-          (cons c (take-while f cs))
-          ())))
-    ()))
+(defn remove
+  ([f] (filter (complement f)))
+  ([f coll] (filter (complement f) coll)))
+
+(defn take-while
+  ([f]
+   (fn [rf]
+     (fn
+       ([] (rf))
+       ([result] (rf result))
+       ([result input]
+        (if (f input)
+          (rf result input)
+          (reduced result))))))
+  ([f coll]
+   (if (seq coll)
+     (lazy-seq
+       (let [[c & cs] coll]
+         (if (f c)
+           (cons c (take-while f cs))
+           ())))
+     ())))
 
 (defn drop-while [f coll]
   (if (seq coll)
@@ -591,15 +607,118 @@
     (when (seq xs)
       (cons x (butlast xs)))))
 
-(defn pop [coll]
-  (if (vector? coll)
-    (butlast coll)
-    (next coll)))
-
-(defn peek [coll]
-  (if (vector? coll)
-    (last coll)
-    (first coll)))
+(defn unreduced [x]
+  (if (reduced? x) (deref x) x))
+
+(defn ensure-reduced [x]
+  (if (reduced? x) x (reduced x)))
+
+(defn preserving-reduced [rf]
+  (fn [acc x]
+    (let [ret (rf acc x)]
+      (if (reduced? ret)
+        (reduced ret)
+        ret))))
+
+(defn completing
+  ([f] (completing f identity))
+  ([f cf]
+   (fn
+     ([] (f))
+     ([x] (cf x))
+     ([x y] (f x y)))))
+
+(defn transduce
+  ([xform f coll]
+   (transduce xform f (f) coll))
+  ([xform f init coll]
+   (let [rf (xform f)]
+     (rf (reduce* rf init coll)))))
+
+(defn cat [rf]
+  (let [rrf (preserving-reduced rf)]
+    (fn
+      ([] (rf))
+      ([result] (rf result))
+      ([result input] (reduce* rrf result input)))))
+
+(defn mapcat
+  ([f] (comp (map f) cat))
+  ([f coll]
+   (lazy-seq
+     (let [s (seq coll)]
+       (if s
+         (concat (f (first s)) (mapcat f (rest s)))
+         ())))))
+
+(defn partition-all
+  ([n]
+   (fn [rf]
+     (let [buf (atom [])]
+       (fn
+         ([] (rf))
+         ([result]
+          (let [v (deref buf)
+                result (if (seq v)
+                         (do (reset! buf [])
+                             (unreduced (rf result v)))
+                         result)]
+            (rf result)))
+         ([result input]
+          (let [v (conj (deref buf) input)]
+            (if (= n (count v))
+              (do (reset! buf [])
+                  (rf result v))
+              (do (reset! buf v)
+                  result))))))))
+  ([n coll]
+   (lazy-seq
+     (when (seq coll)
+       (cons (take n coll)
+             (partition-all n (drop n coll)))))))
+
+(defn sequence
+  ([coll] (or (seq coll) ()))
+  ([xform coll]
+   ;; Inputs are stepped one at a time and outputs of each step, collected
+   ;; in one reused buffer, are put in front of a lazy rest, so an infinite
+   ;; coll can be consumed partially.
+   (let [buf (chunk-buffer 32)
+         rf (xform (fn ([acc] acc) ([acc x] (chunk-append buf x) acc)))
+         step (fn step [s]
+                (lazy-seq
+                  (loop [s s]
+                    (if (seq s)
+                      (let [ret (rf nil (first s))]
+                        (cond
+                          (reduced? ret) (do (rf (deref ret))
+                                             (chunk-cons (chunk buf) ()))
+                          (= 0 (count buf)) (recur (rest s))
+                          :else (chunk-cons (chunk buf) (step (rest s)))))
+                      (do (rf nil)
+                          (chunk-cons (chunk buf) ()))))))]
+     (step coll))))
+
+(defn eduction [& xforms-and-coll]
+  (let [xform (apply comp (butlast xforms-and-coll))
+        coll (last xforms-and-coll)]
+    (eduction* xform coll (fn [] (sequence xform coll)))))
+
+(defn dedupe
+  ([]
+   (fn [rf]
+     (let [none (gensym)
+           prior (atom none)]
+       (fn
+         ([] (rf))
+         ([result] (rf result))
+         ([result input]
+          (let [p (deref prior)]
+            (reset! prior input)
+            (if (= p input)
+              result
+              (rf result input))))))))
+  ([coll] (sequence (dedupe) coll)))
 
 (defmacro when-let
   [bindings & exprs]
@@ -2,6 +2,7 @@ import builtins
 import space
 
 core_ns = "psota.core"
+string_ns = "clojure.string"
 current_ns = "*ns*"
 
 class Bindings:
@@ -12,9 +13,16 @@ class Bindings:
         for (sym, val) in builtins.core:
             var = space.W_Var(core_ns, sym, val)
             core_mapping[st.get_sym_id(sym)] = var
-        self.vars = {core_ns: core_mapping}
+        string_mapping = {}
+        string_mapping.update(core_mapping)
+        for (sym, val) in builtins.string:
+            var = space.W_Var(string_ns, sym, val)
+            string_mapping[st.get_sym_id(sym)] = var
+        self.vars = {core_ns: core_mapping, string_ns: string_mapping}
         self.ns = core_ns
         self.st = st
+        # Changes whenever a symbol may refer to another var, but not when a
+        # var gets a new value, so lookups of vars stay valid across defs.
         self.version = 0
         self.set(st.add_sym(current_ns), space.W_String(core_ns))
 
@@ -24,15 +32,28 @@ class Bindings:
             vars = {}
             vars.update(self.vars[core_ns])
             self.vars[ns] = vars
+        self.version += 1
         self.set(self.st.get_sym_id(current_ns), space.W_String(ns))
 
     def get(self, key):
-        w_var = self.vars[self.ns].get(key, None)
+        w_var = self.var(key)
         if w_var is not None:
             return w_var.w_val
-        return self._qualified_sym(key)
 
-    def _qualified_sym(self, key):
+    def var(self, key):
+        "Returns a var a symbol refers to in the current ns or None."
+        return self.var_in(self.ns, key)
+
+    def var_in(self, ns, key):
+        "Returns a var a symbol refers to in a given ns or None."
+        vars = self.vars.get(ns, None)
+        if vars is not None:
+            w_var = vars.get(key, None)
+            if w_var is not None:
+                return w_var
+        return self._qualified_var(key)
+
+    def _qualified_var(self, key):
         sym = self.st.get_sym(key)
         idx = sym.find("/") + 1
         if idx <= 1:
@@ -45,9 +66,7 @@ class Bindings:
         sym_id = self.st.get_sym_id(sym[idx:])
         if sym_id < 0:
             return
-        w_var = ns.get(sym_id, None)
-        if w_var is not None:
-            return w_var.w_val
+        return ns.get(sym_id, None)
 
     def get_var(self, sym):
         assert isinstance(sym, str)
@@ -55,12 +74,14 @@ class Bindings:
         return self.vars[self.ns][key]
 
     def set(self, key, val):
-        var = space.W_Var(self.ns, self.st.get_sym(key), val)
-        self.vars[self.ns][key] = var
+        vars = self.vars[self.ns]
+        w_var = vars.get(key, None)
+        if w_var is not None and w_var.ns == self.ns:
+            w_var.set_value(val)
+            w_var.set_meta(space.w_nil)
+            return
+        vars[key] = space.W_Var(self.ns, self.st.get_sym(key), val)
         self.version += 1
 
     def alter_var(self, w_var, w_val):
-        w_new_var = w_var.altered(w_val)
-        key = self.st.get_sym_id(w_var.sym)
-        self.vars[self.ns][key] = w_new_var
-        self.version += 1
+        w_var.set_value(w_val)
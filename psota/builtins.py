@@ -1,7 +1,8 @@
 import space
 import eval
 import os
-from rpython.rlib import rfile
+from rpython.rlib import rfile, rstring
+from rpython.rlib.rstring import StringBuilder
 
 def arity(n):
     def wrap(f):
@@ -12,42 +13,164 @@ def arity(n):
         return wrapped
     return wrap
 
+stdout = space.W_Writer(1)
+stderr = space.W_Writer(2)
+
+def flush_all():
+    """Flushes the standard streams, as done at exit, and tells whether it
+    succeeded. Errors aren't raised, so they cannot hide another exception.
+    """
+    flushed = True
+    for stream in [stdout, stderr]:
+        try:
+            stream.flush()
+        except OSError:
+            flushed = False
+    return flushed
+
+def current_out(ctx):
+    "Returns the writer *out* refers to."
+    w_out = eval.lookup_in_ctx(ctx, ctx.st().get_sym_id("*out*"))
+    if w_out is None:
+        return stdout
+    return space.cast(w_out, space.W_Writer)
+
 class Print1(space.W_BIF):
-    @arity(1)
-    def invoke(self, args, *_):
-        os.write(1, args[0].to_str())
+    "Writes a value to *out* or to a given stream."
 
-class Eq(space.W_BIF):
-    @arity(2)
-    def invoke(self, args, *_):
-        if args[0].equals(args[1]):
-            return space.w_true
-        else:
-            return space.w_false
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 1:
+            return self.invoke1(args[0], ctx)
+        elif argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        raise space.ArityException(argc)
 
-def int_binary_op(op):
-    @arity(2)
-    def f(self, args, *_):
-        a = space.cast(args[0], space.W_Int)
-        b = space.cast(args[1], space.W_Int)
-        return space.W_Int(op(a.val, b.val))
+    def invoke1(self, w_obj, ctx):
+        current_out(ctx).write(w_obj.to_str())
+        return space.w_nil
+
+    def invoke2(self, w_obj, w_out, _):
+        space.cast(w_out, space.W_Writer).write(w_obj.to_str())
+        return space.w_nil
+
+class Flush(space.W_BIF):
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 0:
+            return self.invoke0(ctx)
+        elif argc == 1:
+            return self.invoke1(args[0], ctx)
+        raise space.ArityException(argc)
+
+    def invoke0(self, ctx):
+        current_out(ctx).flush()
+        return space.w_nil
+
+    def invoke1(self, w_out, _):
+        space.cast(w_out, space.W_Writer).flush()
+        return space.w_nil
+
+def fixed_arity(n):
+    "Returns an invoke of a builtin taking n args through its invoke<n>."
+    @arity(n)
+    def f(self, args, ctx):
+        if n == 0:
+            return self.invoke0(ctx)
+        elif n == 1:
+            return self.invoke1(args[0], ctx)
+        elif n == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        else:
+            return self.invoke3(args[0], args[1], args[2], ctx)
     return f
 
-class Mult(space.W_BIF):
-    invoke = int_binary_op(lambda a, b: a * b)
+def _int(w_val):
+    return space.cast(w_val, space.W_Int).val
+
+def int_fold(op, unit):
+    "Returns a base of builtins folding their args with op."
+    class IntFold(space.W_BIF):
+        def invoke(self, args, ctx):
+            if len(args) == 2:
+                return self.invoke2(args[0], args[1], ctx)
+            elif len(args) == 1:
+                return self.invoke1(args[0], ctx)
+            elif len(args) == 0:
+                if unit is None:
+                    raise space.ArityException(0)
+                return space.W_Int(unit)
+            acc = _int(args[0])
+            for idx in range(1, len(args)):
+                acc = op(acc, _int(args[idx]))
+            return space.W_Int(acc)
+
+        def invoke1(self, w_a, _):
+            return space.cast(w_a, space.W_Int)
+
+        def invoke2(self, w_a, w_b, _):
+            return space.W_Int(op(_int(w_a), _int(w_b)))
+    return IntFold
+
+def comparison(test):
+    "Returns a base of builtins testing every pair of consecutive args."
+    class Comparison(space.W_BIF):
+        def invoke(self, args, ctx):
+            if len(args) == 2:
+                return self.invoke2(args[0], args[1], ctx)
+            elif len(args) == 0:
+                raise space.ArityException(0)
+            for idx in range(1, len(args)):
+                if not test(args[idx - 1], args[idx]):
+                    return space.w_false
+            return space.w_true
 
-class Add(space.W_BIF):
-    invoke = int_binary_op(lambda a, b: a + b)
+        def invoke2(self, w_a, w_b, _):
+            return space.wrap(test(w_a, w_b))
+    return Comparison
 
-class Subtract(space.W_BIF):
-    invoke = int_binary_op(lambda a, b: a - b)
+class Eq(comparison(lambda w_a, w_b: w_a.equals(w_b))):
+    pass
 
-class LT(space.W_BIF):
-    @arity(2)
-    def invoke(self, args, *_):
-        a = space.cast(args[0], space.W_Int)
-        b = space.cast(args[1], space.W_Int)
-        return space.wrap(a.val < b.val)
+class Add(int_fold(lambda a, b: a + b, 0)):
+    pass
+
+class Mult(int_fold(lambda a, b: a * b, 1)):
+    pass
+
+class Subtract(int_fold(lambda a, b: a - b, None)):
+    def invoke1(self, w_a, _):
+        return space.W_Int(-_int(w_a))
+
+class Max(int_fold(lambda a, b: a if a >= b else b, None)):
+    pass
+
+class Min(int_fold(lambda a, b: a if a <= b else b, None)):
+    pass
+
+class LT(comparison(lambda w_a, w_b: _int(w_a) < _int(w_b))):
+    pass
+
+class GT(comparison(lambda w_a, w_b: _int(w_a) > _int(w_b))):
+    pass
+
+class LE(comparison(lambda w_a, w_b: _int(w_a) <= _int(w_b))):
+    pass
+
+class GE(comparison(lambda w_a, w_b: _int(w_a) >= _int(w_b))):
+    pass
+
+class Inc(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_a, _):
+        return space.W_Int(_int(w_a) + 1)
+
+class Dec(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_a, _):
+        return space.W_Int(_int(w_a) - 1)
 
 class List(space.W_BIF):
     def invoke(self, args, *_):
@@ -55,26 +178,28 @@ class List(space.W_BIF):
 
 class Vector(space.W_BIF):
     def invoke(self, args, *_):
-        return space.W_Vector(args)
+        return space.vector(args)
 
 class First(space.W_BIF):
-    @arity(1)
-    def invoke(self, args, *_):
-        return args[0].first()
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_coll, _):
+        return w_coll.first()
 
 class Rest(space.W_BIF):
-    @arity(1)
-    def invoke(self, args, *_):
-        return args[0].rest()
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_coll, _):
+        return w_coll.rest()
 
 class Cons(space.W_BIF):
-    @arity(2)
-    def invoke(self, args, *_):
-        head, tail = args
-        if tail is space.w_nil:
-            return space.W_List(args[0], space.w_empty_list)
+    invoke = fixed_arity(2)
+
+    def invoke2(self, w_head, w_tail, _):
+        if w_tail is space.w_nil:
+            return space.W_List(w_head, space.w_empty_list)
         else:
-            return space.W_List(args[0], args[1])
+            return space.W_List(w_head, w_tail)
 
 class Gensym(space.W_BIF):
     def __init__(self):
@@ -85,33 +210,193 @@ class Gensym(space.W_BIF):
         val = args[0].to_str() + str(self.counter)
         ctx.st().add_sym(val)
         self.counter += 1
-        return space.W_Sym(val)
+        return space.symbol(val)
+
+gensym = Gensym()
 
 class ArrayMap(space.W_BIF):
     def invoke(self, args, *_):
-        return space.W_ArrayMap(args)
+        return space.array_map(args)
 
 class HashMap(space.W_BIF):
     def invoke(self, args, *_):
-        return space.W_HashMap(args)
+        return space.hash_map(args)
 
 class Get(space.W_BIF):
-    def invoke(self, args, *_):
+    def invoke(self, args, ctx):
         argc = len(args)
-        if argc not in [2, 3]:
-            raise space.ArityException(len(args))
-        map = args[0]
-        if map == space.w_nil:
+        if argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        elif argc == 3:
+            return self.invoke3(args[0], args[1], args[2], ctx)
+        raise space.ArityException(argc)
+
+    def invoke2(self, w_map, w_key, ctx):
+        return self.invoke3(w_map, w_key, space.w_nil, ctx)
+
+    def invoke3(self, w_map, w_key, w_not_found, _):
+        if w_map == space.w_nil:
             return space.w_nil
-        elif argc == 2:
-            return args[0].get(args[1], space.w_nil)
-        else:
-            return args[0].get(args[1], args[2])
+        return w_map.get(w_key, w_not_found)
 
 class Assoc(space.W_BIF):
-    @arity(3)
+    invoke = fixed_arity(3)
+
+    def invoke3(self, w_map, w_key, w_val, _):
+        return w_map.assoc(w_key, w_val)
+
+class Conj(space.W_BIF):
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 0:
+            return space.w_empty_vector
+        elif argc == 1:
+            return args[0]
+        elif argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        raise space.ArityException(argc)
+
+    def invoke2(self, w_coll, w_val, _):
+        return w_coll.conj(w_val)
+
+class Pop(space.W_BIF):
+    @arity(1)
+    def invoke(self, args, *_):
+        return args[0].pop()
+
+class Peek(space.W_BIF):
+    @arity(1)
     def invoke(self, args, *_):
-        return args[0].assoc(args[1], args[2])
+        return args[0].peek()
+
+class Count(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_coll, _):
+        return space.W_Int(w_coll.count())
+
+class Nth(space.W_BIF):
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        elif argc == 3:
+            return self.invoke3(args[0], args[1], args[2], ctx)
+        raise space.ArityException(argc)
+
+    def invoke2(self, w_coll, w_idx, _):
+        return nth(w_coll, w_idx, None)
+
+    def invoke3(self, w_coll, w_idx, w_not_found, _):
+        return nth(w_coll, w_idx, w_not_found)
+
+def nth(w_coll, w_idx, w_not_found):
+    idx = space.cast(w_idx, space.W_Int).val
+    w_val = w_coll.nth(idx, w_not_found)
+    if w_val is None:
+        raise space.IndexOutOfBoundsException(idx)
+    return w_val
+
+class Seq(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_coll, _):
+        return w_coll.seq()
+
+class ChunkBuffer(space.W_BIF):
+    @arity(1)
+    def invoke(self, args, *_):
+        return space.W_ChunkBuffer()
+
+class ChunkAppend(space.W_BIF):
+    invoke = fixed_arity(2)
+
+    def invoke2(self, w_buffer, w_val, _):
+        space.cast(w_buffer, space.W_ChunkBuffer).append(w_val)
+
+class Chunk(space.W_BIF):
+    @arity(1)
+    def invoke(self, args, *_):
+        return space.cast(args[0], space.W_ChunkBuffer).chunk()
+
+class ChunkFirst(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_coll, _):
+        return w_coll.chunk_first()
+
+class ChunkRest(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_coll, _):
+        return w_coll.chunk_rest()
+
+class ChunkNext(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_coll, _):
+        return w_coll.chunk_rest().seq()
+
+class ChunkCons(space.W_BIF):
+    @arity(2)
+    def invoke(self, args, *_):
+        w_chunk = space.cast(args[0], space.W_ArrayChunk)
+        if w_chunk.count() == 0:
+            return args[1]
+        return space.W_ChunkedCons(w_chunk, args[1])
+
+class ChunkedSeqP(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_arg, _):
+        return space.wrap(isinstance(w_arg, space.W_ChunkedSeq) or
+                isinstance(w_arg, space.W_ChunkedCons))
+
+class UncheckedInc(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_a, _):
+        return space.W_Int(_int(w_a) + 1)
+
+class Transient(space.W_BIF):
+    @arity(1)
+    def invoke(self, args, *_):
+        return args[0].transient()
+
+class PersistentBang(space.W_BIF):
+    @arity(1)
+    def invoke(self, args, *_):
+        return args[0].persistent()
+
+class ConjBang(space.W_BIF):
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 0:
+            return space.w_empty_vector.transient()
+        elif argc == 1:
+            return args[0]
+        elif argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        raise space.ArityException(argc)
+
+    def invoke2(self, w_coll, w_val, _):
+        return w_coll.conj_bang(w_val)
+
+class AssocBang(space.W_BIF):
+    invoke = fixed_arity(3)
+
+    def invoke3(self, w_coll, w_key, w_val, _):
+        return w_coll.assoc_bang(w_key, w_val)
+
+class DissocBang(space.W_BIF):
+    @arity(2)
+    def invoke(self, args, *_):
+        return args[0].dissoc_bang(args[1])
+
+class PopBang(space.W_BIF):
+    @arity(1)
+    def invoke(self, args, *_):
+        return args[0].pop_bang()
 
 class Dissoc(space.W_BIF):
     @arity(2)
@@ -164,11 +449,11 @@ class ReadString(space.W_BIF):
     @arity(1)
     def invoke(self, args, ctx):
         w_str = space.cast(args[0], space.W_String)
-        from parser import parse
-        parsed = parse(w_str.val)
-        if len(parsed) == 0:
+        from parser import string_reader
+        w_form = string_reader(w_str.val).read()
+        if w_form is None:
             raise space.ParsingException("EOF")
-        return eval.read(ctx, parsed[0])
+        return eval.read(ctx, w_form)
 
 class Class(space.W_BIF):
     @arity(1)
@@ -190,6 +475,15 @@ class LazySeq(space.W_BIF):
         def deliver(self):
             return eval.invoke_fn(self.w_fn, [], self.ctx)
 
+class Eduction(space.W_BIF):
+    """(eduction* xform coll seq-fn) makes an eduction whose seq is what
+    seq-fn returns."""
+
+    @arity(3)
+    def invoke(self, args, ctx):
+        w_fn = space.cast(args[2], space.W_Fun)
+        return space.W_Eduction(LazySeq.Promise(w_fn, ctx), args[0], args[1])
+
 def type_predicate(type):
     @arity(1)
     def f(self, args, *_):
@@ -212,11 +506,129 @@ class MapP(space.W_BIF):
 class ListP(space.W_BIF):
     invoke = type_predicate(space.W_List)
 
-class Deref(space.W_BIF):
+def call1(w_fn, w_a, ctx):
+    "Invokes any invokable value with one arg, not only a fn."
+    if isinstance(w_fn, space.W_Fun):
+        return eval.invoke_fn(w_fn, [w_a], ctx)
+    w_ret = w_fn.invoke1(w_a, ctx)
+    if w_ret is None:
+        return space.w_nil
+    return w_ret
+
+def call2(w_fn, w_a, w_b, ctx):
+    "Invokes any invokable value with two args, not only a fn."
+    if isinstance(w_fn, space.W_Fun):
+        return eval.invoke_fn(w_fn, [w_a, w_b], ctx)
+    w_ret = w_fn.invoke2(w_a, w_b, ctx)
+    if w_ret is None:
+        return space.w_nil
+    return w_ret
+
+def _reduce_vector(w_fn, w_acc, w_vec, idx, ctx):
+    while idx < w_vec.cnt:
+        leaf = w_vec.array_for(idx)
+        offset = w_vec.offset(idx)
+        while offset < len(leaf):
+            w_acc = call2(w_fn, w_acc, leaf[offset], ctx)
+            if isinstance(w_acc, space.W_Reduced):
+                return w_acc.val
+            offset += 1
+            idx += 1
+    return w_acc
+
+def _reduce_string(w_fn, w_acc, val, idx, ctx):
+    while idx < len(val):
+        w_acc = call2(w_fn, w_acc, space.W_Char(ord(val[idx])), ctx)
+        if isinstance(w_acc, space.W_Reduced):
+            return w_acc.val
+        idx += 1
+    return w_acc
+
+class _Completing(space.W_BIF):
+    "A reducing fn with an identity completion arity, as completing makes."
+
+    def __init__(self, w_fn):
+        self.w_fn = w_fn
+
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 1:
+            return self.invoke1(args[0], ctx)
+        elif argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        raise space.ArityException(argc)
+
+    def invoke1(self, w_acc, _):
+        return w_acc
+
+    def invoke2(self, w_acc, w_val, ctx):
+        return call2(self.w_fn, w_acc, w_val, ctx)
+
+def _reduce_eduction(w_fn, w_acc, w_ed, ctx):
+    "Transduces the source of an eduction, like transduce does."
+    w_rf = call1(w_ed.w_xform, _Completing(w_fn), ctx)
+    return call1(w_rf, reduce_coll(w_rf, w_acc, w_ed.w_coll, ctx), ctx)
+
+def reduce_coll(w_fn, w_acc, w_coll, ctx):
+    """Reduces a collection, walking storage of vectors, maps and strings
+    directly instead of calling rest on them."""
+    while True:
+        if isinstance(w_coll, space.W_Eduction):
+            return _reduce_eduction(w_fn, w_acc, w_coll, ctx)
+        elif isinstance(w_coll, space.W_List) and \
+                w_coll is not space.w_empty_list:
+            w_acc = call2(w_fn, w_acc, w_coll.head, ctx)
+            if isinstance(w_acc, space.W_Reduced):
+                return w_acc.val
+            w_coll = w_coll.tail
+        elif isinstance(w_coll, space.W_Vector):
+            return _reduce_vector(w_fn, w_acc, w_coll, w_coll.start, ctx)
+        elif isinstance(w_coll, space.W_ChunkedSeq):
+            return _reduce_vector(w_fn, w_acc, w_coll.w_vec, w_coll.idx, ctx)
+        elif isinstance(w_coll, space.W_Map):
+            kvs_w = w_coll.elems()
+            idx = 0
+            while idx < len(kvs_w):
+                w_entry = space.vector([kvs_w[idx], kvs_w[idx + 1]])
+                w_acc = call2(w_fn, w_acc, w_entry, ctx)
+                if isinstance(w_acc, space.W_Reduced):
+                    return w_acc.val
+                idx += 2
+            return w_acc
+        elif isinstance(w_coll, space.W_String):
+            return _reduce_string(w_fn, w_acc, w_coll.val, 0, ctx)
+        elif isinstance(w_coll, space.W_StringSeq):
+            return _reduce_string(w_fn, w_acc, w_coll.val, w_coll.idx, ctx)
+        else:
+            w_seq = w_coll.seq()
+            if w_seq is space.w_nil:
+                return w_acc
+            if w_seq is not w_coll:
+                w_coll = w_seq
+                continue
+            w_acc = call2(w_fn, w_acc, w_seq.first(), ctx)
+            if isinstance(w_acc, space.W_Reduced):
+                return w_acc.val
+            w_coll = w_seq.rest()
+
+class Reduce(space.W_BIF):
+    @arity(3)
+    def invoke(self, args, ctx):
+        return reduce_coll(args[0], args[1], args[2], ctx)
+
+class Reduced(space.W_BIF):
     @arity(1)
     def invoke(self, args, *_):
-        w_val = args[0]
-        return w_val.deref()
+        return space.W_Reduced(args[0])
+
+class ReducedP(space.W_BIF):
+    invoke = type_predicate(space.W_Reduced)
+
+class Deref(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_ref, _):
+        return w_ref.deref()
 
 class Atom(space.W_BIF):
     @arity(1)
@@ -245,9 +657,17 @@ class _LazyFile:
 
 stdin = _LazyFile("/dev/stdin")
 
+class TtyP(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_out, _):
+        return space.wrap(space.cast(w_out, space.W_Writer).isatty())
+
 class Getline(space.W_BIF):
     @arity(0)
-    def invoke(self, *_):
+    def invoke(self, args, ctx):
+        # A prompt written before reading has to be seen.
+        current_out(ctx).flush()
         return space.wrap(str(stdin.get().readline()))
 
 class Keyword(space.W_BIF):
@@ -255,7 +675,7 @@ class Keyword(space.W_BIF):
     def invoke(self, args, *_):
         w_obj = args[0]
         if isinstance(w_obj, space.W_String):
-            return space.W_Keyword(w_obj.val)
+            return space.keyword(w_obj.val)
         return space.w_nil
 
 class Symbol(space.W_BIF):
@@ -263,18 +683,160 @@ class Symbol(space.W_BIF):
     def invoke(self, args, ctx):
         w_obj = args[0]
         if isinstance(w_obj, space.W_String):
-            return space.W_Sym(w_obj.val)
+            return space.symbol(w_obj.val)
         return space.w_nil
 
 class Str(space.W_BIF):
     def invoke(self, args, *_):
-        acc = ""
+        builder = StringBuilder()
         for w_arg in args:
-            if isinstance(w_arg, space.W_String):
-                acc += w_arg.val
-            else:
-                acc += w_arg.to_str()
-        return space.wrap(acc)
+            builder.append(w_arg.to_str())
+        return space.wrap(builder.build())
+
+    def invoke1(self, w_a, _):
+        if isinstance(w_a, space.W_String):
+            return w_a
+        return space.wrap(w_a.to_str())
+
+    def invoke2(self, w_a, w_b, _):
+        return space.wrap(w_a.to_str() + w_b.to_str())
+
+def _str(w_val):
+    return space.cast(w_val, space.W_String).val
+
+def _text(w_val):
+    "Returns a string or a char as a string."
+    if isinstance(w_val, space.W_Char):
+        return w_val.to_str()
+    return _str(w_val)
+
+def substring(s, start, end):
+    if start < 0 or start > len(s):
+        raise space.IndexOutOfBoundsException(start)
+    if end < start or end > len(s):
+        raise space.IndexOutOfBoundsException(end)
+    assert start >= 0 and end >= 0
+    return space.W_String(s[start:end])
+
+class Subs(space.W_BIF):
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        elif argc == 3:
+            return self.invoke3(args[0], args[1], args[2], ctx)
+        raise space.ArityException(argc)
+
+    def invoke2(self, w_s, w_start, _):
+        s = _str(w_s)
+        return substring(s, _int(w_start), len(s))
+
+    def invoke3(self, w_s, w_start, w_end, _):
+        return substring(_str(w_s), _int(w_start), _int(w_end))
+
+def join(sep, w_coll):
+    builder = StringBuilder()
+    w_seq = w_coll.seq()
+    first = True
+    while w_seq is not space.w_nil:
+        if not first:
+            builder.append(sep)
+        first = False
+        builder.append(w_seq.first().to_str())
+        w_seq = w_seq.rest().seq()
+    return space.W_String(builder.build())
+
+class Join(space.W_BIF):
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 1:
+            return self.invoke1(args[0], ctx)
+        elif argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        raise space.ArityException(argc)
+
+    def invoke1(self, w_coll, _):
+        return join("", w_coll)
+
+    def invoke2(self, w_sep, w_coll, _):
+        return join(w_sep.to_str(), w_coll)
+
+class Split(space.W_BIF):
+    invoke = fixed_arity(2)
+
+    def invoke2(self, w_s, w_sep, _):
+        s = _str(w_s)
+        sep = _text(w_sep)
+        if s == "":
+            return space.vector([w_s])
+        if sep == "":
+            parts = [s[idx:idx + 1] for idx in range(len(s))]
+        else:
+            parts = s.split(sep)
+        # Trailing empty strings are dropped, as by clojure.string/split.
+        end = len(parts)
+        while end > 0 and parts[end - 1] == "":
+            end -= 1
+        parts_w = []
+        for idx in range(end):
+            parts_w.append(space.wrap(parts[idx]))
+        return space.vector(parts_w)
+
+class IndexOf(space.W_BIF):
+    def invoke(self, args, ctx):
+        argc = len(args)
+        if argc == 2:
+            return self.invoke2(args[0], args[1], ctx)
+        elif argc == 3:
+            return self.invoke3(args[0], args[1], args[2], ctx)
+        raise space.ArityException(argc)
+
+    def invoke2(self, w_s, w_val, _):
+        return index_of(_str(w_s), _text(w_val), 0)
+
+    def invoke3(self, w_s, w_val, w_from, _):
+        return index_of(_str(w_s), _text(w_val), _int(w_from))
+
+def index_of(s, sub, start):
+    if start < 0:
+        start = 0
+    if start > len(s):
+        return space.w_nil
+    idx = s.find(sub, start)
+    if idx < 0:
+        return space.w_nil
+    return space.W_Int(idx)
+
+class StartsWithP(space.W_BIF):
+    invoke = fixed_arity(2)
+
+    def invoke2(self, w_s, w_prefix, _):
+        return space.wrap(_str(w_s).startswith(_text(w_prefix)))
+
+class Replace(space.W_BIF):
+    invoke = fixed_arity(3)
+
+    def invoke3(self, w_s, w_match, w_replacement, _):
+        return space.W_String(rstring.replace(_str(w_s), _text(w_match),
+                _text(w_replacement)))
+
+class UpperCase(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_s, _):
+        return space.W_String(_str(w_s).upper())
+
+class LowerCase(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_s, _):
+        return space.W_String(_str(w_s).lower())
+
+class Trim(space.W_BIF):
+    invoke = fixed_arity(1)
+
+    def invoke1(self, w_s, _):
+        return space.W_String(_str(w_s).strip())
 
 class Hash(space.W_BIF):
     @arity(1)
@@ -296,18 +858,9 @@ class InNs(space.W_BIF):
 class Load(space.W_BIF):
     @arity(1)
     def invoke(self, args, ctx):
-        from parser import parse
-        from compiler import emit
+        import bytecode
         w_str = space.cast(args[0], space.W_String)
-        f = open(w_str.val)
-        try:
-            input = f.read()
-            parsed = parse(input)
-            for sexp in parsed:
-                code = emit(ctx, eval.read(ctx, sexp))
-                ctx.run(code)
-        finally:
-            f.close()
+        bytecode.load(ctx, w_str.val)
 
 class Macroexpand1(space.W_BIF):
     @arity(1)
@@ -332,23 +885,58 @@ consts = [
     ]
 
 core = [
-        ('binary*', Mult()),
+        ('+', Add()),
+        ('-', Subtract()),
+        ('*', Mult()),
         ('=', Eq()),
-        ('binary+', Add()),
-        ('binary-', Subtract()),
         ('<', LT()),
+        ('>', GT()),
+        ('<=', LE()),
+        ('>=', GE()),
+        ('max', Max()),
+        ('min', Min()),
+        ('inc', Inc()),
+        ('dec', Dec()),
         ('print1', Print1()),
+        ('flush', Flush()),
+        ('tty?', TtyP()),
+        ('*out*', stdout),
+        ('*err*', stderr),
         ('list', List()),
         ('first', First()),
         ('rest', Rest()),
         ('cons', Cons()),
         ('vector', Vector()),
-        ('gensym*', Gensym()),
+        ('gensym*', gensym),
         ('array-map', ArrayMap()),
         ('hash-map', HashMap()),
         ('get', Get()),
         ('assoc', Assoc()),
         ('dissoc', Dissoc()),
+        ('conj', Conj()),
+        ('pop', Pop()),
+        ('peek', Peek()),
+        ('count', Count()),
+        ('nth', Nth()),
+        ('reduce*', Reduce()),
+        ('reduced', Reduced()),
+        ('reduced?', ReducedP()),
+        ('seq', Seq()),
+        ('chunk-buffer', ChunkBuffer()),
+        ('chunk-append', ChunkAppend()),
+        ('chunk', Chunk()),
+        ('chunk-first', ChunkFirst()),
+        ('chunk-rest', ChunkRest()),
+        ('chunk-next', ChunkNext()),
+        ('chunk-cons', ChunkCons()),
+        ('chunked-seq?', ChunkedSeqP()),
+        ('unchecked-inc', UncheckedInc()),
+        ('transient', Transient()),
+        ('persistent!', PersistentBang()),
+        ('conj!', ConjBang()),
+        ('assoc!', AssocBang()),
+        ('dissoc!', DissocBang()),
+        ('pop!', PopBang()),
         ('meta', Meta()),
         ('with-meta', WithMeta()),
         ('alter-meta!', AlterMeta()),
@@ -357,6 +945,7 @@ core = [
         ('eval', Eval()),
         ('read-string', ReadString()),
         ('lazy-seq*', LazySeq()),
+        ('eduction*', Eduction()),
         ('class', Class()),
         ('symbol?', SymbolP()),
         ('keyword?', KeywordP()),
@@ -370,6 +959,7 @@ core = [
         ('keyword', Keyword()),
         ('symbol', Symbol()),
         ('str', Str()),
+        ('subs', Subs()),
         ('hash', Hash()),
         ('throw', Throw()),
         ('in-ns', InNs()),
@@ -377,3 +967,15 @@ core = [
         ('macroexpand-1', Macroexpand1()),
         ('reader', space.w_nil),
         ]
+
+# Builtins of the clojure.string ns.
+string = [
+        ('join', Join()),
+        ('split', Split()),
+        ('index-of', IndexOf()),
+        ('starts-with?', StartsWithP()),
+        ('replace', Replace()),
+        ('upper-case', UpperCase()),
+        ('lower-case', LowerCase()),
+        ('trim', Trim()),
+        ]
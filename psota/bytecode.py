@@ -0,0 +1,709 @@
+"""Caches of code compiled from files passed to load.
+
+Code compiled from foo.clj is stored in foo.pbc together with symbols, fns and
+macros it refers to. A cache is used only if it was written by the same
+interpreter for the same contents of the file, all macros the file used while
+compiling are unchanged together with everything they reach through vars, no
+symbol called as a fn has become a macro and all files it loaded in turn are
+unchanged.
+"""
+
+import os
+import hashlib
+from rpython.rlib import rmd5
+from rpython.rlib.objectmodel import we_are_translated
+
+import space
+import ops
+import eval
+import builtins
+import parser
+import image
+from image import Writer, Reader, write_ints, read_ints
+
+magic = "psota-bytecode"
+
+def _md5():
+    if not we_are_translated():
+        # rmd5 is unbearably slow when run on top of Python.
+        return hashlib.md5()
+    return rmd5.RMD5()
+
+def digest(data):
+    md5 = _md5()
+    md5.update(data)
+    return md5.hexdigest()
+
+def file_digest(filename):
+    md5 = _md5()
+    fd = os.open(filename, os.O_RDONLY, 0)
+    try:
+        while True:
+            chunk = os.read(fd, parser.chunk_size)
+            if chunk == "":
+                break
+            md5.update(chunk)
+    finally:
+        os.close(fd)
+    return md5.hexdigest()
+
+def _sources_digest():
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    md5 = hashlib.md5()
+    for name in sorted(os.listdir(dirname)):
+        if name.endswith(".py"):
+            f = open(os.path.join(dirname, name))
+            md5.update(f.read())
+            f.close()
+    return md5.hexdigest()
+
+# Computed once the module is imported, which happens at translation time.
+revision = _sources_digest()
+
+def cache_name(filename):
+    if filename.endswith(".clj"):
+        end = len(filename) - len(".clj")
+        assert end >= 0
+        return filename[:end] + ".pbc"
+    return filename + ".pbc"
+
+def operand_kinds(code):
+    "Returns a kind of every element of code. Op codes are IMMEDIATE."
+    kinds = [ops.IMMEDIATE for _ in code]
+    ip = 0
+    while ip < len(code):
+        op = code[ip]
+        for kind in ops.operands[op]:
+            ip += 1
+            kinds[ip] = kind
+        ip += 1
+    return kinds
+
+def write_literal(out, w_val):
+    "Writes a constant which code refers to."
+    if w_val is space.w_nil:
+        out.int(image.NIL)
+    elif w_val is space.w_true:
+        out.int(image.TRUE)
+    elif w_val is space.w_false:
+        out.int(image.FALSE)
+    elif w_val is space.w_empty_list:
+        out.int(image.EMPTY_LIST)
+    elif isinstance(w_val, space.W_List):
+        out.int(image.LIST)
+        _write_literals(out, space.unwrap(w_val))
+    elif isinstance(w_val, space.W_Vector):
+        out.int(image.VECTOR)
+        _write_literals(out, w_val.elems())
+    elif isinstance(w_val, space.W_Map):
+        out.int(image.ARRAY_MAP)
+        _write_literals(out, w_val.elems())
+    elif isinstance(w_val, space.W_Sym):
+        out.int(image.SYM)
+        out.str(w_val.val)
+    elif isinstance(w_val, space.W_Keyword):
+        out.int(image.KEYWORD)
+        out.str(w_val.val)
+    elif isinstance(w_val, space.W_String):
+        out.int(image.STRING)
+        out.str(w_val.val)
+    elif isinstance(w_val, space.W_Char):
+        out.int(image.CHAR)
+        out.int(w_val.val)
+    elif isinstance(w_val, space.W_Int):
+        out.int(image.INT)
+        out.int(w_val.val)
+    else:
+        raise space.CompilationException("Cannot cache %s" % w_val.to_str())
+
+def _write_literals(out, values_w):
+    out.int(len(values_w))
+    for w_val in values_w:
+        write_literal(out, w_val)
+
+def read_literal(inp):
+    kind = inp.int()
+    if kind == image.NIL:
+        return space.w_nil
+    elif kind == image.TRUE:
+        return space.w_true
+    elif kind == image.FALSE:
+        return space.w_false
+    elif kind == image.EMPTY_LIST:
+        return space.w_empty_list
+    elif kind == image.LIST:
+        return space.wrap(_read_literals(inp))
+    elif kind == image.VECTOR:
+        return space.vector(_read_literals(inp))
+    elif kind == image.ARRAY_MAP:
+        return space.array_map(_read_literals(inp))
+    elif kind == image.SYM:
+        return space.symbol(inp.str())
+    elif kind == image.KEYWORD:
+        return space.keyword(inp.str())
+    elif kind == image.STRING:
+        return space.W_String(inp.str())
+    elif kind == image.CHAR:
+        return space.W_Char(inp.int())
+    elif kind == image.INT:
+        return space.W_Int(inp.int())
+    raise space.ImageException("Unknown constant kind: %s" % kind)
+
+def _read_literals(inp):
+    return [read_literal(inp) for _ in range(inp.int())]
+
+def fingerprint(st, w_val):
+    "A digest of a fn which doesn't depend on ids used by a particular ctx."
+    if not isinstance(w_val, space.W_Fun):
+        return ""
+    out = Writer()
+    code = w_val.code
+    kinds = operand_kinds(code)
+    idx = 0
+    while idx < len(code):
+        val = code[idx]
+        if kinds[idx] == ops.SYM_ID and val >= 0:
+            out.str(st.get_sym(val))
+        elif kinds[idx] == ops.FN_ID and val >= 0:
+            out.str(fingerprint(st, st.get_fn(val)))
+        elif kinds[idx] == ops.CONST_ID:
+            w_const = st.get_const(val)
+            try:
+                write_literal(out, w_const)
+            except space.CompilationException:
+                out.str(w_const.to_str())
+        else:
+            out.int(val)
+        idx += 1
+    for arg_id in w_val.arg_ids:
+        out.str(st.get_sym(arg_id))
+    if w_val.rest_args_id >= 0:
+        out.str(st.get_sym(w_val.rest_args_id))
+    if w_val.arities is not None:
+        out.int(len(w_val.arities))
+        for w_body in w_val.arities:
+            out.str(fingerprint(st, w_body) if w_body is not None else "")
+    return digest(out.build())
+
+# Kinds of values a cache depends on.
+(
+        DEP_VAR,
+        DEP_MACRO,
+        ) = range(2)
+
+class _Walk:
+    """Walks fns reachable from roots through vars of a ns and closures.
+
+    Without local names it writes everything it reaches to out. With local
+    names, which are vars defined by a file being compiled, it follows only
+    those and collects names of all other vars it meets in external.
+    """
+
+    def __init__(self, ctx, ns, local_names=None):
+        self.st = ctx.st()
+        self.bindings = ctx.bindings()
+        self.ns = ns
+        self.local_names = local_names
+        self.out = Writer()
+        self.seen = {}
+        self.pending = []
+        self.external = {}
+
+    def fn(self, w_fn):
+        if w_fn not in self.seen:
+            self.seen[w_fn] = None
+            self.pending.append(w_fn)
+
+    def value(self, w_val):
+        if isinstance(w_val, space.W_Fun):
+            self.out.str("fn")
+            self.fn(w_val)
+            return
+        try:
+            write_literal(self.out, w_val)
+        except space.CompilationException:
+            self.out.str(w_val.type().to_str())
+
+    def sym(self, sym_id):
+        name = self.st.get_sym(sym_id)
+        self.out.str(name)
+        if self.local_names is not None and name not in self.local_names:
+            self.external[name] = None
+            return
+        w_var = self.bindings.var_in(self.ns, sym_id)
+        if w_var is None:
+            self.out.int(0)
+        else:
+            self.out.int(1)
+            self.value(w_var.w_val)
+
+    def run(self):
+        idx = 0
+        while idx < len(self.pending):
+            w_fn = self.pending[idx]
+            idx += 1
+            if self.local_names is None:
+                self.out.str(fingerprint(self.st, w_fn))
+            code = w_fn.code
+            ip = 0
+            while ip < len(code):
+                op = code[ip]
+                if op == ops.SYM or ops.is_intrinsic(op):
+                    self.sym(code[ip + 1])
+                elif op == ops.FN:
+                    self.fn(self.st.get_fn(code[ip + 1]))
+                ip += 1 + len(ops.operands[op])
+            if w_fn.arities is not None:
+                for w_body in w_fn.arities:
+                    if w_body is not None:
+                        self.fn(w_body)
+            env = w_fn.env
+            while env is not None:
+                for w_val in env.slots:
+                    if w_val is not None:
+                        self.value(w_val)
+                env = env.parent
+        return digest(self.out.build())
+
+def dependency_digest(ctx, kind, ns, name):
+    """A digest of a var or a macro and of everything it reaches through vars
+    of ns, which tells whether code compiled with it is still valid."""
+    st = ctx.st()
+    walk = _Walk(ctx, ns)
+    if kind == DEP_MACRO:
+        fn_id = st.macros.get(name, -1)
+        if fn_id < 0:
+            return ""
+        walk.fn(st.get_fn(fn_id))
+    else:
+        sym_id = st.get_sym_id(name)
+        w_var = ctx.bindings().var_in(ns, sym_id) if sym_id >= 0 else None
+        if w_var is None:
+            return ""
+        walk.value(w_var.w_val)
+    return walk.run()
+
+def defined_names(st, code, names):
+    "Adds names of vars code defines to names."
+    ip = 0
+    while ip < len(code):
+        op = code[ip]
+        if op == ops.DEF:
+            names[st.get_sym(code[ip + 1])] = None
+        ip += 1 + len(ops.operands[op])
+
+class Dependency:
+    def __init__(self, kind, ns, name, digest):
+        self.kind = kind
+        self.ns = ns
+        self.name = name
+        self.digest = digest
+
+class Log:
+    "Records what compilation of a file depends on and what it defines."
+
+    def __init__(self, fn_base, bindings):
+        self.fn_base = fn_base
+        self.bindings = bindings
+        # Macros used in each ns, as (name, ns, fn id).
+        self.used = {}
+        self.non_macros = {}
+        self.local_names = {}
+        self.defined = []
+        self.loaded = []
+
+    def macro_used(self, name, fn_id):
+        ns = self.bindings.ns
+        key = ns + " " + name
+        if key not in self.used:
+            self.used[key] = (name, ns, fn_id)
+
+    def non_macro_used(self, name):
+        self.non_macros[name] = None
+
+    def macro_defined(self, name, fn_id):
+        self.defined.append((name, fn_id))
+
+    def defined_by(self, st, forms, fn_base):
+        "Records names of vars defined by forms and fns from fn_base on."
+        for form in forms:
+            defined_names(st, form.code, self.local_names)
+        for fn_id in range(fn_base, len(st.fns)):
+            defined_names(st, st.get_fn(fn_id).code, self.local_names)
+
+    def dependencies(self, ctx, forms):
+        """Returns vars and macros defined elsewhere which compilation used.
+
+        Macros defined by the file are covered by its digest, but vars they
+        refer to may come from elsewhere, so these vars are dependencies too.
+        Vars defined by the file or by files it loaded aren't.
+        """
+        st = ctx.st()
+        self.defined_by(st, forms, self.fn_base)
+        local_names = self.local_names
+        deps = []
+        seen = {}
+        for (name, ns, fn_id) in self.used.values():
+            if fn_id < self.fn_base:
+                deps.append(Dependency(DEP_MACRO, ns, name,
+                    dependency_digest(ctx, DEP_MACRO, ns, name)))
+                continue
+            walk = _Walk(ctx, ns, local_names)
+            walk.fn(st.get_fn(fn_id))
+            walk.run()
+            for var_name in walk.external.keys():
+                key = ns + " " + var_name
+                if key not in seen:
+                    seen[key] = None
+                    deps.append(Dependency(DEP_VAR, ns, var_name,
+                        dependency_digest(ctx, DEP_VAR, ns, var_name)))
+        return deps
+
+class Form:
+    def __init__(self, code, gensyms, macros):
+        self.code = code
+        self.gensyms = gensyms
+        self.macros = macros
+
+def load(ctx, filename):
+    st = ctx.st()
+    source_digest = file_digest(filename)
+    outer_log = st.macro_log
+    fn_base = len(st.fns)
+    forms = _load_cached(ctx, cache_name(filename), source_digest)
+    if forms is None:
+        forms = _compile(ctx, filename, source_digest)
+    if outer_log is not None:
+        outer_log.loaded.append((filename, source_digest))
+        # Vars the loaded file defines are covered by its digest.
+        outer_log.defined_by(st, forms, fn_base)
+
+def _compile(ctx, filename, source_digest):
+    from compiler import emit
+    st = ctx.st()
+    ns = ctx.bindings().ns
+    log = Log(len(st.fns), ctx.bindings())
+    reader_dep = Dependency(DEP_VAR, ns, "reader",
+            dependency_digest(ctx, DEP_VAR, ns, "reader"))
+    forms = []
+    outer_log = st.macro_log
+    st.macro_log = log
+    reader = parser.file_reader(filename)
+    try:
+        while True:
+            sexp = reader.read()
+            if sexp is None:
+                break
+            log.defined = []
+            gensyms = builtins.gensym.counter
+            code = emit(ctx, eval.read(ctx, sexp))
+            gensyms = builtins.gensym.counter - gensyms
+            forms.append(Form(code, gensyms, log.defined))
+            ctx.run(code)
+    finally:
+        reader.close()
+        st.macro_log = outer_log
+    deps = [reader_dep] + log.dependencies(ctx, forms)
+    encoder = _Encoder(st, log.fn_base)
+    data = encoder.encode(source_digest, deps, log, forms)
+    if data is not None:
+        _write(cache_name(filename), data)
+    return forms
+
+def _write(path, data):
+    tmp_path = path + ".tmp"
+    try:
+        f = open(tmp_path, "w")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    except (OSError, IOError):
+        # Caching is best effort; directories might not be writable.
+        pass
+
+class _Encoder:
+    def __init__(self, st, fn_base):
+        self.st = st
+        self.fn_base = fn_base
+        self.syms = []
+        self.sym_indices = {}
+        self.fn_ids = []
+        self.fn_indices = {}
+        self.const_ids = []
+        self.const_indices = {}
+        # Arity tables refer to fns themselves rather than to their ids.
+        self.ids_of_fns = {}
+        for fn_id in range(fn_base, len(st.fns)):
+            self.ids_of_fns[st.get_fn(fn_id)] = fn_id
+
+    def sym_index(self, sym_id):
+        idx = self.sym_indices.get(sym_id, -1)
+        if idx < 0:
+            idx = len(self.syms)
+            self.sym_indices[sym_id] = idx
+            self.syms.append(self.st.get_sym(sym_id))
+        return idx
+
+    def fn_index(self, fn_id):
+        idx = self.fn_indices.get(fn_id, -1)
+        if idx < 0:
+            if fn_id < self.fn_base:
+                raise space.CompilationException("Fn defined elsewhere")
+            idx = len(self.fn_ids)
+            self.fn_indices[fn_id] = idx
+            self.fn_ids.append(fn_id)
+        return idx
+
+    def const_index(self, const_id):
+        idx = self.const_indices.get(const_id, -1)
+        if idx < 0:
+            idx = len(self.const_ids)
+            self.const_indices[const_id] = idx
+            self.const_ids.append(const_id)
+        return idx
+
+    def arities(self, w_fn):
+        "Returns indices of fns in an arity table, -1 for missing ones."
+        if w_fn.arities is None:
+            return []
+        indices = []
+        for w_body in w_fn.arities:
+            if w_body is None:
+                indices.append(-1)
+            else:
+                indices.append(self.fn_index(self.ids_of_fns.get(w_body, -1)))
+        return indices
+
+    def code(self, code):
+        kinds = operand_kinds(code)
+        encoded = [0 for _ in code]
+        idx = 0
+        while idx < len(code):
+            val = code[idx]
+            if kinds[idx] == ops.SYM_ID and val >= 0:
+                val = self.sym_index(val)
+            elif kinds[idx] == ops.FN_ID and val >= 0:
+                val = self.fn_index(val)
+            elif kinds[idx] == ops.CONST_ID:
+                val = self.const_index(val)
+            encoded[idx] = val
+            idx += 1
+        return encoded
+
+    def encode(self, source_digest, deps, log, forms):
+        "Returns contents of a cache or None if forms cannot be cached."
+        try:
+            forms_code = [self.code(form.code) for form in forms]
+            forms_macros = [[(name, self.fn_index(fn_id))
+                             for (name, fn_id) in form.macros]
+                            for form in forms]
+            fns_code = []
+            fns_args = []
+            fns_arities = []
+            # Encoding fns can discover further fns, hence no iterator.
+            idx = 0
+            while idx < len(self.fn_ids):
+                w_fn = self.st.get_fn(self.fn_ids[idx])
+                fns_code.append(self.code(w_fn.code))
+                fns_args.append([self.sym_index(id) for id in w_fn.arg_ids])
+                fns_arities.append(self.arities(w_fn))
+                idx += 1
+            consts = Writer()
+            consts.int(len(self.const_ids))
+            for const_id in self.const_ids:
+                write_literal(consts, self.st.get_const(const_id))
+        except space.CompilationException:
+            return None
+        out = Writer()
+        out.str(magic)
+        out.str(revision)
+        out.str(source_digest)
+        out.int(len(deps))
+        for dep in deps:
+            out.int(dep.kind)
+            out.str(dep.ns)
+            out.str(dep.name)
+            out.str(dep.digest)
+        non_macros = log.non_macros.keys()
+        out.int(len(non_macros))
+        for name in non_macros:
+            out.str(name)
+        out.int(len(log.loaded))
+        for (filename, file_digest) in log.loaded:
+            out.str(filename)
+            out.str(file_digest)
+        rest_args = [self.st.get_fn(id).rest_args_id for id in self.fn_ids]
+        rest_args = [self.sym_index(id) if id >= 0 else -1 for id in rest_args]
+        out.int(len(self.syms))
+        for sym in self.syms:
+            out.str(sym)
+        out.builder.append(consts.build())
+        out.int(len(self.fn_ids))
+        idx = 0
+        while idx < len(self.fn_ids):
+            write_ints(out, fns_code[idx])
+            write_ints(out, fns_args[idx])
+            out.int(rest_args[idx])
+            out.int(self.st.get_fn(self.fn_ids[idx]).nslots)
+            write_ints(out, fns_arities[idx])
+            idx += 1
+        out.int(len(forms))
+        idx = 0
+        while idx < len(forms):
+            write_ints(out, forms_code[idx])
+            out.int(forms[idx].gensyms)
+            out.int(len(forms_macros[idx]))
+            for (name, fn_idx) in forms_macros[idx]:
+                out.str(name)
+                out.int(fn_idx)
+            idx += 1
+        return out.build()
+
+def _load_cached(ctx, path, source_digest):
+    try:
+        f = open(path)
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except (OSError, IOError):
+        return None
+    try:
+        forms = _Decoder(ctx, Reader(data)).decode(source_digest)
+    except space.ImageException:
+        return None
+    if forms is None:
+        return None
+    st = ctx.st()
+    for form in forms:
+        builtins.gensym.counter += form.gensyms
+        for (name, fn_id) in form.macros:
+            st.add_macro(name, fn_id)
+        ctx.run(form.code)
+    return forms
+
+class _Decoder:
+    def __init__(self, ctx, inp):
+        self.ctx = ctx
+        self.st = ctx.st()
+        self.inp = inp
+        self.sym_ids = []
+        self.fn_base = len(self.st.fns)
+        self.fns = 0
+        self.const_ids = []
+
+    def sym_id(self, idx):
+        if idx < 0 or idx >= len(self.sym_ids):
+            raise space.ImageException("Invalid symbol in cache")
+        return self.sym_ids[idx]
+
+    def fn_id(self, idx):
+        if idx < 0 or idx >= self.fns:
+            raise space.ImageException("Invalid fn in cache")
+        return self.fn_base + idx
+
+    def code(self):
+        code = read_ints(self.inp)
+        ip = 0
+        while ip < len(code):
+            op = code[ip]
+            if op not in ops.operands:
+                raise space.ImageException("Invalid code in cache")
+            ip += 1 + len(ops.operands[op])
+        if ip != len(code):
+            raise space.ImageException("Invalid code in cache")
+        kinds = operand_kinds(code)
+        idx = 0
+        while idx < len(code):
+            val = code[idx]
+            if kinds[idx] == ops.SYM_ID and val >= 0:
+                code[idx] = self.sym_id(val)
+            elif kinds[idx] == ops.FN_ID and val >= 0:
+                code[idx] = self.fn_id(val)
+            elif kinds[idx] == ops.CONST_ID:
+                if val < 0 or val >= len(self.const_ids):
+                    raise space.ImageException("Invalid constant in cache")
+                code[idx] = self.const_ids[val]
+            idx += 1
+        return code
+
+    def up_to_date(self, source_digest):
+        inp = self.inp
+        st = self.st
+        if (inp.str() != magic or inp.str() != revision or
+                inp.str() != source_digest):
+            return False
+        for _ in range(inp.int()):
+            kind = inp.int()
+            ns = inp.str()
+            name = inp.str()
+            if inp.str() != dependency_digest(self.ctx, kind, ns, name):
+                return False
+        for _ in range(inp.int()):
+            # Calls compiled as calls of fns would now expand a macro.
+            if st.has_macro(inp.str()):
+                return False
+        for _ in range(inp.int()):
+            filename = inp.str()
+            expected = inp.str()
+            try:
+                if file_digest(filename) != expected:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def decode(self, source_digest):
+        "Returns forms to be run or None if the cache is stale."
+        if not self.up_to_date(source_digest):
+            return None
+        inp = self.inp
+        st = self.st
+        self.sym_ids = [st.add_sym(inp.str()) for _ in range(inp.int())]
+        # Equal scalars may already be in the pool and keep their ids.
+        self.const_ids = [st.add_const(w_const)
+                          for w_const in _read_literals(inp)]
+        self.fns = inp.int()
+        fns_w = []
+        fns_arities = []
+        for _ in range(self.fns):
+            code = self.code()
+            arg_ids = [self.sym_id(idx) for idx in read_ints(inp)]
+            rest_args_id = inp.int()
+            if rest_args_id >= 0:
+                rest_args_id = self.sym_id(rest_args_id)
+            nslots = inp.int()
+            if nslots < 0:
+                raise space.ImageException("Invalid fn in cache")
+            arities = read_ints(inp)
+            for arity_idx in arities:
+                if arity_idx >= 0:
+                    self.fn_id(arity_idx)
+            fns_arities.append(arities)
+            arities_w = None
+            if len(arities) > 0:
+                arities_w = [None for _ in arities]
+            fns_w.append(space.W_Fun(code, arg_ids, rest_args_id, nslots,
+                ops.stack_depth(code), None, arities_w))
+        # Arity tables may refer to fns which come later.
+        idx = 0
+        while idx < len(fns_w):
+            arities = fns_arities[idx]
+            for argc in range(len(arities)):
+                if arities[argc] >= 0:
+                    fns_w[idx].arities[argc] = fns_w[arities[argc]]
+            idx += 1
+        forms = []
+        for _ in range(inp.int()):
+            code = self.code()
+            gensyms = inp.int()
+            macros = []
+            for _ in range(inp.int()):
+                name = inp.str()
+                macros.append((name, self.fn_id(inp.int())))
+            forms.append(Form(code, gensyms, macros))
+        for w_fn in fns_w:
+            st.add_fn(w_fn)
+        return forms
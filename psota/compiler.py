@@ -1,9 +1,49 @@
 import ops
+import eval
+import builtins
 from space import (W_List, W_Int, W_EmptyList, W_Vector, W_Sym, W_Fun, unwrap,
-        W_Seq, W_ArrayMap, W_Keyword, w_nil, W_String, CompilationException,
-        W_Char, cast)
+        W_Seq, W_Map, W_Keyword, w_nil, W_String, CompilationException,
+        W_Char, cast, wrap, vector, array_map, symbol)
 
-def mkfn(ctx, w_args, body_w):
+class Scope:
+    "Locals of a fn being compiled, each of them kept in a slot of its frame."
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.slots = {}
+        self.size = 0
+        self.nslots = 0
+
+    def bind(self, sym_id):
+        "Returns a slot for a new local and the slot it shadows or -1."
+        slot = self.size
+        self.size += 1
+        if self.size > self.nslots:
+            self.nslots = self.size
+        shadowed = self.slots.get(sym_id, -1)
+        self.slots[sym_id] = slot
+        return (slot, shadowed)
+
+    def unbind(self, sym_id, shadowed):
+        self.size -= 1
+        if shadowed < 0:
+            del self.slots[sym_id]
+        else:
+            self.slots[sym_id] = shadowed
+
+    def resolve(self, sym_id):
+        "Returns a depth of a frame and a slot of a local or (-1, -1)."
+        depth = 0
+        scope = self
+        while scope is not None:
+            slot = scope.slots.get(sym_id, -1)
+            if slot >= 0:
+                return (depth, slot)
+            scope = scope.parent
+            depth += 1
+        return (-1, -1)
+
+def mkfn(ctx, w_args, body_w, outer):
     args = []
     rest_args_id = -1
     arg_vec_w = unwrap(cast(w_args, W_Seq))
@@ -23,80 +63,120 @@ def mkfn(ctx, w_args, body_w):
     for arg in args:
         id = st.add_sym(arg)
         ids.append(id)
+    # Args take the first slots of a frame, in order.
+    scope = Scope(outer)
+    for id in ids:
+        scope.bind(id)
+    if rest_args_id >= 0:
+        scope.bind(rest_args_id)
     if len(ids) > 0 or rest_args_id >= 0:
         recur_bindings = (ids, rest_args_id)
     else:
         recur_bindings = empty_recur_bindings
     code = []
     for w_elem in body_w:
-        code += emit(ctx, w_elem, recur_bindings)
-    return st.add_fn(W_Fun(code, ids, rest_args_id))
+        code += emit_form(ctx, w_elem, scope, recur_bindings)
+    return st.add_fn(W_Fun(code, ids, rest_args_id, scope.nslots,
+        ops.stack_depth(code)))
 
 def defmacro(ctx, list_w):
     _, w_name, w_args = list_w[0:3]
-    fn_id = mkfn(ctx, w_args, list_w[3:])
+    # Macros run while compiling, so they cannot see any locals.
+    fn_id = mkfn(ctx, w_args, list_w[3:], None)
     ctx.st().add_macro(cast(w_name, W_Sym).val, fn_id)
     return []
 
-def expand_macro(ctx, macro_id, args_w, recur_bindings):
-    args_code = []
-    for w_arg in args_w:
-        args_code += emit_quote(ctx, w_arg) + [ops.PUSH]
-    expanding_code = [ops.FN, macro_id, ops.INVOKE, len(args_w)]
-    all_code = args_code + expanding_code
-    value = ctx.run(all_code)
-    return emit(ctx, value, recur_bindings)
-
-def fn(ctx, list_w):
+def expand_macro(ctx, macro_id, args_w, scope, recur_bindings):
+    w_macro = ctx.st().get_fn(macro_id)
+    value = eval.invoke_fn(w_macro, [w_arg for w_arg in args_w], ctx)
+    return emit_form(ctx, value, scope, recur_bindings)
+
+def is_multi_arity(list_w):
+    "Tells whether an fn* form is (fn* ([args] body) ...)."
+    if len(list_w) < 2 or not isinstance(list_w[1], W_List):
+        return False
+    clause_w = unwrap(list_w[1])
+    return len(clause_w) > 0 and isinstance(clause_w[0], W_Seq)
+
+def multi_arity_fn(ctx, clauses_w, scope):
+    "Returns an id of an fn with an arity table, indexed by a count of args."
+    st = ctx.st()
+    fixed = {}
+    w_variadic = None
+    size = 0
+    for w_clause in clauses_w:
+        clause_w = unwrap(cast(w_clause, W_List))
+        w_body = st.get_fn(mkfn(ctx, clause_w[0], clause_w[1:], scope))
+        argc = len(w_body.arg_ids)
+        if w_body.got_rest_args():
+            if w_variadic is not None:
+                raise CompilationException("Only one variadic arity allowed")
+            w_variadic = w_body
+            size = max(size, argc)
+        else:
+            if argc in fixed:
+                raise CompilationException("Duplicate arity: %s" % argc)
+            fixed[argc] = w_body
+            size = max(size, argc + 1)
+    arities = []
+    for argc in range(size + 1):
+        w_body = fixed.get(argc, None)
+        if (w_body is None and w_variadic is not None and
+                argc >= len(w_variadic.arg_ids)):
+            w_body = w_variadic
+        arities.append(w_body)
+    return st.add_fn(W_Fun([], [], -1, 0, 0, None, arities))
+
+def fn(ctx, list_w, scope):
+    if is_multi_arity(list_w):
+        return [ops.FN, multi_arity_fn(ctx, list_w[1:], scope)]
     _, w_args = list_w[0:2]
-    fn_id = mkfn(ctx, w_args, list_w[2:])
+    fn_id = mkfn(ctx, w_args, list_w[2:], scope)
     return [ops.FN, fn_id]
 
-def try_block(ctx, list_w):
+def try_block(ctx, list_w, scope):
     _, w_body, w_catch, w_finally = list_w
-    fn_code = fn(ctx, unwrap(w_body))
+    fn_code = fn(ctx, unwrap(w_body), scope)
     if w_catch is w_nil:
         catch_code = []
     else:
-        catch_code = fn(ctx, unwrap(w_catch)) + [ops.INVOKE, 1]
-    finally_id = fn(ctx, unwrap(w_finally))[1] if w_finally is not w_nil else -1
+        catch_code = fn(ctx, unwrap(w_catch), scope) + [ops.INVOKE, 1]
+    if w_finally is not w_nil:
+        finally_id = fn(ctx, unwrap(w_finally), scope)[1]
+    else:
+        finally_id = -1
     return fn_code + [ops.TRY, finally_id, 1 + len(catch_code)] + catch_code
 
-def somehow_quoted_emit(list_handling_fn):
-    def f(ctx, w_val):
-        st = ctx.st()
-        if isinstance(w_val, W_Sym):
-            id = st.add_sym(w_val.val)
-            return [ops.QUOTE, id]
-        elif isinstance(w_val, W_Keyword):
-            id = st.add_sym(w_val.val)
-            return [ops.KEYWORD, id]
-        elif isinstance(w_val, W_String):
-            id = st.add_sym(w_val.val)
-            return [ops.STRING, id]
-        elif isinstance(w_val, W_Int):
-            return [ops.INT, w_val.val]
-        elif isinstance(w_val, W_Char):
-            return [ops.CHAR, w_val.val]
-        elif isinstance(w_val, W_List):
-            return list_handling_fn(ctx, w_val, f)
-        elif isinstance(w_val, W_Vector):
-            code = []
-            for w_elem in w_val.elems():
-                code += f(ctx, w_elem) + [ops.PUSH]
-            return code + [ops.SYM, st.add_sym("vector"),
-                    ops.INVOKE, len(w_val.elems())]
-        elif isinstance(w_val, W_ArrayMap):
-            code = []
-            for w_elem in w_val.elems():
-                code += f(ctx, w_elem) + [ops.PUSH]
-            return code + [ops.SYM, st.add_sym("array-map"),
-                    ops.INVOKE, len(w_val.elems())]
-        elif w_val == w_nil:
-            return [ops.SYM, st.get_sym_id("nil")]
-        else:
-            raise Exception("how do i quasiquote? %s" % w_val)
-    return f
+def literal(w_val):
+    "Returns a value which a quoted form evaluates to."
+    if isinstance(w_val, W_Sym):
+        return symbol(w_val.val)
+    elif isinstance(w_val, W_List):
+        return wrap([literal(w_elem) for w_elem in unwrap(w_val)])
+    elif isinstance(w_val, W_Vector):
+        return vector([literal(w_elem) for w_elem in w_val.elems()])
+    elif isinstance(w_val, W_Map):
+        return array_map([literal(w_elem) for w_elem in w_val.elems()])
+    return w_val
+
+def emit_const(ctx, w_val):
+    return [ops.CONST, ctx.st().add_const(literal(w_val))]
+
+def is_literal(w_val):
+    "Tells whether w_val evaluates to an equal value."
+    if (isinstance(w_val, W_Keyword) or isinstance(w_val, W_String) or
+            isinstance(w_val, W_Int) or isinstance(w_val, W_Char)):
+        return True
+    elif isinstance(w_val, W_Vector):
+        elems_w = w_val.elems()
+    elif isinstance(w_val, W_Map):
+        elems_w = w_val.elems()
+    else:
+        return False
+    for w_elem in elems_w:
+        if not is_literal(w_elem):
+            return False
+    return True
 
 def is_unquote(list_w):
     if len(list_w) != 2:
@@ -104,137 +184,208 @@ def is_unquote(list_w):
     w_first = list_w[0]
     return isinstance(w_first, W_Sym) and w_first.to_str() == '~'
 
-def emit_quasiquoted_list(ctx, w_val, recur):
-    list_w = unwrap(w_val)
-    if is_unquote(list_w):
-        code = emit(ctx, list_w[1])
-        return code
+def has_unquote(w_val):
+    "Tells whether a quasiquoted form has to be built at run time."
+    if isinstance(w_val, W_List):
+        elems_w = unwrap(w_val)
+        if is_unquote(elems_w):
+            return True
+    elif isinstance(w_val, W_Vector):
+        elems_w = w_val.elems()
+    elif isinstance(w_val, W_Map):
+        elems_w = w_val.elems()
     else:
-        code = []
-        list = unwrap(w_val)
-        for w_elem in list:
-            code += recur(ctx, w_elem) + [ops.PUSH]
-        return code + [ops.SYM, ctx.st().add_sym("list"), ops.INVOKE, len(list)]
+        return False
+    for w_elem in elems_w:
+        if has_unquote(w_elem):
+            return True
+    return False
 
-emit_quasiquote = somehow_quoted_emit(emit_quasiquoted_list)
+def emit_quote(ctx, w_val):
+    if isinstance(w_val, W_Sym):
+        return [ops.QUOTE, ctx.st().add_sym(w_val.val)]
+    elif isinstance(w_val, W_Int):
+        return [ops.INT, w_val.val]
+    elif isinstance(w_val, W_Char):
+        return [ops.CHAR, w_val.val]
+    return emit_const(ctx, w_val)
 
-def emit_quoted_list(ctx, w_val, recur):
-    code = []
-    list = unwrap(w_val)
-    for w_elem in list:
-        code += recur(ctx, w_elem) + [ops.PUSH]
-    return code + [ops.SYM, ctx.st().add_sym("list"), ops.INVOKE, len(list)]
+def emit_global(ctx, name):
+    return [ops.SYM, ctx.st().add_sym(name)]
 
-emit_quote = somehow_quoted_emit(emit_quoted_list)
+def emit_quasiquote(ctx, w_val, scope):
+    if not has_unquote(w_val):
+        return emit_quote(ctx, w_val)
+    if isinstance(w_val, W_List):
+        list_w = unwrap(w_val)
+        if is_unquote(list_w):
+            return emit_form(ctx, list_w[1], scope)
+        code = []
+        for w_elem in list_w:
+            code += emit_quasiquote(ctx, w_elem, scope) + [ops.PUSH]
+        return code + emit_global(ctx, "list") + [ops.INVOKE, len(list_w)]
+    elif isinstance(w_val, W_Vector):
+        code = []
+        for w_elem in w_val.elems():
+            code += emit_quasiquote(ctx, w_elem, scope) + [ops.PUSH]
+        return code + emit_global(ctx, "vector") + [
+                ops.INVOKE, len(w_val.elems())]
+    else:
+        map_w = cast(w_val, W_Map)
+        code = []
+        for w_elem in map_w.elems():
+            code += emit_quasiquote(ctx, w_elem, scope) + [ops.PUSH]
+        return code + emit_global(ctx, "array-map") + [
+                ops.INVOKE, len(map_w.elems())]
 
-def emit_list(ctx, node, recur_bindings):
+def emit_list(ctx, node, scope, recur_bindings):
     st = ctx.st()
     list_w = unwrap(node)
     if len(list_w) == 0:
-        return [ops.SYM, st.add_sym("list"), ops.INVOKE, 0]
+        return emit_global(ctx, "list") + [ops.INVOKE, 0]
     w_head = list_w[0]
     args_w = list_w[1:]
     if isinstance(w_head, W_Sym):
         head = w_head.val
         if head == "if":
-            cond_code = emit(ctx, list_w[1])
-            true_code = emit(ctx, list_w[2], recur_bindings)
-            false_code = emit(ctx, list_w[3], recur_bindings)
+            cond_code = emit_form(ctx, list_w[1], scope)
+            true_code = emit_form(ctx, list_w[2], scope, recur_bindings)
+            false_code = emit_form(ctx, list_w[3], scope, recur_bindings)
             jmp_code = [ops.RELJMP, len(false_code)]
             code = (cond_code + [ops.IF, len(true_code) + len(jmp_code)] +
                     true_code + jmp_code + false_code)
             return code
         elif head == "let*":
             sym = cast(list_w[1], W_Sym)
-            binding_code = emit(ctx, list_w[2])
+            binding_code = emit_form(ctx, list_w[2], scope)
             id = st.add_sym(sym.val)
-            inner_code = emit(ctx, list_w[3], recur_bindings)
-            code = binding_code + [ops.PUSH_ENV, id] + inner_code + [ops.POP_ENV]
-            return code
+            (slot, shadowed) = scope.bind(id)
+            inner_code = emit_form(ctx, list_w[3], scope, recur_bindings)
+            scope.unbind(id, shadowed)
+            return binding_code + [ops.SET_LOCAL, slot] + inner_code
         elif head == "do":
             body_code = []
             for step in list_w[1:]:
-                body_code += emit(ctx, step, recur_bindings)
+                body_code += emit_form(ctx, step, scope, recur_bindings)
             return body_code
         elif head == "quote":
             return emit_quote(ctx, list_w[1])
         elif head == "qquote*":
-            return emit_quasiquote(ctx, list_w[1])
+            return emit_quasiquote(ctx, list_w[1], scope)
         elif head == "fn*":
-            return fn(ctx, list_w)
+            return fn(ctx, list_w, scope)
         elif head == "defmacro*":
             return defmacro(ctx, list_w)
         elif head == "def*":
             var_sym = cast(list_w[1], W_Sym)
             id = st.add_sym(var_sym.val)
-            val_code = emit(ctx, list_w[2])
+            val_code = emit_form(ctx, list_w[2], scope)
             return val_code + [ops.DEF, id]
         elif head == "try*":
-            return try_block(ctx, list_w)
+            return try_block(ctx, list_w, scope)
         elif head == "recur":
             args = list_w[1:]
             args_code = []
+            if recur_bindings == no_recur_bindings:
+                raise CompilationException("Not a recur point :o")
             (ids, rest_id) = recur_bindings
-            if len(args) < len(ids):
+            targets = [x for x in ids]
+            if rest_id >= 0:
+                targets.append(rest_id)
+            if len(args) < len(ids) or len(args) > len(targets):
                 msg = "Invalid number of recur arguments: %s given, %s expected"
                 raise CompilationException(msg % (len(args), len(ids)))
             for arg in args:
-                c = emit(ctx, arg)
+                c = emit_form(ctx, arg, scope)
                 args_code += c + [ops.PUSH]
-            if recur_bindings == no_recur_bindings:
-                raise CompilationException("Not a recur point :o")
-            bindings_ids = [x for x in reversed(ids)] + \
-                    [rest_id if rest_id >= 0 else -1]
-            return args_code + [ops.RECUR, len(args)] + bindings_ids
-        elif st.has_macro(head):
-            return expand_macro(ctx, st.get_macro(head), list_w[1:], recur_bindings)
+            return args_code + [ops.RECUR, len(args)]
+        macro_id = st.find_macro(head)
+        if macro_id >= 0:
+            return expand_macro(ctx, macro_id, list_w[1:], scope,
+                    recur_bindings)
         elif head == "apply":
             args_code = []
             for arg in args_w:
-                c = emit(ctx, arg)
+                c = emit_form(ctx, arg, scope)
                 args_code += c + [ops.PUSH]
             return args_code + [ops.APPLY, len(args_w)]
+    if isinstance(w_head, W_Sym):
+        op = intrinsic(ctx, w_head.val, len(args_w), scope)
+        if op >= 0:
+            code = []
+            for arg in args_w[:-1]:
+                code += emit_form(ctx, arg, scope) + [ops.PUSH]
+            code += emit_form(ctx, args_w[-1], scope)
+            return code + [op, st.add_sym(w_head.val)]
     args_code = []
     for arg in args_w:
-        c = emit(ctx, arg)
+        c = emit_form(ctx, arg, scope)
         args_code += c + [ops.PUSH]
-    fn_code = emit(ctx, w_head)
+    fn_code = emit_form(ctx, w_head, scope)
     return args_code + fn_code + [ops.INVOKE, len(args_w)]
 
+def intrinsic(ctx, name, argc, scope):
+    "Returns an op standing for a call of a core fn or -1."
+    if argc == 2:
+        op = ops.binary_intrinsics.get(name, -1)
+    elif argc == 1:
+        op = ops.unary_intrinsics.get(name, -1)
+    else:
+        return -1
+    if op >= 0 and scope.resolve(ctx.st().add_sym(name))[0] >= 0:
+        return -1
+    return op
+
 no_recur_bindings = ([], -1)
 empty_recur_bindings = ([], -2)
 
-def emit(ctx, node, recur_bindings=no_recur_bindings):
-    st = ctx.st()
+def emit_symbol(ctx, name, scope):
+    if name == "~":
+        raise Exception("Shouldn't see '~' here!")
+    id = ctx.st().add_sym(name)
+    (depth, slot) = scope.resolve(id)
+    if depth >= 0:
+        return [ops.LOCAL, depth, slot]
+    for (const_name, w_val) in builtins.consts:
+        if const_name == name:
+            return emit_const(ctx, w_val)
+    return [ops.SYM, id]
+
+def emit(ctx, node):
+    "Compiles a top level form."
+    scope = Scope()
+    code = emit_form(ctx, node, scope)
+    if scope.nslots == 0:
+        return code
+    # Locals of top level forms live in a frame of an fn called in place.
+    fn_id = ctx.st().add_fn(W_Fun(code, [], -1, scope.nslots,
+        ops.stack_depth(code)))
+    return [ops.FN, fn_id, ops.INVOKE, 0]
+
+def emit_form(ctx, node, scope, recur_bindings=no_recur_bindings):
     if isinstance(node, W_Sym):
-        sym = node.val
-        if sym == "~":
-            raise Exception("Shouldn't see '~' here!")
-        return [ops.SYM, st.add_sym(sym)]
-    elif isinstance(node, W_Keyword):
-        sym = node.val
-        id = st.add_sym(sym)
-        return [ops.KEYWORD, id]
-    elif isinstance(node, W_String):
-        id = st.add_sym(node.val)
-        return [ops.STRING, id]
+        return emit_symbol(ctx, node.val, scope)
     elif isinstance(node, W_Int):
         return [ops.INT, node.val]
     elif isinstance(node, W_Char):
         return [ops.CHAR, node.val]
+    elif is_literal(node):
+        return emit_const(ctx, node)
     elif isinstance(node, W_List):
-        return emit_list(ctx, node, recur_bindings)
+        return emit_list(ctx, node, scope, recur_bindings)
     elif isinstance(node, W_Vector):
         code = []
         for w_elem in node.elems():
-            code += emit(ctx, w_elem) + [ops.PUSH]
-        return code + [ops.SYM, st.add_sym("vector"), ops.INVOKE, len(node.elems())]
-    elif isinstance(node, W_ArrayMap):
+            code += emit_form(ctx, w_elem, scope) + [ops.PUSH]
+        return code + emit_global(ctx, "vector") + [
+                ops.INVOKE, len(node.elems())]
+    elif isinstance(node, W_Map):
         code = []
         for w_elem in node.elems():
-            code += emit(ctx, w_elem) + [ops.PUSH]
-        return code + [ops.SYM, st.add_sym("array-map"), ops.INVOKE, len(node.elems())]
+            code += emit_form(ctx, w_elem, scope) + [ops.PUSH]
+        return code + emit_global(ctx, "array-map") + [
+                ops.INVOKE, len(node.elems())]
     elif node == w_nil:
-        return [ops.SYM, st.get_sym_id("nil")]
+        return emit_const(ctx, w_nil)
     else:
         raise Exception("How to emit? %s" % node)
@@ -4,88 +4,56 @@ import space
 import builtins
 import ops
 from symbol_table import SymbolTable
-from bindings import Bindings
+from bindings import Bindings, core_ns
 
-@jit.elidable
-def _get_index(indices, key, version):
-    return indices.get(key, -1)
+class Frame:
+    """Locals of a fn call, each one in a slot assigned by the compiler.
+
+    Closures keep a copy of a frame they were made in, which is why frames
+    they refer to never change.
+    """
 
-class Env:
-    def __init__(self, inits, parent=None):
+    def __init__(self, slots, parent=None):
+        self.slots = slots
         self.parent = parent
-        if parent is None:
-            self.indices = {}
-            self.version = 0
-            self.slots = []
-        else:
-            self.indices = parent.indices
-            self.version = parent.version
-            self.slots = [None for _ in range(len(parent.slots))]
-        self.on_stack = False
-        for (key, val) in inits:
-            self.set(key, val)
-
-    def mark_used(self):
-        self.on_stack = True
-
-    def mark_free(self):
-        self.on_stack = False
-
-    def set(self, key, val):
-        indices = jit.promote(self.indices)
-        key = jit.promote(key)
-        version = jit.promote(self.version)
-        index = _get_index(indices, key, version)
-        if index == -1:
-            parent = self.parent
-            if parent is not None and self.indices is parent.indices:
-                self.indices = {}
-                self.indices.update(parent.indices)
-            self.indices[key] = len(self.slots)
-            self.slots.append(val)
-            self.version += 1
-        else:
-            self.slots[index] = val
-
-    def get(self, key):
-        indices = jit.promote(self.indices)
-        key = jit.promote(key)
-        version = jit.promote(self.version)
-        index = _get_index(indices, key, version)
-        if index >= 0:
-            val = self.slots[index]
-            if val is None and self.parent is not None:
-                return self.parent.get(key)
-            return val
-        if self.parent is not None:
-            return self.parent.get(key)
-
-    def clone(self):
-        inits = [(id, self.slots[self.indices[id]])
-                for id in self.indices.keys()]
-        return Env(inits, self)
-
-def base_env(st):
-    return Env(inits=[(st.get_sym_id(sym), val)
-                      for (sym, val) in builtins.consts])
+
+    def copy(self):
+        return Frame([w_val for w_val in self.slots], self.parent)
+
+def call_frame(w_body, env):
+    return Frame([None for _ in range(w_body.nslots)], env)
+
+@jit.unroll_safe
+def get_local(frame, depth, slot):
+    while depth > 0:
+        frame = frame.parent
+        depth -= 1
+    return frame.slots[slot]
 
 @jit.elidable
-def lookup_in_bindings(bindings, version, sym_id):
-    return bindings.get(sym_id)
+def lookup_var(bindings, version, sym_id):
+    return bindings.var(sym_id)
 
-def lookup_in_ctx(ctx, sym_id):
+def lookup_var_in_ctx(ctx, sym_id):
     bindings = jit.promote(ctx.bindings())
     version = jit.promote(bindings.version)
-    return lookup_in_bindings(bindings, version, sym_id)
+    return lookup_var(bindings, version, sym_id)
+
+def lookup_in_ctx(ctx, sym_id):
+    w_var = lookup_var_in_ctx(ctx, sym_id)
+    if w_var is None:
+        return None
+    return w_var.w_val
 
-def lookup(env, ctx, sym_id):
-    val = env.get(sym_id)
-    if val is None:
-        val = lookup_in_ctx(ctx, sym_id)
-    if val is None:
+def global_var(ctx, sym_id):
+    w_var = lookup_var_in_ctx(ctx, sym_id)
+    if w_var is None:
         raise space.LookupException("Undefined symbol: %s" %
                 ctx.st().get_sym(sym_id))
-    return val
+    return w_var
+
+def lookup(ctx, sym_id):
+    return global_var(ctx, sym_id).w_val
 
 def read(ctx, form):
     reader = lookup_in_ctx(ctx, ctx.st().get_sym_id("reader"))
@@ -105,13 +73,13 @@ class Context:
         return self._bindings
 
     def run(self, code):
-        return eval(self, base_env(self._st), code)
+        return eval(self, None, code, ops.stack_depth(code))
 
 ops_names = {
-        ops.KEYWORD: 'KEYWORD',
+        ops.CONST: 'CONST',
         ops.IF: 'IF',
-        ops.PUSH_ENV: 'PUSH_ENV',
-        ops.POP_ENV: 'POP_ENV',
+        ops.LOCAL: 'LOCAL',
+        ops.SET_LOCAL: 'SET_LOCAL',
         ops.SYM: 'SYM',
         ops.INT: 'INT',
         ops.QUOTE: 'QUOTE',
@@ -122,8 +90,19 @@ ops_names = {
         ops.PUSH: 'PUSH',
         ops.APPLY: 'APPLY',
         ops.RECUR: 'RECUR',
-        ops.STRING: 'STRING',
         ops.TRY: 'TRY',
+        ops.CHAR: 'CHAR',
+        ops.ADD: 'ADD',
+        ops.SUB: 'SUB',
+        ops.MUL: 'MUL',
+        ops.LT: 'LT',
+        ops.GT: 'GT',
+        ops.LE: 'LE',
+        ops.GE: 'GE',
+        ops.EQ: 'EQ',
+        ops.INC: 'INC',
+        ops.DEC: 'DEC',
+        ops.ZERO: 'ZERO',
         }
 
 def get_location(ip, code):
@@ -144,115 +123,133 @@ def get_location(ip, code):
 
 jitdriver = jit.JitDriver(
         greens=["ip", "code"],
-        reds=["sp", "stack", "ctx", "r1", "env"],
+        reds=["sp", "stack", "ctx", "r1", "frame", "caller"],
         get_printable_location=get_location,
         )
 
+class Activation:
+    "A call waiting in eval for a fn it invoked to return."
+
+    def __init__(self, code, ip, frame, stack, sp, parent):
+        self.code = code
+        self.ip = ip
+        self.frame = frame
+        self.stack = stack
+        self.sp = sp
+        self.parent = parent
+
+def select_arity(w_fn, argc):
+    "Returns a fn whose code runs a call of w_fn with argc args."
+    w_body = w_fn.arity(argc)
+    if w_body is None:
+        raise space.ArityException(argc)
+    return w_body
+
+def check_arity(w_fn, argc):
+    arg_ids_len = len(w_fn.arg_ids)
+    if argc < arg_ids_len or (argc > arg_ids_len and not w_fn.got_rest_args()):
+        raise space.ArityException(argc, arg_ids_len)
+
+def args_frame(w_body, env, args_w):
+    "Returns a frame of a call of w_body with args_w."
+    check_arity(w_body, len(args_w))
+    arg_ids_len = len(w_body.arg_ids)
+    frame = call_frame(w_body, env)
+    for idx in range(arg_ids_len):
+        frame.slots[idx] = args_w[idx]
+    if w_body.got_rest_args():
+        frame.slots[arg_ids_len] = space.wrap(args_w[arg_ids_len:])
+    return frame
+
+@jit.unroll_safe
+def stack_frame(w_body, env, stack, sp, argc):
+    "Returns a frame of a call of w_body with argc args on top of the stack."
+    check_arity(w_body, argc)
+    arg_ids_len = const_len(w_body.arg_ids)
+    frame = call_frame(w_body, env)
+    if w_body.got_rest_args():
+        new_sp = sp - (argc - arg_ids_len)
+        assert new_sp >= 0
+        rest_args = [space.w_nil for _ in range(argc - arg_ids_len)]
+        for i in range(new_sp, sp):
+            rest_args[i - new_sp] = stack[jit.promote(i)]
+        sp = new_sp
+        frame.slots[arg_ids_len] = space.wrap(rest_args)
+    sp -= arg_ids_len
+    for idx in range(arg_ids_len):
+        frame.slots[idx] = stack[jit.promote(idx + sp)]
+    return frame
+
 def invoke_fn(w_fn, args_w, ctx):
     w_fn = space.cast(w_fn, space.W_Fun)
-    argc = len(args_w)
-    arg_ids_len = len(w_fn.arg_ids)
-    rest_args = space.w_empty_list
-    if argc > arg_ids_len and w_fn.got_rest_args():
-        rest_args = [args_w.pop() for _ in range(argc - arg_ids_len)]
-        rest_args.reverse()
-        rest_args = space.wrap(rest_args)
-    args = [args_w.pop() for _ in range(arg_ids_len)]
-    idx = 0
-    env = Env([], w_fn.env)
-    for arg_id in reversed(w_fn.arg_ids):
-        env.set(arg_id, args[idx])
-        idx += 1
-    if w_fn.got_rest_args():
-        env.set(w_fn.rest_args_id, rest_args)
-    return eval(ctx, env, w_fn.code)
+    w_body = select_arity(w_fn, len(args_w))
+    frame = args_frame(w_body, w_fn.env, args_w)
+    return eval(ctx, frame, w_body.code, w_body.stack_size)
 
 @jit.unroll_safe
-def invoke(ip, env, code, r1, stack, sp, ctx):
-    ip += 1
-    sp = jit.promote(sp)
-    argc = jit.promote(get_op(code, ip))
-    assert argc >= 0
-    fn = jit.promote(r1)
-    if isinstance(fn, space.W_Fun):
-        arg_ids_len = const_len(fn.arg_ids)
-        if fn.env.on_stack:
-            new_env = Env([], fn.env)
-        else:
-            new_env = fn.env
-        try:
-            new_env.mark_used()
-            if (argc < arg_ids_len or
-                    (argc > arg_ids_len and not fn.got_rest_args())):
-                raise space.ArityException(argc, arg_ids_len)
-            if argc > arg_ids_len and fn.got_rest_args():
-                new_sp = sp - (argc - arg_ids_len)
-                assert new_sp >= 0
-                rest_args = [space.w_nil for _ in range(argc - arg_ids_len)]
-                for i in range(new_sp, sp):
-                    rest_args[i - new_sp] = stack[jit.promote(i)]
-                sp = new_sp
-                new_env.set(fn.rest_args_id, space.wrap(rest_args))
-            elif fn.got_rest_args():
-                new_env.set(fn.rest_args_id, space.w_empty_list)
-            sp -= arg_ids_len
-            idx = 0
-            for arg_id in fn.arg_ids:
-                new_env.set(arg_id, stack[jit.promote(idx + sp)])
-                idx += 1
-            return eval(ctx, new_env, fn.code)
-        finally:
-            new_env.mark_free()
+def invoke_bif(fn, stack, sp, argc, ctx):
+    new_sp = sp - argc
+    assert new_sp >= 0
+    # Few args are passed straight from the stack.
+    if argc == 0:
+        ret = fn.invoke0(ctx)
+    elif argc == 1:
+        ret = fn.invoke1(stack[new_sp], ctx)
+    elif argc == 2:
+        ret = fn.invoke2(stack[new_sp], stack[new_sp + 1], ctx)
+    elif argc == 3:
+        ret = fn.invoke3(stack[new_sp], stack[new_sp + 1], stack[new_sp + 2],
+                ctx)
     else:
-        new_sp = sp - argc
-        assert new_sp >= 0
         args = [space.w_nil for _ in range(argc)]
         for i in range(new_sp, sp):
             args[i - new_sp] = stack[i]
         ret = fn.invoke(args, ctx)
-        if ret is None:
-            ret = space.w_nil
-        return ret
+    if ret is None:
+        ret = space.w_nil
+    return ret
 
-@jit.unroll_safe
-def apply(ip, env, code, r1, stack, sp, ctx):
-    ip += 1
-    assert code[ip] == 2
-    new_sp = sp - 2
-    assert new_sp >= 0
-    (fn, w_args) = stack[new_sp : sp]
-    sp = new_sp
-    args = space.unwrap(w_args)
-    argc = len(args)
-    if isinstance(fn, space.W_Fun):
-        arg_ids_len = len(fn.arg_ids)
-        if fn.env.on_stack:
-            new_env = Env([], fn.env)
-        else:
-            new_env = fn.env
-        try:
-            new_env.mark_used()
-            if (argc < arg_ids_len or
-                    (argc > arg_ids_len and not fn.got_rest_args())):
-                raise space.ArityException(argc, arg_ids_len)
-            if argc > arg_ids_len and fn.got_rest_args():
-                rest_args = [args.pop() for _ in range(argc - arg_ids_len)]
-                rest_args.reverse()
-                new_env.set(fn.rest_args_id, space.wrap(rest_args))
-            elif fn.got_rest_args():
-                new_env.set(fn.rest_args_id, space.w_empty_list)
-            idx = 0
-            for arg_id in fn.arg_ids:
-                new_env.set(arg_id, args[idx])
-                idx += 1
-            return eval(ctx, new_env, fn.code)
-        finally:
-            new_env.mark_free()
+@jit.elidable
+def is_core_var(w_var):
+    return w_var.ns == core_ns
+
+def is_intact(w_var):
+    "Tells whether a var still holds a core fn which an intrinsic stands for."
+    return is_core_var(w_var) and not w_var.redefined
+
+def binary_intrinsic(op, w_a, w_b):
+    "Returns a value of an intrinsic or None if the fn has to be called."
+    if op == ops.EQ:
+        return space.wrap(w_a.equals(w_b))
+    if not isinstance(w_a, space.W_Int) or not isinstance(w_b, space.W_Int):
+        return None
+    a = w_a.val
+    b = w_b.val
+    if op == ops.ADD:
+        return space.W_Int(a + b)
+    elif op == ops.SUB:
+        return space.W_Int(a - b)
+    elif op == ops.MUL:
+        return space.W_Int(a * b)
+    elif op == ops.LT:
+        return space.wrap(a < b)
+    elif op == ops.GT:
+        return space.wrap(a > b)
+    elif op == ops.LE:
+        return space.wrap(a <= b)
     else:
-        ret = fn.invoke(args, ctx)
-        if ret is None:
-            ret = space.w_nil
-        return ret
+        return space.wrap(a >= b)
+
+def unary_intrinsic(op, w_a):
+    "Returns a value of an intrinsic or None if the fn has to be called."
+    if op == ops.ZERO:
+        return space.wrap(isinstance(w_a, space.W_Int) and w_a.val == 0)
+    if not isinstance(w_a, space.W_Int):
+        return None
+    if op == ops.INC:
+        return space.W_Int(w_a.val + 1)
+    else:
+        return space.W_Int(w_a.val - 1)
 
 @jit.elidable
 def get_op(code, ip):
@@ -262,59 +259,106 @@ def get_op(code, ip):
 def const_len(code):
     return len(code)
 
-stack_size = 100
-empty_stack = []
+@jit.elidable
+def is_tail_call(code, ip):
+    "Tells whether a value of a call at ip is returned right away."
+    ip += 2
+    while ip < len(code) and code[ip] == ops.RELJMP:
+        ip += code[ip + 1] + 2
+    return ip >= len(code)
+
+@jit.elidable
+def get_symbol(st, id):
+    return space.symbol(st.get_sym(id))
 
-def eval(ctx, env, code):
+@jit.elidable
+def get_const(st, id):
+    # Constants are appended to the pool and never replaced.
+    return st.get_const(id)
+
+def eval(ctx, frame, code, stack_size):
     ip = 0
-    stack = empty_stack
+    stack = [None for _ in range(stack_size)]
     sp = 0
     r1 = space.w_nil
-    while ip < const_len(code):
+    # Calls of fns don't recurse, they push an Activation of a caller instead.
+    caller = None
+    while True:
         jitdriver.jit_merge_point(
                 ip=ip,
                 sp=sp,
                 stack=stack,
                 ctx=ctx,
-                env=env,
+                frame=frame,
                 code=code,
                 r1=r1,
+                caller=caller,
                 )
+        if ip >= const_len(code):
+            assert sp == 0
+            if caller is None:
+                return r1
+            code = caller.code
+            ip = caller.ip
+            frame = caller.frame
+            stack = caller.stack
+            sp = caller.sp
+            caller = caller.parent
+            continue
         assert r1 is not None
         assert sp >= 0
         op = get_op(code, ip)
+        argc = -1
+        if ops.is_intrinsic(op):
+            w_var = global_var(ctx, get_op(code, ip + 1))
+            argc = ops.intrinsic_argc(op)
+            if is_intact(w_var):
+                if argc == 1:
+                    w_res = unary_intrinsic(op, r1)
+                else:
+                    a_idx = sp - 1
+                    assert a_idx >= 0
+                    w_res = binary_intrinsic(op, stack[a_idx], r1)
+                if w_res is not None:
+                    sp -= argc - 1
+                    r1 = w_res
+                    ip += 2
+                    continue
+            # Anything else is left to the fn itself, called as by INVOKE.
+            stack[jit.promote(sp)] = r1
+            sp += 1
+            r1 = w_var.w_val
+            op = ops.INVOKE
         if op == ops.IF:
             ip += 1
             if not space.is_true(r1):
                 ip += get_op(code, ip)
         elif op == ops.SYM:
             ip += 1
-            r1 = lookup(env, ctx, get_op(code, ip))
-        elif op == ops.KEYWORD:
-            ip += 1
-            r1 = space.W_Keyword(ctx.st().get_sym(get_op(code, ip)))
-        elif op == ops.STRING:
+            r1 = lookup(ctx, get_op(code, ip))
+        elif op == ops.CONST:
             ip += 1
-            r1 = space.W_String(ctx.st().get_sym(get_op(code, ip)))
+            r1 = get_const(jit.promote(ctx.st()), get_op(code, ip))
         elif op == ops.INT:
             ip += 1
             r1 = space.W_Int(get_op(code, ip))
-        elif op == ops.PUSH_ENV:
+        elif op == ops.LOCAL:
+            depth = get_op(code, ip + 1)
+            ip += 2
+            r1 = get_local(frame, depth, get_op(code, ip))
+        elif op == ops.SET_LOCAL:
             ip += 1
-            env = Env([(get_op(code, ip), r1)], env)
-        elif op == ops.POP_ENV:
-            env = env.parent
+            frame.slots[get_op(code, ip)] = r1
         elif op == ops.QUOTE:
             ip += 1
-            r1 = space.W_Sym(ctx.st().get_sym(get_op(code, ip)))
+            r1 = get_symbol(jit.promote(ctx.st()), get_op(code, ip))
         elif op == ops.RELJMP:
             ip += get_op(code, ip + 1) + 1
         elif op == ops.FN:
             ip += 1
+            env = frame.copy() if frame is not None else None
             r1 = ctx.st().get_fn(get_op(code, ip)).with_env(env)
         elif op == ops.PUSH:
-            if stack is empty_stack:
-                stack = [None for _ in range(stack_size)]
             stack[jit.promote(sp)] = r1
             sp += 1
         elif op == ops.DEF:
@@ -324,39 +368,68 @@ def eval(ctx, env, code):
             ip += 1
             argc = jit.promote(get_op(code, ip))
             sp -= argc
-            idx = argc - 1
-            while idx >= 0:
-                ip += 1
-                env.set(get_op(code, ip), stack[jit.promote(idx + sp)])
-                idx -= 1
+            # Recur targets args of the current fn, kept in the first slots.
+            for idx in range(argc):
+                frame.slots[idx] = stack[jit.promote(idx + sp)]
             ip = -1
         elif op == ops.INVOKE:
-            r1 = invoke(ip, env, code, r1, stack, sp, ctx)
-            ip += 1
-            sp -= get_op(code, ip)
+            if argc < 0:
+                argc = jit.promote(get_op(code, ip + 1))
+            w_fn = jit.promote(r1)
+            if isinstance(w_fn, space.W_Fun):
+                w_body = select_arity(w_fn, argc)
+                callee = stack_frame(w_body, w_fn.env, stack, sp, argc)
+                sp -= argc
+                if not is_tail_call(code, ip):
+                    caller = Activation(code, ip + 2, frame, stack, sp, caller)
+                code = w_body.code
+                frame = callee
+                stack = [None for _ in range(w_body.stack_size)]
+                sp = 0
+                ip = -1
+            else:
+                r1 = invoke_bif(w_fn, stack, sp, argc, ctx)
+                sp -= argc
+                ip += 1
         elif op == ops.APPLY:
-            r1 = apply(ip, env, code, r1, stack, sp, ctx)
-            ip += 1
             sp -= 2
+            w_fn = stack[sp]
+            args_w = space.unwrap(stack[sp + 1])
+            if isinstance(w_fn, space.W_Fun):
+                w_body = select_arity(w_fn, len(args_w))
+                callee = args_frame(w_body, w_fn.env, args_w)
+                if not is_tail_call(code, ip):
+                    caller = Activation(code, ip + 2, frame, stack, sp, caller)
+                code = w_body.code
+                frame = callee
+                stack = [None for _ in range(w_body.stack_size)]
+                sp = 0
+                ip = -1
+            else:
+                r1 = w_fn.invoke(args_w, ctx)
+                if r1 is None:
+                    r1 = space.w_nil
+                ip += 1
         elif op == ops.TRY:
             ip += 1
             finally_id = get_op(code, ip)
             try:
                 assert isinstance(r1, space.W_Fun)
-                r1 = eval(ctx, env, r1.code)
+                r1 = eval(ctx, call_frame(r1, r1.env), r1.code, r1.stack_size)
                 ip += get_op(code, ip + 1)
             except space.SpaceException as ex:
                 if get_op(code, ip + 1) == 1:
                     raise ex
-                if stack is empty_stack:
-                    stack = [None for _ in range(stack_size)]
                 stack[jit.promote(sp)] = space.wrap(ex.reason())
                 sp += 1
                 ip += 1
             finally:
                 if finally_id >= 0:
-                    finally_fn = ctx.st().get_fn(finally_id).with_env(env)
-                    eval(ctx, env, finally_fn.code)
+                    finally_fn = ctx.st().get_fn(finally_id)
+                    # It runs in place, so it may refer to this very frame.
+                    eval(ctx, Frame([None for _ in range(finally_fn.nslots)],
+                                    frame), finally_fn.code,
+                         finally_fn.stack_size)
         elif op == ops.CHAR:
             ip += 1
             r1 = space.W_Char(get_op(code, ip))
@@ -364,5 +437,3 @@ def eval(ctx, env, code):
             raise Exception("Unknown code: %s, ip %s, code %s" %
                     (str(op), ip, str(code)))
         ip += 1
-    assert sp == 0
-    return r1
@@ -0,0 +1,655 @@
+"Snapshots of a booted Context which can be loaded instead of core.clj."
+
+from rpython.rlib.objectmodel import r_dict, compute_identity_hash
+from rpython.rlib.rstring import StringBuilder
+
+import space
+import builtins
+import ops
+from eval import Context, Frame
+
+magic = "psota-image"
+format_version = 11
+
+(
+        NIL,
+        TRUE,
+        FALSE,
+        EMPTY_LIST,
+        TYPE,
+        LIST,
+        LAZY_SEQ,
+        VECTOR,
+        SYM,
+        CHAR,
+        STRING,
+        KEYWORD,
+        INT,
+        FUN,
+        BIF,
+        ARRAY_MAP,
+        HASH_MAP,
+        VAR,
+        ATOM,
+        ARRAY_CHUNK,
+        CHUNKED_SEQ,
+        CHUNKED_CONS,
+        STRING_SEQ,
+        WRITER,
+        EDUCTION,
+        ) = range(25)
+
+def _known_types():
+    types = {}
+    for obj in space.__dict__.values():
+        w_type = getattr(obj, "_type", None)
+        if isinstance(w_type, space.W_Type):
+            types[w_type.name] = w_type
+    return types
+
+types_by_name = _known_types()
+
+def _bif_name(w_bif):
+    for (name, w_val) in builtins.core + builtins.string:
+        if w_val is w_bif:
+            return name
+    raise space.ImageException("Cannot dump an unnamed builtin %s" %
+            w_bif.to_str())
+
+def _bif_by_name(name):
+    for (sym, w_val) in builtins.core + builtins.string:
+        if sym == name and isinstance(w_val, space.W_BIF):
+            return w_val
+    raise space.ImageException("Unknown builtin in image: %s" % name)
+
+class Writer:
+    def __init__(self):
+        self.builder = StringBuilder()
+
+    def int(self, val):
+        self.builder.append(str(val))
+        self.builder.append(" ")
+
+    def str(self, val):
+        self.int(len(val))
+        self.builder.append(val)
+
+    def build(self):
+        return self.builder.build()
+
+def _is_int(data, start, end):
+    if start < end and data[start] == "-":
+        start += 1
+    # Longer numbers wouldn't fit into a machine word.
+    if start == end or end - start > 18:
+        return False
+    for idx in range(start, end):
+        if not "0" <= data[idx] <= "9":
+            return False
+    return True
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def int(self):
+        end = self.data.find(" ", self.pos)
+        if end < 0:
+            raise space.ImageException("Truncated image")
+        start = self.pos
+        assert start >= 0
+        self.pos = end + 1
+        if not _is_int(self.data, start, end):
+            raise space.ImageException("Corrupt image")
+        return int(self.data[start:end])
+
+    def str(self):
+        length = self.int()
+        start = self.pos
+        end = start + length
+        if length < 0 or end > len(self.data):
+            raise space.ImageException("Truncated image")
+        assert start >= 0 and end >= 0
+        self.pos = end
+        return self.data[start:end]
+
+def _same(a, b):
+    return a is b
+
+def _identity_hash(x):
+    return compute_identity_hash(x)
+
+class _Dumper:
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.values_w = []
+        self.value_ids = {}
+        self.envs = []
+        self.env_ids = {}
+        self.codes = []
+        # Code lists are compared by identity, as they aren't hashable.
+        self.code_ids = r_dict(_same, _identity_hash)
+        self.refs = Writer()
+
+    def value_id(self, w_val):
+        if w_val is None:
+            return -1
+        id = self.value_ids.get(w_val, -1)
+        if id < 0:
+            id = len(self.values_w)
+            self.value_ids[w_val] = id
+            self.values_w.append(w_val)
+        return id
+
+    def env_id(self, env):
+        if env is None:
+            return -1
+        id = self.env_ids.get(env, -1)
+        if id < 0:
+            id = len(self.envs)
+            self.env_ids[env] = id
+            self.envs.append(env)
+        return id
+
+    def code_id(self, code):
+        # Closures share code lists with the fns kept in the symbol table.
+        id = self.code_ids.get(code, -1)
+        if id < 0:
+            id = len(self.codes)
+            self.code_ids[code] = id
+            self.codes.append(code)
+        return id
+
+    def dump(self):
+        st = self.ctx.st()
+        bindings = self.ctx.bindings()
+        fn_ids = [self.value_id(w_fn) for w_fn in st.fns]
+        const_ids = [self.value_id(w_const) for w_const in st.consts]
+        nss = bindings.vars.keys()
+        ns_vars = []
+        for ns in nss:
+            vars = bindings.vars[ns]
+            ns_vars.append([(sym_id, self.value_id(vars[sym_id]))
+                            for sym_id in vars.keys()])
+        self.traverse()
+        out = Writer()
+        out.str(magic)
+        out.int(format_version)
+        out.int(len(st.syms))
+        for sym in st.syms:
+            out.str(sym)
+        macros = st.macros.keys()
+        out.int(len(macros))
+        for name in macros:
+            out.str(name)
+            out.int(st.macros[name])
+        out.int(len(self.codes))
+        for code in self.codes:
+            write_ints(out, code)
+        out.int(len(self.envs))
+        out.int(len(self.values_w))
+        for w_val in self.values_w:
+            self.write_scalars(out, w_val)
+        out.builder.append(self.refs.build())
+        for env in self.envs:
+            self.write_env(out, env)
+        write_ints(out, fn_ids)
+        write_ints(out, const_ids)
+        out.str(bindings.ns)
+        out.int(bindings.version)
+        out.int(len(nss))
+        idx = 0
+        while idx < len(nss):
+            out.str(nss[idx])
+            out.int(len(ns_vars[idx]))
+            for (sym_id, var_id) in ns_vars[idx]:
+                out.int(sym_id)
+                out.int(var_id)
+            idx += 1
+        return out.build()
+
+    def traverse(self):
+        idx = 0
+        env_idx = 0
+        while idx < len(self.values_w) or env_idx < len(self.envs):
+            if idx < len(self.values_w):
+                self.write_refs(self.values_w[idx])
+                idx += 1
+            else:
+                env = self.envs[env_idx]
+                self.env_id(env.parent)
+                for w_val in env.slots:
+                    self.value_id(w_val)
+                env_idx += 1
+
+    def write_scalars(self, out, w_val):
+        if w_val is space.w_nil:
+            out.int(NIL)
+        elif w_val is space.w_true:
+            out.int(TRUE)
+        elif w_val is space.w_false:
+            out.int(FALSE)
+        elif w_val is space.w_empty_list:
+            out.int(EMPTY_LIST)
+        elif isinstance(w_val, space.W_Type):
+            out.int(TYPE)
+            out.str(w_val.name)
+        elif isinstance(w_val, space.W_List):
+            out.int(LIST)
+        elif isinstance(w_val, space.W_Eduction):
+            out.int(EDUCTION)
+        elif isinstance(w_val, space.W_LazySeq):
+            out.int(LAZY_SEQ)
+        elif isinstance(w_val, space.W_Vector):
+            out.int(VECTOR)
+            out.int(w_val.count())
+        elif isinstance(w_val, space.W_Sym):
+            out.int(SYM)
+            out.str(w_val.val)
+            out.int(0 if w_val.meta() is space.w_nil else 1)
+        elif isinstance(w_val, space.W_Char):
+            out.int(CHAR)
+            out.int(w_val.val)
+        elif isinstance(w_val, space.W_String):
+            out.int(STRING)
+            out.str(w_val.val)
+        elif isinstance(w_val, space.W_Keyword):
+            out.int(KEYWORD)
+            out.str(w_val.val)
+        elif isinstance(w_val, space.W_Int):
+            out.int(INT)
+            out.int(w_val.val)
+        elif isinstance(w_val, space.W_Fun):
+            out.int(FUN)
+            out.int(self.code_id(w_val.code))
+            write_ints(out, w_val.arg_ids)
+            out.int(w_val.rest_args_id)
+            out.int(w_val.nslots)
+            out.int(self.env_id(w_val.env))
+            out.int(-1 if w_val.arities is None else len(w_val.arities))
+        elif isinstance(w_val, space.W_BIF):
+            out.int(BIF)
+            out.str(_bif_name(w_val))
+            if isinstance(w_val, builtins.Gensym):
+                out.int(w_val.counter)
+        elif isinstance(w_val, space.W_ArrayMap):
+            out.int(ARRAY_MAP)
+            out.int(len(w_val.kvs))
+        elif isinstance(w_val, space.W_HashMap):
+            out.int(HASH_MAP)
+            out.int(w_val.cnt)
+        elif isinstance(w_val, space.W_Var):
+            out.int(VAR)
+            out.str(w_val.ns)
+            out.str(w_val.sym)
+            out.int(1 if w_val.redefined else 0)
+        elif isinstance(w_val, space.W_Atom):
+            out.int(ATOM)
+        elif isinstance(w_val, space.W_ArrayChunk):
+            out.int(ARRAY_CHUNK)
+            out.int(w_val.count())
+        elif isinstance(w_val, space.W_ChunkedSeq):
+            out.int(CHUNKED_SEQ)
+            # Dumped vectors start at their first element.
+            out.int(w_val.idx - w_val.w_vec.start)
+        elif isinstance(w_val, space.W_ChunkedCons):
+            out.int(CHUNKED_CONS)
+        elif isinstance(w_val, space.W_StringSeq):
+            out.int(STRING_SEQ)
+            out.str(w_val.val)
+            out.int(w_val.idx)
+        elif isinstance(w_val, space.W_Writer):
+            out.int(WRITER)
+            out.int(w_val.fd)
+        else:
+            raise space.ImageException("Cannot dump %s" % w_val.to_str())
+
+    def write_refs(self, w_val):
+        refs = self.refs
+        if isinstance(w_val, space.W_EmptyList):
+            pass
+        elif isinstance(w_val, space.W_List):
+            refs.int(self.value_id(w_val.head))
+            refs.int(self.value_id(w_val.tail))
+        elif isinstance(w_val, space.W_LazySeq):
+            if isinstance(w_val, space.W_Eduction):
+                refs.int(self.value_id(w_val.w_xform))
+                refs.int(self.value_id(w_val.w_coll))
+            promise = w_val.promise
+            if promise is None:
+                refs.int(1)
+                refs.int(self.value_id(w_val.delivery))
+            else:
+                refs.int(0)
+                refs.int(self.value_id(promise.w_fn))
+        elif isinstance(w_val, space.W_Vector):
+            for w_elem in w_val.elems():
+                refs.int(self.value_id(w_elem))
+            refs.int(self.value_id(w_val.meta()))
+        elif isinstance(w_val, space.W_Sym):
+            refs.int(self.value_id(w_val.meta()))
+        elif isinstance(w_val, space.W_Fun):
+            self.code_id(w_val.code)
+            self.env_id(w_val.env)
+            if w_val.arities is not None:
+                for w_body in w_val.arities:
+                    refs.int(self.value_id(w_body))
+        elif isinstance(w_val, space.W_Map):
+            for w_elem in w_val.elems():
+                refs.int(self.value_id(w_elem))
+            refs.int(self.value_id(w_val.meta()))
+        elif isinstance(w_val, space.W_Var):
+            refs.int(self.value_id(w_val.w_val))
+            refs.int(self.value_id(w_val.meta()))
+        elif isinstance(w_val, space.W_Atom):
+            refs.int(self.value_id(w_val.val))
+        elif isinstance(w_val, space.W_ArrayChunk):
+            for idx in range(w_val.count()):
+                refs.int(self.value_id(w_val.nth(idx, space.w_nil)))
+        elif isinstance(w_val, space.W_ChunkedSeq):
+            refs.int(self.value_id(w_val.w_vec))
+        elif isinstance(w_val, space.W_ChunkedCons):
+            refs.int(self.value_id(w_val.w_chunk))
+            refs.int(self.value_id(w_val.w_more))
+
+    def write_env(self, out, env):
+        out.int(self.env_id(env.parent))
+        out.int(len(env.slots))
+        for w_val in env.slots:
+            out.int(self.value_id(w_val))
+
+def write_ints(out, ints):
+    out.int(len(ints))
+    for val in ints:
+        out.int(val)
+
+def read_ints(inp):
+    return [inp.int() for _ in range(inp.int())]
+
+class _Loader:
+    def __init__(self, data):
+        self.inp = Reader(data)
+        self.ctx = Context()
+        self.values_w = []
+        self.kinds = []
+        self.envs = []
+        self.codes = []
+        self.pending_maps = {}
+
+    def value(self, id):
+        if id < 0:
+            return None
+        return self.values_w[id]
+
+    def env(self, id):
+        if id < 0:
+            return None
+        return self.envs[id]
+
+    def load(self):
+        inp = self.inp
+        if inp.str() != magic or inp.int() != format_version:
+            raise space.ImageException("Not a compatible psota image")
+        st = self.ctx.st()
+        st.syms = [inp.str() for _ in range(inp.int())]
+        st.sym_ids = {}
+        idx = 0
+        while idx < len(st.syms):
+            st.sym_ids[st.syms[idx]] = idx
+            idx += 1
+        st.macros = {}
+        for _ in range(inp.int()):
+            name = inp.str()
+            st.macros[name] = inp.int()
+        self.codes = [read_ints(inp) for _ in range(inp.int())]
+        self.envs = [Frame([]) for _ in range(inp.int())]
+        for _ in range(inp.int()):
+            self.read_scalars()
+        idx = 0
+        while idx < len(self.values_w):
+            self.read_refs(self.kinds[idx], self.values_w[idx])
+            idx += 1
+        for env in self.envs:
+            self.read_env(env)
+        for w_map in self.pending_maps.keys():
+            self.fill_map(w_map)
+        st.fns = []
+        for id in read_ints(inp):
+            st.fns.append(space.cast(self.value(id), space.W_Fun))
+        st.set_consts([self.value(id) for id in read_ints(inp)])
+        bindings = self.ctx.bindings()
+        bindings.ns = inp.str()
+        bindings.version = inp.int()
+        bindings.vars = {}
+        for _ in range(inp.int()):
+            ns = inp.str()
+            vars = {}
+            for _ in range(inp.int()):
+                sym_id = inp.int()
+                vars[sym_id] = space.cast(self.value(inp.int()), space.W_Var)
+            bindings.vars[ns] = vars
+        return self.ctx
+
+    def read_scalars(self):
+        inp = self.inp
+        kind = inp.int()
+        if kind == NIL:
+            w_val = space.w_nil
+        elif kind == TRUE:
+            w_val = space.w_true
+        elif kind == FALSE:
+            w_val = space.w_false
+        elif kind == EMPTY_LIST:
+            w_val = space.w_empty_list
+        elif kind == TYPE:
+            name = inp.str()
+            w_val = types_by_name.get(name, None)
+            if w_val is None:
+                raise space.ImageException("Unknown type in image: %s" % name)
+        elif kind == LIST:
+            w_val = space.W_List(space.w_nil, space.w_empty_list)
+        elif kind == LAZY_SEQ:
+            w_val = space.W_LazySeq(builtins.LazySeq.Promise(None, self.ctx))
+        elif kind == EDUCTION:
+            w_val = space.W_Eduction(builtins.LazySeq.Promise(None, self.ctx),
+                                     space.w_nil, space.w_nil)
+        elif kind == VECTOR:
+            elems_w = [space.w_nil for _ in range(inp.int())]
+            # A fresh shell even if empty, as its meta is patched in later.
+            w_val = space.vector(elems_w).with_meta(space.w_nil)
+        elif kind == SYM:
+            name = inp.str()
+            if inp.int() == 0:
+                w_val = space.symbol(name)
+            else:
+                # Symbols with meta aren't interned.
+                w_val = space.W_Sym(name)
+        elif kind == CHAR:
+            w_val = space.W_Char(inp.int())
+        elif kind == STRING:
+            w_val = space.W_String(inp.str())
+        elif kind == KEYWORD:
+            w_val = space.keyword(inp.str())
+        elif kind == INT:
+            w_val = space.W_Int(inp.int())
+        elif kind == FUN:
+            code = self.codes[inp.int()]
+            arg_ids = read_ints(inp)
+            rest_args_id = inp.int()
+            nslots = inp.int()
+            env = self.env(inp.int())
+            arities_len = inp.int()
+            arities_w = None
+            if arities_len >= 0:
+                arities_w = [None for _ in range(arities_len)]
+            w_val = space.W_Fun(code, arg_ids, rest_args_id, nslots,
+                    ops.stack_depth(code), env, arities_w)
+        elif kind == BIF:
+            w_val = _bif_by_name(inp.str())
+            if isinstance(w_val, builtins.Gensym):
+                w_val.counter = inp.int()
+        elif kind == ARRAY_MAP:
+            w_val = space.W_ArrayMap([space.w_nil for _ in range(inp.int())])
+        elif kind == HASH_MAP:
+            w_val = space.W_HashMap()
+            self.pending_maps[w_val] = [space.w_nil
+                                        for _ in range(2 * inp.int())]
+        elif kind == VAR:
+            ns = inp.str()
+            w_val = space.W_Var(ns, inp.str(), space.w_nil)
+            w_val.redefined = inp.int() == 1
+        elif kind == ATOM:
+            w_val = space.W_Atom(space.w_nil)
+        elif kind == ARRAY_CHUNK:
+            values_w = [space.w_nil for _ in range(inp.int())]
+            w_val = space.W_ArrayChunk(values_w, 0, len(values_w))
+        elif kind == CHUNKED_SEQ:
+            w_val = space.W_ChunkedSeq(space.w_empty_vector, 0)
+            w_val.idx = inp.int()
+        elif kind == CHUNKED_CONS:
+            w_val = space.W_ChunkedCons(space.W_ArrayChunk([], 0, 0),
+                    space.w_nil)
+        elif kind == STRING_SEQ:
+            val = inp.str()
+            w_val = space.W_StringSeq(val, inp.int())
+        elif kind == WRITER:
+            fd = inp.int()
+            if fd == builtins.stdout.fd:
+                w_val = builtins.stdout
+            elif fd == builtins.stderr.fd:
+                w_val = builtins.stderr
+            else:
+                raise space.ImageException("Unknown writer in image: %s" % fd)
+        else:
+            raise space.ImageException("Unknown value kind in image: %s" %
+                    kind)
+        self.values_w.append(w_val)
+        self.kinds.append(kind)
+
+    def read_refs(self, kind, w_val):
+        inp = self.inp
+        if kind == LIST:
+            assert isinstance(w_val, space.W_List)
+            w_val.head = self.value(inp.int())
+            w_val.tail = space.cast(self.value(inp.int()), space.W_Seq)
+        elif kind == LAZY_SEQ or kind == EDUCTION:
+            assert isinstance(w_val, space.W_LazySeq)
+            if isinstance(w_val, space.W_Eduction):
+                w_val.w_xform = self.value(inp.int())
+                w_val.w_coll = self.value(inp.int())
+            if inp.int() == 1:
+                w_val.promise = None
+                w_val.delivery = self.value(inp.int())
+            else:
+                w_fn = space.cast(self.value(inp.int()), space.W_Fun)
+                w_val.promise = builtins.LazySeq.Promise(w_fn, self.ctx)
+        elif kind == VECTOR:
+            assert isinstance(w_val, space.W_Vector)
+            elems_w = [space.w_nil for _ in range(w_val.count())]
+            self.read_values(elems_w)
+            # Leaves of a fresh vector are aligned and filled in order.
+            idx = 0
+            while idx < len(elems_w):
+                leaf = w_val.array_for(idx)
+                for offset in range(len(leaf)):
+                    leaf[offset] = elems_w[idx + offset]
+                idx += len(leaf)
+            w_val.w_meta = self.value(inp.int())
+        elif kind == SYM:
+            assert isinstance(w_val, space.W_Sym)
+            w_meta = self.value(inp.int())
+            if w_meta is not space.w_nil:
+                w_val.w_meta = w_meta
+        elif kind == FUN:
+            assert isinstance(w_val, space.W_Fun)
+            if w_val.arities is not None:
+                for argc in range(len(w_val.arities)):
+                    w_body = self.value(inp.int())
+                    if w_body is not None:
+                        w_val.arities[argc] = space.cast(w_body, space.W_Fun)
+        elif kind == ARRAY_MAP:
+            assert isinstance(w_val, space.W_ArrayMap)
+            self.read_values(w_val.kvs)
+            w_val.w_meta = self.value(inp.int())
+        elif kind == HASH_MAP:
+            assert isinstance(w_val, space.W_HashMap)
+            self.read_values(self.pending_maps[w_val])
+            w_val.w_meta = self.value(inp.int())
+        elif kind == VAR:
+            assert isinstance(w_val, space.W_Var)
+            w_val.w_val = self.value(inp.int())
+            w_val.w_meta = self.value(inp.int())
+        elif kind == ATOM:
+            assert isinstance(w_val, space.W_Atom)
+            w_val.val = self.value(inp.int())
+        elif kind == ARRAY_CHUNK:
+            assert isinstance(w_val, space.W_ArrayChunk)
+            self.read_values(w_val.values)
+        elif kind == CHUNKED_SEQ:
+            assert isinstance(w_val, space.W_ChunkedSeq)
+            w_vec = space.cast(self.value(inp.int()), space.W_Vector)
+            w_val.w_vec = w_vec
+            w_val.leaf = w_vec.array_for(w_val.idx)
+            w_val.offset = w_vec.offset(w_val.idx)
+        elif kind == CHUNKED_CONS:
+            assert isinstance(w_val, space.W_ChunkedCons)
+            w_val.w_chunk = space.cast(self.value(inp.int()),
+                    space.W_ArrayChunk)
+            w_val.w_more = self.value(inp.int())
+
+    def read_values(self, values_w):
+        idx = 0
+        while idx < len(values_w):
+            values_w[idx] = self.value(self.inp.int())
+            idx += 1
+
+    def read_env(self, env):
+        inp = self.inp
+        env.parent = self.env(inp.int())
+        env.slots = [self.value(inp.int()) for _ in range(inp.int())]
+
+    def fill_map(self, w_map):
+        kvs_w = self.pending_maps.get(w_map, None)
+        if kvs_w is None:
+            return
+        del self.pending_maps[w_map]
+        idx = 0
+        while idx < len(kvs_w):
+            self.settle(kvs_w[idx])
+            idx += 2
+        w_filled = space.hash_map(kvs_w)
+        w_map.cnt = w_filled.cnt
+        w_map.root = w_filled.root
+
+    def settle(self, w_key):
+        "Fills hash maps nested in a key before the key gets hashed."
+        if isinstance(w_key, space.W_HashMap):
+            self.fill_map(w_key)
+        elif isinstance(w_key, space.W_Vector):
+            for w_elem in w_key.elems():
+                self.settle(w_elem)
+        elif isinstance(w_key, space.W_ArrayMap):
+            for w_elem in w_key.kvs:
+                self.settle(w_elem)
+        elif isinstance(w_key, space.W_List):
+            while w_key is not space.w_empty_list:
+                assert isinstance(w_key, space.W_List)
+                self.settle(w_key.head)
+                w_key = w_key.tail
+
+def dump(ctx, filename):
+    data = _Dumper(ctx).dump()
+    f = open(filename, "w")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def load(filename):
+    f = open(filename)
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    return _Loader(data).load()
@@ -1,9 +1,9 @@
 "Op codes of the virtual machine."
 (
-        KEYWORD,
+        CONST,
         IF,
-        PUSH_ENV,
-        POP_ENV,
+        LOCAL,
+        SET_LOCAL,
         SYM,
         INT,
         QUOTE,
@@ -14,7 +14,98 @@
         PUSH,
         APPLY,
         RECUR,
-        STRING,
         TRY,
         CHAR,
-        ) = range(17)
+        ADD,
+        SUB,
+        MUL,
+        LT,
+        GT,
+        LE,
+        GE,
+        EQ,
+        INC,
+        DEC,
+        ZERO,
+        ) = range(27)
+
+# Kinds of operands which follow op codes.
+(
+        IMMEDIATE,
+        SYM_ID,
+        FN_ID,
+        CONST_ID,
+        ) = range(4)
+
+operands = {
+        CONST: [CONST_ID],
+        IF: [IMMEDIATE],
+        # A depth of a frame followed by a slot in it.
+        LOCAL: [IMMEDIATE, IMMEDIATE],
+        SET_LOCAL: [IMMEDIATE],
+        SYM: [SYM_ID],
+        INT: [IMMEDIATE],
+        QUOTE: [SYM_ID],
+        RELJMP: [IMMEDIATE],
+        FN: [FN_ID],
+        INVOKE: [IMMEDIATE],
+        DEF: [SYM_ID],
+        PUSH: [],
+        APPLY: [IMMEDIATE],
+        RECUR: [IMMEDIATE],
+        TRY: [FN_ID, IMMEDIATE],
+        CHAR: [IMMEDIATE],
+        }
+
+# Calls of core fns which get ops of their own. Operands of an intrinsic are
+# evaluated as for a call, the last one left in r1, and the op refers to a
+# symbol of the fn called instead if its var has been redefined.
+binary_intrinsics = {
+        "+": ADD,
+        "-": SUB,
+        "*": MUL,
+        "<": LT,
+        ">": GT,
+        "<=": LE,
+        ">=": GE,
+        "=": EQ,
+        }
+
+unary_intrinsics = {
+        "inc": INC,
+        "dec": DEC,
+        "zero?": ZERO,
+        }
+
+for op in binary_intrinsics.values() + unary_intrinsics.values():
+    operands[op] = [SYM_ID]
+
+def is_intrinsic(op):
+    return op >= ADD
+
+def intrinsic_argc(op):
+    return 1 if op >= INC else 2
+
+def stack_depth(code):
+    "Returns the largest number of values code keeps on the stack at once."
+    depth = 0
+    max_depth = 0
+    ip = 0
+    while ip < len(code):
+        op = code[ip]
+        if op == PUSH:
+            depth += 1
+        elif op == INVOKE or op == APPLY or op == RECUR:
+            depth -= code[ip + 1]
+        elif op == TRY and code[ip + 2] != 1:
+            # A caught exception is pushed for its handler.
+            depth += 1
+        elif is_intrinsic(op):
+            # Calling a redefined fn pushes the last arg as well.
+            if depth + 1 > max_depth:
+                max_depth = depth + 1
+            depth -= intrinsic_argc(op) - 1
+        if depth > max_depth:
+            max_depth = depth
+        ip += 1 + len(operands[op])
+    return max_depth
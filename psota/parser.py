@@ -1,153 +1,269 @@
-from rpython.rlib.parsing.pypackrat import PackratParser
-from rpython.rlib.parsing.makepackrat import BacktrackException, Status
-
-from space import (W_Int, W_Sym, W_Vector, wrap, W_ArrayMap, W_Keyword,
-        W_Char, ParsingException)
-
-# Most of the parser has been taken from lang-scheme. You can find it at
-# https://bitbucket.org/pypy/lang-scheme/src/b1d5a1b8744f/scheme/ssparser.py
-
-def str_unquote(s):
-    str_lst = []
-    pos = 1
-    last = len(s)-1
-    while pos < last:
-        ch = s[pos]
-        if ch == '\\':
-            pos += 1
-            ch = s[pos]
-            if ch == '\\' or ch == '\"':
-                str_lst.append(ch)
-            elif ch == 'n':
-                str_lst.append("\n")
+import os
+from rpython.rlib.rstring import StringBuilder
+
+import space
+from space import W_Int, vector, wrap, W_ArrayMap, W_Char, ParsingException
+
+chunk_size = 64 * 1024
+
+whitespace = " ,\n\t\r"
+
+def _is_alpha(c):
+    return 'a' <= c <= 'z' or 'A' <= c <= 'Z'
+
+def _is_digit(c):
+    return '0' <= c <= '9'
+
+def _starts_keyword(c):
+    return c != "" and (_is_alpha(c) or c in "+-*^?!<=>_/$%&:")
+
+def _starts_symbol(c):
+    return _starts_keyword(c) or c == "~"
+
+def _continues_keyword(c):
+    return _starts_symbol(c) or _is_digit(c) or c == "."
+
+def _continues_symbol(c):
+    return _continues_keyword(c) or c == "#"
+
+class _LambdaArgs:
+    "Arguments referred to by a body of a #() literal."
+
+    def __init__(self, id):
+        self.id = id
+        self.arity = 0
+        self.rest = False
+
+    def param(self, n):
+        return space.symbol("p%d__%d#" % (n, self.id))
+
+    def rest_param(self):
+        return space.symbol("rest__%d#" % self.id)
+
+    def lookup(self, name):
+        "Returns a param replacing a %-symbol or None if name isn't one."
+        if name == "%":
+            name = "%1"
+        if name == "%&":
+            self.rest = True
+            return self.rest_param()
+        idx = 1
+        while idx < len(name):
+            if not _is_digit(name[idx]):
+                return None
+            idx += 1
+        n = int(name[1:])
+        if n < 1:
+            return None
+        if n > self.arity:
+            self.arity = n
+        return self.param(n)
+
+class Reader:
+    """Reads forms one at a time from a string or a file descriptor.
+
+    Input is consumed in chunks and only a form which is being read is held
+    in memory.
+    """
+
+    def __init__(self, buf, fd=-1):
+        self.buf = buf
+        self.pos = 0
+        self.fd = fd
+        self.lambda_args = None
+        self.lambdas = 0
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def peek(self):
+        "Returns the current character or an empty string at the end."
+        if self.pos == len(self.buf):
+            if self.fd < 0:
+                return ""
+            self.buf = os.read(self.fd, chunk_size)
+            self.pos = 0
+            if self.buf == "":
+                return ""
+        return self.buf[self.pos]
+
+    def next(self):
+        c = self.peek()
+        if c == "":
+            raise ParsingException("Unexpected end of input")
+        self.pos += 1
+        return c
+
+    def skip_ignored(self):
+        while True:
+            c = self.peek()
+            if c == ";":
+                while c != "" and c != "\n":
+                    self.pos += 1
+                    c = self.peek()
+            elif c != "" and c in whitespace:
+                self.pos += 1
             else:
-                raise Exception("syntax error: " + s)
+                return
+
+    def read(self):
+        "Returns the next top level form or None if the input is over."
+        self.skip_ignored()
+        if self.peek() == "":
+            return None
+        return self.sexpr()
+
+    def sexpr(self):
+        c = self.peek()
+        if c == "(":
+            self.pos += 1
+            return wrap(self.seq(")"))
+        elif c == "[":
+            self.pos += 1
+            return vector(self.seq("]"))
+        elif c == "{":
+            self.pos += 1
+            kvs = self.seq("}")
+            if len(kvs) % 2 != 0:
+                raise ParsingException("A map literal with an odd number "
+                        "of forms")
+            return W_ArrayMap(kvs)
+        elif c == "'":
+            self.pos += 1
+            return wrap([space.symbol("quote"), self.sexpr()])
+        elif c == "`":
+            self.pos += 1
+            return wrap([space.symbol("qquote"), self.sexpr()])
+        elif c == "~":
+            self.pos += 1
+            c = self.peek()
+            if c == "" or c in whitespace or c in ")]}":
+                return self.symbol("~")
+            return wrap([space.symbol("~"), self.sexpr()])
+        elif c == "#":
+            self.pos += 1
+            if self.peek() != "(":
+                raise ParsingException("Expected a list after #")
+            return self.lambda_expr()
+        elif c == '"':
+            self.pos += 1
+            return self.string()
+        elif c == "\\":
+            self.pos += 1
+            return self.char()
+        elif _is_digit(c):
+            return self.number("")
+        elif c == "-":
+            self.pos += 1
+            if _is_digit(self.peek()):
+                return self.number("-")
+            return self.symbol("-")
+        elif c == ":":
+            self.pos += 1
+            if _starts_keyword(self.peek()):
+                return self.keyword()
+            return self.symbol(":")
+        elif _starts_symbol(c):
+            self.pos += 1
+            return self.symbol(c)
+        elif c == "":
+            raise ParsingException("Unexpected end of input")
         else:
-            str_lst.append(ch)
-        pos += 1
-    return ''.join(str_lst)
-
-class QuoppaParser(PackratParser):
-    r"""
-    SYMBOL:
-        c = `[\+\-\*\^\?a-zA-Z!<=>_~/$%&:][#\+\-\*\^\?a-zA-Z0-9!<=>_~/$%&:.]*`
-        IGNORE*
-        return {W_Sym(c)};
-
-    keyword:
-        `:`
-        c = `[\+\-\*\^\?a-zA-Z!<=>_/$%&:][\+\-\*\^\?a-zA-Z0-9!<=>_~/$%&:.]*`
-        IGNORE*
-        return {W_Keyword(c)};
-
-    FIXNUM:
-        c = `\-?(0|([1-9][0-9]*))`
-        IGNORE*
-        return {W_Int(int(c))};
-
-    IGNORE:
-        ` |,|\n|\t|;[^\n]*`;
-
-    STRING:
-        c = `\"([^\\\"]|\\\"|\\\\|\\n)*\"`
-        IGNORE*
-        return {wrap(str_unquote(c))};
-
-    CHAR:
-        '\'
-        c = `[^ \n\t][a-z]*`
-        IGNORE*
-        return {char(c)};
-
-    EOF:
-        !__any__;
-
-    file:
-        IGNORE*
-        s = sexpr*
-        EOF
-        return {s};
-
-    quote:
-       `'`
-       s = sexpr
-       return {quote(s)};
-
-    quasiquote:
-       `\``
-       s = sexpr
-       return {quasiquote(s)};
-
-    unquote:
-       `~`
-       s = sexpr
-       return {unquote(s)};
-
-    lambda_expr:
-       `#`
-       s = list
-       return {lambda_expr(s)};
-
-    sexpr:
-        list
-      | vector
-      | map
-      | quote
-      | quasiquote
-      | unquote
-      | lambda_expr
-      | FIXNUM
-      | keyword
-      | STRING
-      | CHAR
-      | SYMBOL;
-
-    vector:
-        '['
-        IGNORE*
-        s = sexpr*
-        ']'
-        IGNORE*
-        return {W_Vector(s)};
-
-    list:
-        '('
-        IGNORE*
-        s = sexpr*
-        ')'
-        IGNORE*
-        return {wrap(s)};
-
-    map:
-        '{'
-        IGNORE*
-        s = sexpr*
-        '}'
-        IGNORE*
-        return {map(s)};
-    """
+            raise ParsingException("Unexpected character: %s" % c)
+
+    def seq(self, closing):
+        self.skip_ignored()
+        elems_w = []
+        while self.peek() != closing:
+            elems_w.append(self.sexpr())
+        self.pos += 1
+        self.skip_ignored()
+        return elems_w
+
+    def token(self, prefix, continues):
+        builder = StringBuilder()
+        builder.append(prefix)
+        c = self.peek()
+        while continues(c):
+            builder.append(c)
+            self.pos += 1
+            c = self.peek()
+        self.skip_ignored()
+        return builder.build()
+
+    def symbol(self, prefix):
+        name = self.token(prefix, _continues_symbol)
+        if self.lambda_args is not None and name[0] == "%":
+            w_param = self.lambda_args.lookup(name)
+            if w_param is not None:
+                return w_param
+        return space.symbol(name)
 
-def parse(code):
-    try:
-        p = QuoppaParser(code)
-        return p.file()
-    except Exception as ex:
-        raise ParsingException(str(ex))
+    def lambda_expr(self):
+        "Reads #(...) into (fn* [p1 ... pn & rest] (...))."
+        outer = self.lambda_args
+        args = _LambdaArgs(self.lambdas)
+        self.lambdas += 1
+        self.lambda_args = args
+        try:
+            w_body = self.sexpr()
+        finally:
+            self.lambda_args = outer
+        params_w = [args.param(n) for n in range(1, args.arity + 1)]
+        if args.rest:
+            params_w.append(space.symbol("&"))
+            params_w.append(args.rest_param())
+        return wrap([space.symbol("fn*"), vector(params_w), w_body])
 
-def quote(sexpr):
-    return wrap([W_Sym('quote'), sexpr])
+    def keyword(self):
+        return space.keyword(self.token("", _continues_keyword))
+
+    def number(self, prefix):
+        builder = StringBuilder()
+        builder.append(prefix)
+        c = self.next()
+        builder.append(c)
+        if c != "0":
+            while _is_digit(self.peek()):
+                builder.append(self.next())
+        self.skip_ignored()
+        return W_Int(int(builder.build()))
+
+    def string(self):
+        builder = StringBuilder()
+        c = self.next()
+        while c != '"':
+            if c == "\\":
+                c = self.next()
+                if c == "\\" or c == '"':
+                    builder.append(c)
+                elif c == "n":
+                    builder.append("\n")
+                else:
+                    raise ParsingException("Invalid escape sequence: \\%s" % c)
+            else:
+                builder.append(c)
+            c = self.next()
+        self.skip_ignored()
+        return wrap(builder.build())
 
-def quasiquote(sexpr):
-    return wrap([W_Sym('qquote'), sexpr])
+    def char(self):
+        c = self.next()
+        if c in " \n\t":
+            raise ParsingException("Invalid character")
+        val = c + self.token("", _is_lower)
+        return char(val)
 
-def unquote(sexpr):
-    return wrap([W_Sym('~'), sexpr])
+def _is_lower(c):
+    return 'a' <= c <= 'z'
 
-def lambda_expr(sexpr):
-    return wrap([W_Sym('#'), sexpr])
+def string_reader(code):
+    return Reader(code)
 
-def map(args):
-    return W_ArrayMap(args)
+def file_reader(filename):
+    return Reader("", os.open(filename, os.O_RDONLY, 0))
 
 def char(val):
     if len(val) == 1:
@@ -1,5 +1,6 @@
 from rpython.rlib.objectmodel import specialize, r_dict, compute_hash
 from rpython.rlib import jit
+import os
 
 hash_by_reference = lambda self: compute_hash(self)
 
@@ -32,8 +33,35 @@ class W_Value:
                 (self, self.type().to_str()))
 
     invoke = _unsupported("invoke")
+
+    # Calls with few args skip building a list of them where overridden.
+    def invoke0(self, ctx):
+        return self.invoke([], ctx)
+
+    def invoke1(self, w_a, ctx):
+        return self.invoke([w_a], ctx)
+
+    def invoke2(self, w_a, w_b, ctx):
+        return self.invoke([w_a, w_b], ctx)
+
+    def invoke3(self, w_a, w_b, w_c, ctx):
+        return self.invoke([w_a, w_b, w_c], ctx)
     first = _unsupported("first")
     rest = _unsupported("rest")
+    seq = _unsupported("seq")
+    conj = _unsupported("conj")
+    pop = _unsupported("pop")
+    peek = _unsupported("peek")
+    count = _unsupported("count")
+    nth = _unsupported("nth")
+    chunk_first = _unsupported("chunk-first")
+    chunk_rest = _unsupported("chunk-rest")
+    transient = _unsupported("transient")
+    persistent = _unsupported("persistent!")
+    conj_bang = _unsupported("conj!")
+    assoc_bang = _unsupported("assoc!")
+    dissoc_bang = _unsupported("dissoc!")
+    pop_bang = _unsupported("pop!")
 
 class W_Type(W_Value):
     def __init__(self, name):
@@ -42,6 +70,8 @@ class W_Type(W_Value):
     def to_str(self):
         return self.name
 
+    hash = hash_by_reference
+
 class W_Nil(W_Value):
     def to_str(self):
         return "nil"
@@ -58,6 +88,21 @@ class W_Nil(W_Value):
     def hash(self):
         return 0
 
+    def conj(self, w_val):
+        return W_List(w_val, w_empty_list)
+
+    def count(self):
+        return 0
+
+    def nth(self, idx, not_found):
+        return w_nil if not_found is None else not_found
+
+    def pop(self):
+        return w_nil
+
+    def peek(self):
+        return w_nil
+
 w_nil = W_Nil()
 W_Nil._type = w_nil
 W_Value._type = W_Type("Value")
@@ -112,6 +157,33 @@ class W_Seq(W_Obj):
             coll = coll.rest()
         return hash
 
+    def to_str(self):
+        ret = "("
+        for e in unwrap(self):
+            ret += e.to_str() + " "
+        return "()" if ret == "(" else ret[:-1] + ")"
+
+    def conj(self, w_val):
+        return W_List(w_val, self)
+
+    def count(self):
+        n = 0
+        w_seq = self.seq()
+        while w_seq is not w_nil:
+            n += 1
+            w_seq = w_seq.rest().seq()
+        return n
+
+    def nth(self, idx, not_found):
+        if idx >= 0:
+            w_seq = self.seq()
+            while w_seq is not w_nil:
+                if idx == 0:
+                    return w_seq.first()
+                idx -= 1
+                w_seq = w_seq.rest().seq()
+        return not_found
+
     seq = _unimplemented("W_Seq", "seq")
     first = _unimplemented("W_Seq", "first")
     rest = _unimplemented("W_Seq", "rest")
@@ -129,15 +201,15 @@ class W_List(W_Seq):
     def rest(self):
         return self.tail
 
-    def to_str(self):
-        ret = "("
-        for e in unwrap(self):
-            ret += e.to_str() + " "
-        return "()" if ret == "(" else ret[:-1] + ")"
-
     def seq(self):
         return self
 
+    def pop(self):
+        return self.tail
+
+    def peek(self):
+        return self.head
+
 class W_EmptyList(W_List):
     def __init__(self):
         self.head = self.tail = w_nil
@@ -154,6 +226,9 @@ class W_EmptyList(W_List):
     def seq(self):
         return w_nil
 
+    def pop(self):
+        raise SpaceException("Can't pop an empty list")
+
 w_empty_list = W_EmptyList()
 
 class W_LazySeq(W_Seq):
@@ -187,53 +262,522 @@ class W_LazySeq(W_Seq):
         self.delivery = self.promise.deliver()
         self.promise = None
 
+class W_Eduction(W_LazySeq):
+    """A lazy seq of a coll passed through a transducer. Reducing it runs
+    the transducer over the coll instead of realizing the seq."""
+
+    def __init__(self, promise, w_xform, w_coll):
+        W_LazySeq.__init__(self, promise)
+        self.w_xform = w_xform
+        self.w_coll = w_coll
+
+_bits = 5
+_width = 1 << _bits
+_mask = _width - 1
+
+class _Edit:
+    "Marks nodes which a transient owns and can thus change in place."
+
+    def __init__(self):
+        self.active = True
+
+class _VectorNode:
+    "A node of a vector's trie. Inner nodes have children and leaves values."
+
+    def __init__(self, children, values, edit=None):
+        self.children = children
+        self.values = values
+        self.edit = edit
+
+_empty_node = _VectorNode([], None)
+
+def _new_path(level, node, edit=None):
+    while level > 0:
+        node = _VectorNode([node], None, edit)
+        level -= _bits
+    return node
+
+def _leaf_for(node, shift, idx):
+    level = shift
+    while level > 0:
+        node = node.children[(idx >> level) & _mask]
+        level -= _bits
+    return node.values
+
+def _do_assoc(level, node, idx, w_val):
+    if level == 0:
+        values = [x for x in node.values]
+        values[idx & _mask] = w_val
+        return _VectorNode(None, values)
+    children = [x for x in node.children]
+    subidx = (idx >> level) & _mask
+    children[subidx] = _do_assoc(level - _bits, children[subidx], idx, w_val)
+    return _VectorNode(children, None)
+
 class W_Vector(W_Seq):
+    """A persistent vector, i.e. a 32-way trie with a tail buffer.
+
+    Elements of the trie before start aren't part of the vector, which lets
+    rest share the trie instead of copying it.
+    """
+
     _type = W_Type("PersistentVector")
 
-    def __init__(self, buffer, start=0, end=0):
-        assert isinstance(buffer, list)
+    _immutable_fields_ = ["cnt", "shift", "root", "tail", "start"]
+
+    def __init__(self, cnt, shift, root, tail, start=0, w_meta=w_nil):
+        W_Obj.__init__(self, w_meta)
+        self.cnt = cnt
+        self.shift = shift
+        self.root = root
+        self.tail = tail
         self.start = start
-        self.end = end if end > 0 else len(buffer)
-        self.buffer = buffer
+
+    def count(self):
+        return self.cnt - self.start
+
+    def offset(self, idx):
+        "Returns where the idx-th element of the trie is in its leaf."
+        return idx & _mask
+
+    def tailoff(self):
+        return self.cnt - len(self.tail)
+
+    def array_for(self, idx):
+        "Returns the leaf holding the idx-th element of the trie."
+        if idx >= self.tailoff():
+            return self.tail
+        return _leaf_for(self.root, self.shift, idx)
+
+    def nth(self, idx, not_found):
+        if idx < 0 or idx >= self.count():
+            return not_found
+        idx += self.start
+        return self.array_for(idx)[idx & _mask]
 
     def first(self):
-        if self.start < self.end:
-            return self.buffer[self.start]
-        else:
-            return w_nil
+        return self.nth(0, w_nil)
 
     def rest(self):
-        if self.start < self.end:
-            return W_Vector(self.buffer, self.start + 1, self.end)
+        if self.start < self.cnt:
+            return W_Vector(self.cnt, self.shift, self.root, self.tail,
+                    self.start + 1)
         else:
             return w_empty_list
 
-    def to_str(self):
-        if self.start < self.end:
-            ret = "["
-            idx = self.start
-            while idx < self.end:
-                ret += self.buffer[idx].to_str() + " "
-                idx += 1
-            return ret[:-1] + "]"
+    def seq(self):
+        if self.start < self.cnt:
+            return W_ChunkedSeq(self, self.start)
         else:
+            return w_nil
+
+    def to_str(self):
+        elems_w = self.elems()
+        if len(elems_w) == 0:
             return "[]"
+        ret = "["
+        for w_elem in elems_w:
+            ret += w_elem.to_str() + " "
+        return ret[:-1] + "]"
+
+    def equals(self, other):
+        if not isinstance(other, W_Vector):
+            return W_Seq.equals(self, other)
+        if self.count() != other.count():
+            return False
+        idx = 0
+        while idx < self.count():
+            if not self.nth(idx, w_nil).equals(other.nth(idx, w_nil)):
+                return False
+            idx += 1
+        return True
 
     def elems(self):
-        return self.buffer[self.start : self.end]
+        elems_w = []
+        idx = self.start
+        while idx < self.cnt:
+            leaf = self.array_for(idx)
+            offset = idx & _mask
+            while offset < len(leaf) and idx < self.cnt:
+                elems_w.append(leaf[offset])
+                offset += 1
+                idx += 1
+        return elems_w
 
     def get(self, key, not_found):
-        idx = cast(key, W_Int).val
-        if idx >= 0 and self.start + idx < self.end:
-            return self.buffer[self.start + idx]
+        return self.nth(cast(key, W_Int).val, not_found)
+
+    def with_meta(self, w_meta):
+        return W_Vector(self.cnt, self.shift, self.root, self.tail,
+                self.start, w_meta)
+
+    def transient(self):
+        if self.start > 0:
+            return vector(self.elems()).transient()
+        return W_TransientVector(self.cnt, self.shift, self.root, self.tail)
+
+    def conj(self, w_val):
+        if len(self.tail) < _width:
+            tail = self.tail + [w_val]
+            return W_Vector(self.cnt + 1, self.shift, self.root, tail,
+                    self.start, self.w_meta)
+        tail_node = _VectorNode(None, self.tail)
+        shift = self.shift
+        if (self.cnt >> _bits) > (1 << shift):
+            root = _VectorNode([self.root, _new_path(shift, tail_node)], None)
+            shift += _bits
         else:
+            root = self._push_tail(shift, self.root, tail_node)
+        return W_Vector(self.cnt + 1, shift, root, [w_val], self.start,
+                self.w_meta)
+
+    def _push_tail(self, level, parent, tail_node):
+        subidx = ((self.cnt - 1) >> level) & _mask
+        children = [x for x in parent.children]
+        if level == _bits:
+            node = tail_node
+        elif subidx < len(children):
+            node = self._push_tail(level - _bits, children[subidx], tail_node)
+        else:
+            node = _new_path(level - _bits, tail_node)
+        if subidx < len(children):
+            children[subidx] = node
+        else:
+            children.append(node)
+        return _VectorNode(children, None)
+
+    def assoc(self, w_key, w_val):
+        idx = cast(w_key, W_Int).val
+        if idx == self.count():
+            return self.conj(w_val)
+        if idx < 0 or idx > self.count():
+            raise IndexOutOfBoundsException(idx)
+        idx += self.start
+        if idx >= self.tailoff():
+            tail = [x for x in self.tail]
+            tail[idx & _mask] = w_val
+            return W_Vector(self.cnt, self.shift, self.root, tail,
+                    self.start, self.w_meta)
+        root = _do_assoc(self.shift, self.root, idx, w_val)
+        return W_Vector(self.cnt, self.shift, root, self.tail, self.start,
+                self.w_meta)
+
+    def peek(self):
+        return self.nth(self.count() - 1, w_nil)
+
+    def pop(self):
+        if self.count() == 0:
+            raise SpaceException("Can't pop an empty vector")
+        if self.count() == 1:
+            return w_empty_vector.with_meta(self.w_meta)
+        if len(self.tail) > 1:
+            end = len(self.tail) - 1
+            assert end >= 0
+            return W_Vector(self.cnt - 1, self.shift, self.root,
+                    self.tail[:end], self.start, self.w_meta)
+        tail = self.array_for(self.cnt - 2)
+        root = self._pop_tail(self.shift, self.root)
+        shift = self.shift
+        if root is None:
+            root = _empty_node
+        if shift > _bits and len(root.children) == 1:
+            root = root.children[0]
+            shift -= _bits
+        return W_Vector(self.cnt - 1, shift, root, tail, self.start,
+                self.w_meta)
+
+    def _pop_tail(self, level, node):
+        subidx = ((self.cnt - 2) >> level) & _mask
+        if level > _bits:
+            child = self._pop_tail(level - _bits, node.children[subidx])
+            if child is None and subidx == 0:
+                return None
+            children = node.children[:subidx]
+            if child is not None:
+                children.append(child)
+            return _VectorNode(children, None)
+        elif subidx == 0:
+            return None
+        else:
+            return _VectorNode(node.children[:subidx], None)
+
+w_empty_vector = W_Vector(0, _bits, _empty_node, [])
+
+class W_Transient(W_Value):
+    "A collection which can be changed in place until persistent! is called."
+
+    def __init__(self):
+        self.edit = _Edit()
+
+    def ensure_editable(self):
+        if not self.edit.active:
+            raise SpaceException("Transient used after persistent! call")
+
+    def persistent(self):
+        self.ensure_editable()
+        self.edit.active = False
+        return self.to_persistent()
+
+    to_persistent = _unimplemented("W_Transient", "to_persistent")
+
+class W_TransientVector(W_Transient):
+    _type = W_Type("TransientVector")
+
+    def __init__(self, cnt, shift, root, tail):
+        W_Transient.__init__(self)
+        self.cnt = cnt
+        self.shift = shift
+        self.root = self.editable(root)
+        self.tail = [x for x in tail]
+
+    def editable(self, node):
+        if node.edit is self.edit:
+            return node
+        if node.children is None:
+            return _VectorNode(None, [x for x in node.values], self.edit)
+        return _VectorNode([x for x in node.children], None, self.edit)
+
+    def count(self):
+        return self.cnt
+
+    def tailoff(self):
+        return self.cnt - len(self.tail)
+
+    def array_for(self, idx):
+        if idx >= self.tailoff():
+            return self.tail
+        return _leaf_for(self.root, self.shift, idx)
+
+    def nth(self, idx, not_found):
+        if idx < 0 or idx >= self.cnt:
             return not_found
+        return self.array_for(idx)[idx & _mask]
 
-    def seq(self):
-        if self.start < self.end:
+    def get(self, key, not_found):
+        return self.nth(cast(key, W_Int).val, not_found)
+
+    def conj_bang(self, w_val):
+        self.ensure_editable()
+        if len(self.tail) < _width:
+            self.tail.append(w_val)
+            self.cnt += 1
             return self
+        tail_node = _VectorNode(None, self.tail, self.edit)
+        self.tail = [w_val]
+        if (self.cnt >> _bits) > (1 << self.shift):
+            path = _new_path(self.shift, tail_node, self.edit)
+            self.root = _VectorNode([self.root, path], None, self.edit)
+            self.shift += _bits
         else:
-            return w_nil
+            self.root = self._push_tail(self.shift, self.root, tail_node)
+        self.cnt += 1
+        return self
+
+    def _push_tail(self, level, parent, tail_node):
+        node = self.editable(parent)
+        subidx = ((self.cnt - 1) >> level) & _mask
+        if level == _bits:
+            child = tail_node
+        elif subidx < len(node.children):
+            child = self._push_tail(level - _bits, node.children[subidx],
+                    tail_node)
+        else:
+            child = _new_path(level - _bits, tail_node, self.edit)
+        if subidx < len(node.children):
+            node.children[subidx] = child
+        else:
+            node.children.append(child)
+        return node
+
+    def assoc_bang(self, w_key, w_val):
+        self.ensure_editable()
+        idx = cast(w_key, W_Int).val
+        if idx == self.cnt:
+            return self.conj_bang(w_val)
+        if idx < 0 or idx > self.cnt:
+            raise IndexOutOfBoundsException(idx)
+        if idx >= self.tailoff():
+            self.tail[idx & _mask] = w_val
+        else:
+            self.root = self._do_assoc(self.shift, self.root, idx, w_val)
+        return self
+
+    def _do_assoc(self, level, node, idx, w_val):
+        node = self.editable(node)
+        if level == 0:
+            node.values[idx & _mask] = w_val
+        else:
+            subidx = (idx >> level) & _mask
+            node.children[subidx] = self._do_assoc(level - _bits,
+                    node.children[subidx], idx, w_val)
+        return node
+
+    def pop_bang(self):
+        self.ensure_editable()
+        if self.cnt == 0:
+            raise SpaceException("Can't pop an empty vector")
+        if len(self.tail) > 1 or self.cnt == 1:
+            self.tail.pop()
+            self.cnt -= 1
+            return self
+        tail = [x for x in self.array_for(self.cnt - 2)]
+        root = self._pop_tail(self.shift, self.root)
+        if root is None:
+            root = _VectorNode([], None, self.edit)
+        if self.shift > _bits and len(root.children) == 1:
+            root = self.editable(root.children[0])
+            self.shift -= _bits
+        self.root = root
+        self.tail = tail
+        self.cnt -= 1
+        return self
+
+    def _pop_tail(self, level, node):
+        node = self.editable(node)
+        subidx = ((self.cnt - 2) >> level) & _mask
+        if level > _bits:
+            child = self._pop_tail(level - _bits, node.children[subidx])
+            if child is None and subidx == 0:
+                return None
+            if child is None:
+                node.children.pop()
+            else:
+                node.children[subidx] = child
+            return node
+        elif subidx == 0:
+            return None
+        node.children.pop()
+        return node
+
+    def to_persistent(self):
+        return W_Vector(self.cnt, self.shift, self.root, self.tail)
+
+def vector(elems_w):
+    "Builds a vector by filling its trie bottom up."
+    cnt = len(elems_w)
+    if cnt == 0:
+        return w_empty_vector
+    tailoff = ((cnt - 1) >> _bits) << _bits
+    assert tailoff >= 0
+    nodes = []
+    idx = 0
+    while idx < tailoff:
+        nodes.append(_VectorNode(None, elems_w[idx : idx + _width]))
+        idx += _width
+    shift = _bits
+    while len(nodes) > _width:
+        parents = []
+        idx = 0
+        while idx < len(nodes):
+            parents.append(_VectorNode(nodes[idx : idx + _width], None))
+            idx += _width
+        nodes = parents
+        shift += _bits
+    return W_Vector(cnt, shift, _VectorNode(nodes, None), elems_w[tailoff:])
+
+class W_ArrayChunk(W_Value):
+    "Elements of values from off up to end."
+
+    _type = W_Type("ArrayChunk")
+
+    def __init__(self, values, off, end):
+        self.values = values
+        self.off = off
+        self.end = end
+
+    def count(self):
+        return self.end - self.off
+
+    def nth(self, idx, not_found):
+        if idx < 0 or idx >= self.end - self.off:
+            return not_found
+        return self.values[self.off + idx]
+
+    def drop_first(self):
+        return W_ArrayChunk(self.values, self.off + 1, self.end)
+
+class W_ChunkBuffer(W_Value):
+    _type = W_Type("ChunkBuffer")
+
+    def __init__(self):
+        self.values = []
+
+    def count(self):
+        return len(self.values)
+
+    def append(self, w_val):
+        self.values.append(w_val)
+
+    def chunk(self):
+        w_chunk = W_ArrayChunk(self.values, 0, len(self.values))
+        self.values = []
+        return w_chunk
+
+class W_ChunkedSeq(W_Seq):
+    "A seq of a vector, which hands out the vector's leaves as chunks."
+
+    def __init__(self, w_vec, idx):
+        W_Obj.__init__(self)
+        self.w_vec = w_vec
+        self.idx = idx
+        self.leaf = w_vec.array_for(idx)
+        self.offset = w_vec.offset(idx)
+
+    def first(self):
+        return self.leaf[self.offset]
+
+    def rest(self):
+        if self.idx + 1 < self.w_vec.cnt:
+            return W_ChunkedSeq(self.w_vec, self.idx + 1)
+        return w_empty_list
+
+    def seq(self):
+        return self
+
+    def count(self):
+        return self.w_vec.cnt - self.idx
+
+    def nth(self, idx, not_found):
+        if idx < 0 or idx >= self.count():
+            return not_found
+        idx += self.idx
+        return self.w_vec.array_for(idx)[self.w_vec.offset(idx)]
+
+    def chunk_first(self):
+        return W_ArrayChunk(self.leaf, self.offset, len(self.leaf))
+
+    def chunk_rest(self):
+        idx = self.idx + len(self.leaf) - self.offset
+        if idx < self.w_vec.cnt:
+            return W_ChunkedSeq(self.w_vec, idx)
+        return w_empty_list
+
+class W_ChunkedCons(W_Seq):
+    "A non-empty chunk followed by a seq of more elements."
+
+    def __init__(self, w_chunk, w_more):
+        W_Obj.__init__(self)
+        self.w_chunk = w_chunk
+        self.w_more = w_more
+
+    def first(self):
+        return self.w_chunk.nth(0, w_nil)
+
+    def rest(self):
+        if self.w_chunk.count() > 1:
+            return W_ChunkedCons(self.w_chunk.drop_first(), self.w_more)
+        return self.chunk_rest()
+
+    def seq(self):
+        return self
+
+    def chunk_first(self):
+        return self.w_chunk
+
+    def chunk_rest(self):
+        if self.w_more is w_nil:
+            return w_empty_list
+        return self.w_more
 
 class W_Sym(W_Obj):
     _type = W_Type("Symbol")
@@ -241,18 +785,31 @@ class W_Sym(W_Obj):
     def __init__(self, val, meta=w_nil):
         W_Obj.__init__(self, meta)
         self.val = val
+        self.hash_val = compute_hash(val) + 1
 
     def to_str(self):
         return str(self.val)
 
     def equals(self, other):
+        if self is other:
+            return True
         return isinstance(other, W_Sym) and other.val == self.val
 
     def with_meta(self, w_meta):
         return W_Sym(self.val, w_meta)
 
     def hash(self):
-        return compute_hash(self.val) + 1
+        return self.hash_val
+
+_symbols = {}
+
+def symbol(name):
+    "Returns the interned symbol called name, which has no meta."
+    w_sym = _symbols.get(name, None)
+    if w_sym is None:
+        w_sym = W_Sym(name)
+        _symbols[name] = w_sym
+    return w_sym
 
 class W_Char(W_Value):
     _type = W_Type("Char")
@@ -294,34 +851,81 @@ class W_String(W_Value):
     def rest(self):
         if len(self.val) < 2:
             return w_empty_list
-        else:
-            return W_String(self.val[1:])
+        return W_StringSeq(self.val, 1)
+
+    def seq(self):
+        return w_nil if self.val == "" else W_StringSeq(self.val, 0)
+
+    def count(self):
+        return len(self.val)
+
+    def nth(self, idx, not_found):
+        if idx < 0 or idx >= len(self.val):
+            return not_found
+        return W_Char(ord(self.val[idx]))
+
+class W_StringSeq(W_Seq):
+    "A seq of chars of a string from idx on, sharing the string."
+
+    def __init__(self, val, idx):
+        W_Obj.__init__(self)
+        self.val = val
+        self.idx = idx
+
+    def first(self):
+        return W_Char(ord(self.val[self.idx]))
+
+    def rest(self):
+        if self.idx + 1 < len(self.val):
+            return W_StringSeq(self.val, self.idx + 1)
+        return w_empty_list
+
+    def seq(self):
+        return self
+
+    def count(self):
+        return len(self.val) - self.idx
+
+    def nth(self, idx, not_found):
+        if idx < 0 or idx >= self.count():
+            return not_found
+        return W_Char(ord(self.val[self.idx + idx]))
+
+class W_Keyword(W_Value):
+    "Keywords are interned, use keyword to get one."
 
-class W_Keyword(W_Obj):
     _type = W_Type("Keyword")
 
-    def __init__(self, val, meta=w_nil):
-        W_Obj.__init__(self, meta)
+    def __init__(self, val):
         self.val = val
+        self.hash_val = compute_hash(val) + 3
 
     def to_str(self):
         return ":" + str(self.val)
 
     def equals(self, other):
-        return isinstance(other, W_Keyword) and other.val == self.val
-
-    def with_meta(self, w_meta):
-        return W_Keyword(self.val, w_meta)
+        return self is other
 
     def hash(self):
-        return compute_hash(self.val) + 3
+        return self.hash_val
 
     def invoke(self, args, *_):
-        map = args[0]
-        if map == w_nil:
+        return self.invoke1(args[0], None)
+
+    def invoke1(self, w_map, _):
+        if w_map == w_nil:
             return w_nil
         else:
-            return args[0].get(self, w_nil)
+            return w_map.get(self, w_nil)
+
+_keywords = {}
+
+def keyword(name):
+    w_keyword = _keywords.get(name, None)
+    if w_keyword is None:
+        w_keyword = W_Keyword(name)
+        _keywords[name] = w_keyword
+    return w_keyword
 
 class W_Int(W_Value):
     _type = W_Type("Int")
@@ -341,25 +945,46 @@ class W_Int(W_Value):
 class W_Fun(W_Value):
     _type = W_Type("Fn")
 
-    _immutable_fields_ = ["code", "arg_ids", "rest_args_id", "env"]
+    _immutable_fields_ = ["code", "arg_ids", "rest_args_id", "nslots",
+            "stack_size", "env", "arities[*]"]
 
-    def __init__(self, code, arg_ids, rest_args_id=-1, env=None):
+    def __init__(self, code, arg_ids, rest_args_id=-1, nslots=0, stack_size=0,
+            env=None, arities=None):
         self.code = code
         self.arg_ids = arg_ids
         self.rest_args_id = rest_args_id
+        self.nslots = nslots
+        self.stack_size = stack_size
         self.env = env
+        # A multi-arity fn has no code of its own, just a fn for every count
+        # of args. The last one takes all the counts beyond the table.
+        self.arities = arities
 
     def got_rest_args(self):
         return self.rest_args_id >= 0
 
+    @jit.elidable
+    def arity(self, argc):
+        "Returns a fn run by a call with argc args or None if there's none."
+        arities = self.arities
+        if arities is None:
+            return self
+        last = len(arities) - 1
+        if argc < last:
+            return arities[argc]
+        return arities[last]
+
     def with_env(self, env):
-        return W_Fun(self.code, self.arg_ids, self.rest_args_id, env.clone())
+        return W_Fun(self.code, self.arg_ids, self.rest_args_id, self.nslots,
+                self.stack_size, env, self.arities)
 
     hash = hash_by_reference
 
 class W_BIF(W_Value):
     _type = W_Fun._type
 
+    hash = hash_by_reference
+
 class W_Map(W_Obj):
     def hash(self):
         elems = self.elems()
@@ -373,6 +998,15 @@ class W_Map(W_Obj):
     def invoke(self, args, *_):
         return self.get(args[0], w_nil)
 
+    def invoke1(self, w_key, _):
+        return self.get(w_key, w_nil)
+
+    def conj(self, w_entry):
+        return self.assoc(w_entry.first(), w_entry.rest().first())
+
+    def seq(self):
+        return w_nil if self.count() == 0 else self
+
     def equals(self, w_other):
         if not isinstance(w_other, W_Map):
             return False
@@ -392,6 +1026,9 @@ class W_Map(W_Obj):
     elems = _unimplemented("W_Map", "elems")
     get = _unimplemented("W_Map", "get")
 
+# Array maps with more entries are promoted to hash maps.
+array_map_limit = 8
+
 class W_ArrayMap(W_Map):
     _type = W_Type("PersistentArrayMap")
 
@@ -424,6 +1061,8 @@ class W_ArrayMap(W_Map):
             idx += 2
         copy.append(key)
         copy.append(val)
+        if len(copy) > 2 * array_map_limit:
+            return hash_map(copy).with_meta(self.w_meta)
         return W_ArrayMap(copy)
 
     def dissoc(self, key):
@@ -441,88 +1080,469 @@ class W_ArrayMap(W_Map):
     def elems(self):
         return self.kvs
 
+    def count(self):
+        return len(self.kvs) // 2
+
     def with_meta(self, w_meta):
         return W_ArrayMap(self.kvs, w_meta)
 
+    def transient(self):
+        return W_TransientArrayMap(self.kvs)
+
     def first(self):
         if len(self.kvs) == 0:
             return w_nil
-        return W_Vector(self.kvs[0:2])
+        return vector(self.kvs[0:2])
 
     def rest(self):
         coll = []
         idx = 2
         orig = self.kvs
         while idx < len(orig):
-            coll.append(W_Vector([orig[idx], orig[idx + 1]]))
+            coll.append(vector([orig[idx], orig[idx + 1]]))
             idx += 2
         return wrap(coll)
 
+def _hash(w_key):
+    "Hashes are cut to 32 bits, i.e. to the depth of a hash map's trie."
+    return w_key.hash() & 0xFFFFFFFF
+
+def _bitpos(hash, shift):
+    return 1 << ((hash >> shift) & _mask)
+
+def _popcount(bits):
+    bits = bits - ((bits >> 1) & 0x55555555)
+    bits = (bits & 0x33333333) + ((bits >> 2) & 0x33333333)
+    bits = (bits + (bits >> 4)) & 0x0F0F0F0F
+    return ((bits * 0x01010101) & 0xFFFFFFFF) >> 24
+
+class _Box:
+    def __init__(self):
+        self.val = False
+
+class _MapNode:
+    """A node of a hash map's trie.
+
+    Its i-th entry is either a key keys_w[i] mapped to vals_w[i] or, if the
+    key is None, a subnode nodes[i]. Updates of nodes whose edit is the
+    given one happen in place; other nodes are copied first.
+    """
+
+    def __init__(self, keys_w, vals_w, nodes, edit):
+        self.keys_w = keys_w
+        self.vals_w = vals_w
+        self.nodes = nodes
+        self.edit = edit
+
+    def collect(self, elems_w):
+        idx = 0
+        while idx < len(self.keys_w):
+            w_key = self.keys_w[idx]
+            if w_key is None:
+                self.nodes[idx].collect(elems_w)
+            else:
+                elems_w.append(w_key)
+                elems_w.append(self.vals_w[idx])
+            idx += 1
+
+    find = _unimplemented("_MapNode", "find")
+    assoc = _unimplemented("_MapNode", "assoc")
+    without = _unimplemented("_MapNode", "without")
+
+class _BitmapNode(_MapNode):
+    "Holds entries for hashes whose 5 bits at a given shift are in bitmap."
+
+    def __init__(self, bitmap, keys_w, vals_w, nodes, edit=None):
+        _MapNode.__init__(self, keys_w, vals_w, nodes, edit)
+        self.bitmap = bitmap
+
+    def editable(self, edit):
+        if self.edit is edit:
+            return self
+        return _BitmapNode(self.bitmap, [x for x in self.keys_w],
+                [x for x in self.vals_w], [x for x in self.nodes], edit)
+
+    def index(self, bit):
+        return _popcount(self.bitmap & (bit - 1))
+
+    def find(self, shift, hash, w_key, not_found):
+        bit = _bitpos(hash, shift)
+        if self.bitmap & bit == 0:
+            return not_found
+        idx = self.index(bit)
+        w_entry_key = self.keys_w[idx]
+        if w_entry_key is None:
+            return self.nodes[idx].find(shift + _bits, hash, w_key, not_found)
+        if w_key.equals(w_entry_key):
+            return self.vals_w[idx]
+        return not_found
+
+    def assoc(self, edit, shift, hash, w_key, w_val, added):
+        bit = _bitpos(hash, shift)
+        idx = self.index(bit)
+        if self.bitmap & bit == 0:
+            added.val = True
+            node = self.editable(edit)
+            node.bitmap |= bit
+            node.keys_w.insert(idx, w_key)
+            node.vals_w.insert(idx, w_val)
+            node.nodes.insert(idx, None)
+            return node
+        w_entry_key = self.keys_w[idx]
+        if w_entry_key is None:
+            child = self.nodes[idx]
+            new_child = child.assoc(edit, shift + _bits, hash, w_key, w_val,
+                    added)
+            if new_child is child:
+                return self
+            node = self.editable(edit)
+            node.nodes[idx] = new_child
+            return node
+        if w_key.equals(w_entry_key):
+            if self.vals_w[idx] is w_val:
+                return self
+            node = self.editable(edit)
+            node.vals_w[idx] = w_val
+            return node
+        added.val = True
+        child = _create_node(edit, shift + _bits, w_entry_key,
+                self.vals_w[idx], hash, w_key, w_val)
+        node = self.editable(edit)
+        node.keys_w[idx] = None
+        node.vals_w[idx] = None
+        node.nodes[idx] = child
+        return node
+
+    def without(self, edit, shift, hash, w_key, removed):
+        bit = _bitpos(hash, shift)
+        if self.bitmap & bit == 0:
+            return self
+        idx = self.index(bit)
+        w_entry_key = self.keys_w[idx]
+        if w_entry_key is None:
+            child = self.nodes[idx]
+            new_child = child.without(edit, shift + _bits, hash, w_key,
+                    removed)
+            if new_child is child:
+                return self
+            if new_child is not None:
+                node = self.editable(edit)
+                node.nodes[idx] = new_child
+                return node
+        elif w_key.equals(w_entry_key):
+            removed.val = True
+        else:
+            return self
+        if self.bitmap == bit:
+            return None
+        node = self.editable(edit)
+        node.bitmap ^= bit
+        del node.keys_w[idx]
+        del node.vals_w[idx]
+        del node.nodes[idx]
+        return node
+
+_empty_map_node = _BitmapNode(0, [], [], [])
+
+class _CollisionNode(_MapNode):
+    "Holds entries whose keys have the same hash."
+
+    def __init__(self, hash, keys_w, vals_w, nodes, edit):
+        _MapNode.__init__(self, keys_w, vals_w, nodes, edit)
+        self.hash = hash
+
+    def editable(self, edit):
+        if self.edit is edit:
+            return self
+        return _CollisionNode(self.hash, [x for x in self.keys_w],
+                [x for x in self.vals_w], [x for x in self.nodes], edit)
+
+    def index(self, w_key):
+        idx = 0
+        while idx < len(self.keys_w):
+            if w_key.equals(self.keys_w[idx]):
+                return idx
+            idx += 1
+        return -1
+
+    def find(self, shift, hash, w_key, not_found):
+        idx = self.index(w_key)
+        if idx < 0:
+            return not_found
+        return self.vals_w[idx]
+
+    def assoc(self, edit, shift, hash, w_key, w_val, added):
+        if hash != self.hash:
+            node = _BitmapNode(_bitpos(self.hash, shift), [None], [None],
+                    [self], edit)
+            return node.assoc(edit, shift, hash, w_key, w_val, added)
+        idx = self.index(w_key)
+        if idx >= 0:
+            if self.vals_w[idx] is w_val:
+                return self
+            node = self.editable(edit)
+            node.vals_w[idx] = w_val
+            return node
+        added.val = True
+        node = self.editable(edit)
+        node.keys_w.append(w_key)
+        node.vals_w.append(w_val)
+        node.nodes.append(None)
+        return node
+
+    def without(self, edit, shift, hash, w_key, removed):
+        idx = self.index(w_key)
+        if idx < 0:
+            return self
+        removed.val = True
+        if len(self.keys_w) == 1:
+            return None
+        node = self.editable(edit)
+        del node.keys_w[idx]
+        del node.vals_w[idx]
+        del node.nodes[idx]
+        return node
+
+def _create_node(edit, shift, w_key1, w_val1, hash2, w_key2, w_val2):
+    hash1 = _hash(w_key1)
+    if hash1 == hash2:
+        return _CollisionNode(hash1, [w_key1, w_key2], [w_val1, w_val2],
+                [None, None], edit)
+    added = _Box()
+    node = _BitmapNode(0, [], [], [], edit)
+    node = node.assoc(edit, shift, hash1, w_key1, w_val1, added)
+    return node.assoc(edit, shift, hash2, w_key2, w_val2, added)
+
 class W_HashMap(W_Map):
+    "A persistent hash map, i.e. a hash array mapped trie."
+
     _type = W_Type("PersistentHashMap")
 
-    def __init__(self, kvs=[], w_meta=w_nil):
-        assert len(kvs) % 2 == 0
+    def __init__(self, cnt=0, root=_empty_map_node, w_meta=w_nil):
         W_Obj.__init__(self, w_meta)
-        self.dict = r_dict(
-                lambda this, other: this.equals(other),
-                lambda obj: obj.hash()
-                )
-        idx = 0
-        while idx < len(kvs):
-            self.dict[kvs[idx]] = kvs[idx + 1]
-            idx += 2
+        self.cnt = cnt
+        self.root = root
 
     def to_str(self):
+        elems_w = self.elems()
+        if len(elems_w) == 0:
+            return "{}"
         ret = "{"
-        for key in self.dict:
-            ret += key.to_str() + " " + self.dict[key].to_str() + " "
+        for w_elem in elems_w:
+            ret += w_elem.to_str() + " "
         return ret[:-1] + "}"
 
     def get(self, key, not_found):
-        return self.dict.get(key, not_found)
+        return self.root.find(0, _hash(key), key, not_found)
+
+    def count(self):
+        return self.cnt
 
     def elems(self):
-        elems = []
-        for key in self.dict:
-            elems += [key, self.dict[key]]
-        return elems
+        elems_w = []
+        self.root.collect(elems_w)
+        return elems_w
 
     def with_meta(self, w_meta):
-        return W_HashMap(self.elems(), w_meta)
+        return W_HashMap(self.cnt, self.root, w_meta)
 
     def assoc(self, key, val):
-        return W_HashMap(self.elems() + [key, val])
+        added = _Box()
+        root = self.root.assoc(_Edit(), 0, _hash(key), key, val, added)
+        if root is self.root:
+            return self
+        return W_HashMap(self.cnt + 1 if added.val else self.cnt, root,
+                self.w_meta)
 
     def dissoc(self, key):
-        elems = []
-        for cur_key in self.dict:
-            if not cur_key.equals(key):
-                elems += [cur_key, self.dict[cur_key]]
-        return W_HashMap(elems)
+        removed = _Box()
+        root = self.root.without(_Edit(), 0, _hash(key), key, removed)
+        if root is self.root:
+            return self
+        if root is None:
+            root = _empty_map_node
+        return W_HashMap(self.cnt - 1, root, self.w_meta)
+
+    def transient(self):
+        return W_TransientHashMap(self.cnt, self.root)
 
     def first(self):
-        if len(self.dict) == 0:
+        w_seq = _map_seq(self.root, 0, None)
+        if w_seq is None:
             return w_nil
-        key = self.dict.keys()[0]
-        return W_Vector([key, self.dict[key]])
+        return w_seq.first()
 
     def rest(self):
-        if len(self.dict) < 2:
+        w_seq = _map_seq(self.root, 0, None)
+        if w_seq is None:
             return w_empty_list
-        key = self.dict.keys()[0]
-        return self.dissoc(key)
+        return w_seq.rest()
+
+def array_map(kvs_w):
+    if len(kvs_w) > 2 * array_map_limit:
+        return hash_map(kvs_w)
+    return W_ArrayMap(kvs_w)
+
+def hash_map(kvs_w):
+    assert len(kvs_w) % 2 == 0
+    w_map = W_TransientHashMap(0, _empty_map_node)
+    idx = 0
+    while idx < len(kvs_w):
+        w_map.assoc_bang(kvs_w[idx], kvs_w[idx + 1])
+        idx += 2
+    return w_map.to_persistent()
+
+class W_TransientMap(W_Transient):
+    def conj_bang(self, w_entry):
+        return self.assoc_bang(w_entry.first(), w_entry.rest().first())
+
+class W_TransientArrayMap(W_TransientMap):
+    _type = W_Type("TransientArrayMap")
+
+    def __init__(self, kvs):
+        W_Transient.__init__(self)
+        self.kvs = [x for x in kvs]
+
+    def index(self, key):
+        idx = 0
+        while idx < len(self.kvs):
+            if key.equals(self.kvs[idx]):
+                return idx
+            idx += 2
+        return -1
+
+    def get(self, key, not_found):
+        idx = self.index(key)
+        if idx < 0:
+            return not_found
+        return self.kvs[idx + 1]
+
+    def count(self):
+        return len(self.kvs) // 2
+
+    def assoc_bang(self, key, val):
+        self.ensure_editable()
+        idx = self.index(key)
+        if idx >= 0:
+            self.kvs[idx + 1] = val
+            return self
+        if len(self.kvs) < 2 * array_map_limit:
+            self.kvs.append(key)
+            self.kvs.append(val)
+            return self
+        self.edit.active = False
+        w_map = W_TransientHashMap(0, _empty_map_node)
+        idx = 0
+        while idx < len(self.kvs):
+            w_map.assoc_bang(self.kvs[idx], self.kvs[idx + 1])
+            idx += 2
+        return w_map.assoc_bang(key, val)
+
+    def dissoc_bang(self, key):
+        self.ensure_editable()
+        idx = self.index(key)
+        if idx >= 0:
+            del self.kvs[idx + 1]
+            del self.kvs[idx]
+        return self
+
+    def to_persistent(self):
+        return W_ArrayMap(self.kvs)
+
+class W_TransientHashMap(W_TransientMap):
+    _type = W_Type("TransientHashMap")
+
+    def __init__(self, cnt, root):
+        W_Transient.__init__(self)
+        self.cnt = cnt
+        self.root = root
+
+    def get(self, key, not_found):
+        return self.root.find(0, _hash(key), key, not_found)
+
+    def count(self):
+        return self.cnt
+
+    def assoc_bang(self, key, val):
+        self.ensure_editable()
+        added = _Box()
+        self.root = self.root.assoc(self.edit, 0, _hash(key), key, val, added)
+        if added.val:
+            self.cnt += 1
+        return self
+
+    def dissoc_bang(self, key):
+        self.ensure_editable()
+        removed = _Box()
+        root = self.root.without(self.edit, 0, _hash(key), key, removed)
+        self.root = _empty_map_node if root is None else root
+        if removed.val:
+            self.cnt -= 1
+        return self
+
+    def to_persistent(self):
+        return W_HashMap(self.cnt, self.root)
+
+class W_MapSeq(W_Seq):
+    """Entries of a hash map, read off its trie without copying it.
+
+    An entry is either the idx-th one of node or, if inner isn't None, one of
+    a subnode which inner walks.
+    """
+
+    def __init__(self, node, idx, w_inner):
+        W_Obj.__init__(self)
+        self.node = node
+        self.idx = idx
+        self.w_inner = w_inner
+
+    def first(self):
+        if self.w_inner is not None:
+            return self.w_inner.first()
+        return vector([self.node.keys_w[self.idx], self.node.vals_w[self.idx]])
+
+    def next(self):
+        if self.w_inner is not None:
+            return _map_seq(self.node, self.idx, self.w_inner.next())
+        return _map_seq(self.node, self.idx + 1, None)
+
+    def rest(self):
+        w_seq = self.next()
+        if w_seq is None:
+            return w_empty_list
+        return w_seq
+
+    def seq(self):
+        return self
+
+def _map_seq(node, idx, w_inner):
+    if w_inner is not None:
+        return W_MapSeq(node, idx, w_inner)
+    while idx < len(node.keys_w):
+        if node.keys_w[idx] is not None:
+            return W_MapSeq(node, idx, None)
+        w_inner = _map_seq(node.nodes[idx], 0, None)
+        if w_inner is not None:
+            return W_MapSeq(node, idx + 1, w_inner)
+        idx += 1
+    return None
 
 class W_Var(W_Obj):
+    # Compiled code reading a var depends only on that var's value.
+    _immutable_fields_ = ["ns", "sym", "w_val?", "redefined?"]
+
     def __init__(self, ns, sym, w_val, meta=w_nil):
         assert isinstance(ns, str)
         W_Obj.__init__(self, meta)
         self.ns = ns
         self.sym = sym
         self.w_val = w_val
+        self.redefined = False
 
-    def altered(self, w_val):
-        return W_Var(self.ns, self.sym, w_val, self.meta())
+    def set_value(self, w_val):
+        self.w_val = w_val
+        if not self.redefined:
+            self.redefined = True
 
     def set_meta(self, w_meta):
         "Shouldn't it go to a parent class like clojure.lang.IReference?"
@@ -550,6 +1570,65 @@ class W_Atom(W_Value):
 
     hash = hash_by_reference
 
+buffer_size = 64 * 1024
+
+class W_Writer(W_Value):
+    "A stream buffering writes to a file descriptor until it is flushed."
+
+    _type = W_Type("Writer")
+
+    def __init__(self, fd, size=buffer_size):
+        self.fd = fd
+        self.size = size
+        # Not a StringBuilder, as the streams are prebuilt.
+        self.pending = []
+        self.pending_len = 0
+        # Checked once needed, as the streams are prebuilt.
+        self.tty = -1
+
+    def to_str(self):
+        return "#<Writer(%d)>" % self.fd
+
+    def isatty(self):
+        if self.tty < 0:
+            self.tty = 1 if os.isatty(self.fd) else 0
+        return self.tty == 1
+
+    hash = hash_by_reference
+
+    def write(self, s):
+        self.pending.append(s)
+        self.pending_len += len(s)
+        if self.pending_len >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.pending_len == 0:
+            return
+        data = "".join(self.pending)
+        written = 0
+        try:
+            while written < len(data):
+                assert written >= 0
+                written += os.write(self.fd, data[written:])
+        finally:
+            # Whatever a failed write didn't take stays buffered.
+            assert written >= 0
+            data = data[written:]
+            self.pending = [data] if data != "" else []
+            self.pending_len = len(data)
+
+class W_Reduced(W_Value):
+    "Wraps a result of a reducing fn which wants the reduction to stop."
+
+    _type = W_Type("Reduced")
+
+    def __init__(self, val):
+        self.val = val
+
+    def deref(self):
+        return self.val
+
 class SpaceException(BaseException):
     def __init__(self, reason):
         assert isinstance(reason, str)
@@ -578,6 +1657,13 @@ class CompilationException(SpaceException):
 class ClassCastException(SpaceException):
     pass
 
+class IndexOutOfBoundsException(SpaceException):
+    def __init__(self, idx):
+        SpaceException.__init__(self, "Index out of bounds: %s" % idx)
+
+class ImageException(SpaceException):
+    pass
+
 @specialize.argtype(0)
 def wrap(arg):
     if isinstance(arg, list):
@@ -593,16 +1679,15 @@ def wrap(arg):
         raise Exception("Cannot wrap %s" % arg)
 
 def unwrap(arg):
-    if isinstance(arg, W_List):
-        if arg == w_empty_list:
-            return []
-        else:
-            return [arg.head] + unwrap(arg.tail)
-    elif isinstance(arg, W_LazySeq):
-        arg.first()
-        return unwrap(arg.delivery)
-    elif isinstance(arg, W_Vector):
+    if isinstance(arg, W_Vector):
         return [x for x in arg.elems()]
+    elif isinstance(arg, W_Seq) or arg is w_nil:
+        elems_w = []
+        w_seq = arg.seq()
+        while w_seq is not w_nil:
+            elems_w.append(w_seq.first())
+            w_seq = w_seq.rest().seq()
+        return elems_w
     else:
         raise Exception("Cannot unwrap %s" % arg)
 
@@ -1,4 +1,17 @@
 import builtins
+import space
+
+def _const_key(w_val):
+    "Returns a key identifying an immutable scalar by its value or None."
+    if isinstance(w_val, space.W_String):
+        return "s" + w_val.val
+    elif isinstance(w_val, space.W_Keyword):
+        return "k" + w_val.val
+    elif isinstance(w_val, space.W_Int):
+        return "i" + str(w_val.val)
+    elif isinstance(w_val, space.W_Char):
+        return "c" + str(w_val.val)
+    return None
 
 class SymbolTable:
     def __init__(self):
@@ -9,10 +22,15 @@ class SymbolTable:
             self.syms.append(sym)
             self.sym_ids[sym] = len(self.syms) - 1
         self.fns = []
+        self.consts = []
+        # Ids of scalar constants by their keys, so that code evaluated
+        # over and over again doesn't grow the constant pool.
+        self.const_ids = {}
         self.macros = {}
+        self.macro_log = None
 
     def init_core(self):
-        for (sym, _) in builtins.core:
+        for (sym, _) in builtins.core + builtins.string:
             self.add_sym(sym)
 
     def add_sym(self, sym):
@@ -36,13 +54,28 @@ class SymbolTable:
 
     def add_macro(self, name, fn_id):
         self.macros[name] = fn_id
+        if self.macro_log is not None:
+            self.macro_log.macro_defined(name, fn_id)
 
     def get_macro(self, macro):
-        return self.macros[macro]
+        fn_id = self.macros[macro]
+        if self.macro_log is not None:
+            self.macro_log.macro_used(macro, fn_id)
+        return fn_id
 
     def has_macro(self, macro):
         return macro in self.macros
 
+    def find_macro(self, name):
+        "Returns an id of a macro a call of name expands to or -1."
+        fn_id = self.macros.get(name, -1)
+        if self.macro_log is not None:
+            if fn_id >= 0:
+                self.macro_log.macro_used(name, fn_id)
+            else:
+                self.macro_log.non_macro_used(name)
+        return fn_id
+
     def add_fn(self, fn):
         self.fns.append(fn)
         return len(self.fns) - 1
@@ -50,3 +83,28 @@ class SymbolTable:
     def get_fn(self, fn):
         assert fn < len(self.fns)
         return self.fns[fn]
+
+    def add_const(self, w_val):
+        key = _const_key(w_val)
+        if key is not None:
+            id = self.const_ids.get(key, -1)
+            if id >= 0:
+                return id
+        self.consts.append(w_val)
+        id = len(self.consts) - 1
+        if key is not None:
+            self.const_ids[key] = id
+        return id
+
+    def set_consts(self, consts_w):
+        "Replaces the constant pool, keeping ids of all constants."
+        self.consts = consts_w
+        self.const_ids = {}
+        for id in range(len(consts_w)):
+            key = _const_key(consts_w[id])
+            if key is not None and key not in self.const_ids:
+                self.const_ids[key] = id
+
+    def get_const(self, id):
+        assert id < len(self.consts)
+        return self.consts[id]
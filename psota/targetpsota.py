@@ -3,21 +3,68 @@ import sys
 import parser
 import compiler
 import builtins
+import image
+
+usage = ("Usage: %s [--image FILE] [--dump-image FILE] [--buffer-size BYTES] "
+         "[FILE]\n")
 
 def entry_point(argv):
-    if len(argv) == 1:
-        filename = "repl.clj"
+    filename = "repl.clj"
+    image_in = None
+    image_out = None
+    idx = 1
+    while idx < len(argv):
+        arg = argv[idx]
+        if arg == "--image" or arg == "--dump-image" or arg == "--buffer-size":
+            if idx + 1 == len(argv):
+                print usage % argv[0]
+                return 1
+            if arg == "--image":
+                image_in = argv[idx + 1]
+            elif arg == "--dump-image":
+                image_out = argv[idx + 1]
+            elif not set_buffer_size(argv[idx + 1]):
+                print usage % argv[0]
+                return 1
+            idx += 2
+        else:
+            filename = arg
+            idx += 1
+    try:
+        run(filename, image_in, image_out)
+    finally:
+        flushed = builtins.flush_all()
+    return 0 if flushed else 1
+
+def set_buffer_size(arg):
+    "Sets the size of *out* and *err* buffers, 0 disables buffering."
+    try:
+        size = int(arg)
+    except ValueError:
+        return False
+    if size < 0:
+        return False
+    builtins.stdout.size = size
+    builtins.stderr.size = size
+    return True
+
+def run(filename, image_in, image_out):
+    if image_in is None:
+        ctx = eval.Context()
     else:
-        filename = argv[1]
-    f = open(filename)
-    input = f.read()
-    f.close()
-    parsed = parser.parse(input)
-    ctx = eval.Context()
-    for sexp in parsed:
-        code = compiler.emit(ctx, eval.read(ctx, sexp))
-        ctx.run(code)
-    return 0
+        ctx = image.load(image_in)
+    reader = parser.file_reader(filename)
+    try:
+        while True:
+            sexp = reader.read()
+            if sexp is None:
+                break
+            code = compiler.emit(ctx, eval.read(ctx, sexp))
+            ctx.run(code)
+    finally:
+        reader.close()
+    if image_out is not None:
+        image.dump(ctx, image_out)
 
 def target(driver, args):
     return entry_point, None
@@ -35,6 +35,60 @@
   (not (= () nil))
   (not (= [] nil))
 
+  ;; output
+  (= [nil nil nil] [(print1 "" *out*) (flush) (flush *err*)])
+  (= "Int cannot be cast to Writer" (try (flush 1) (catch e e)))
+  (= "Cannot call invoke on #<Writer(1)>" (try (*out* "x") (catch e e)))
+  (let [out *out*]
+    (def *out* :nowhere)
+    (let [e (try (println "x") (catch e e))]
+      (def *out* out)
+      (= "Keyword cannot be cast to Writer" e)))
+  (let [tty (tty? *err*)] (or (= true tty) (= false tty)))
+
+  ;; string seqs
+  (= '(\b \c) (rest "abc") (seq "bc") (rest (seq "abc")))
+  (= [\c 2 \c nil () nil] (let [s (rest "abc")]
+                            [(nth s 1) (count s) (first (rest s)) (nth s 2 nil)
+                             (rest (rest s)) (seq (rest (rest s)))]))
+  (= 3 (loop [s (seq "abc") n 0] (if s (recur (next s) (inc n)) n)))
+  (= "cb" (reduce #(str %2 %1) "" (rest "abc")))
+  (= ["B" "C"] (map #(clojure.string/upper-case (str %)) (rest "abc")))
+
+  ;; count and nth
+  (every? #(apply = %)
+          [[0 (count nil)]
+           [3 (count [1 2 3])]
+           [2 (count (rest [1 2 3]))]
+           [2 (count {:a 1 :b 2})]
+           [9 (count {1 1 2 2 3 3 4 4 5 5 6 6 7 7 8 8 9 9})]
+           [3 (count "abc")]
+           [3 (count '(1 2 3))]
+           [3 (count (map inc [1 2 3]))]
+           [2 (nth [1 2 3] 1)]
+           [3 (nth '(1 2 3) 2)]
+           [\b (nth "abc" 1)]
+           [:x (nth [1 2 3] 3 :x)]
+           [:x (nth '(1 2 3) -1 :x)]
+           [nil (nth nil 1)]])
+  (try (do (nth [1 2 3] 3) false)
+    (catch e true))
+
+  ;; reduce
+  (= 6 (reduce + [1 2 3]))
+  (= 10 (reduce + 0 (map inc (range 4))))
+  (= 6 (reduce + 0 (cons 1 (rest [1 2 3]))))
+  (= "cba" (reduce (fn [acc c] (str c acc)) "" "abc"))
+  (= 3 (reduce (fn [acc [k v]] (+ acc v)) 0 {:a 1 :b 2}))
+  (= 45 (reduce (fn [acc [k v]] (+ acc v)) 0 (zipmap (range 10) (range 10))))
+  (= 3 (reduce (fn [acc x] (if (= x 3) (reduced acc) (+ acc x)))
+               0 [1 2 3 4]))
+  (= 3 (reduce (fn [acc x] (if (= x 3) (reduced acc) (+ acc x)))
+               0 '(1 2 3 4)))
+  (reduced? (reduced 1))
+  (= 604450 (reduce + (loop [v [] i 0]
+                        (if (= i 1100) v (recur (conj v i) (inc i))))))
+
   ;; numbers
   (every? #(apply = %)
           [[1 (*)]
@@ -45,15 +99,260 @@
            [-1 (- 2 3)]
            [-1 (- 1)]])
 
+  ;; numbers as values
+  (= [0 6 1 24 -3 1] [(apply + []) (apply + [1 2 3]) (apply *  []) (reduce * [1 2 3 4])
+                      (apply - [3]) (apply - [10 5 4])])
+  (= [3 1] [(apply max [1 3 2]) (apply min [3 1 2])])
+  (= [true false true true false] [(apply < [1 2 3]) (apply < [1 3 2]) (apply >= [3 3 1])
+                                   (apply = [1 1 1]) (apply = [1 1 2])])
+  (= [2 3 4] (map inc [1 2 3]))
+  (= [0 1 2] (mapv dec [1 2 3]))
+  (= 10 (max 1 10 3))
+
+  ;; builtins called with few args
+  (= [1 nil :x 2 1 :y] [(get {:a 1} :a) (get nil :a) (get {} :a :x) (:b {:b 2})
+                        ({:c 1} :c) (nth [:x :y] 1)])
+  (= :none (nth [] 3 :none))
+  (= "Expected 2 args, 1 given" (try (cons 1) (catch e e)))
+  (= "Expected 1 args, 2 given" (try (first [1] [2]) (catch e e)))
+
+  ;; intrinsics
+  (= [5 -1 6 true false true false true] [(+ 2 3) (- 2 3) (* 2 3) (< 2 3)
+                                         (> 2 3) (<= 3 3) (>= 2 3) (= 2 2)])
+  (= [3 1 true false] [(inc 2) (dec 2) (zero? 0) (zero? :a)])
+  (= ["Symbol cannot be cast to Int" "Symbol cannot be cast to Int"]
+     [(try (+ 'a 1) (catch e e)) (try (inc 'a) (catch e e))])
+  (let [+ (fn [a b] [a b])]
+    (= [1 2] (+ 1 2)))
+  (do
+    (in-ns 'intrinsics)
+    (def inc (fn [x] (str x "!")))
+    (let [s (inc 1)]
+      (in-ns 'psota.core)
+      (= "1!" s)))
+
+  ;; strings
+  (= ["abc" "a1:b" "" ":x"] [(str "abc") (str "a" 1 \: 'b) (str) (str :x)])
+  (= ["bc" "b" ""] [(subs "abc" 1) (subs "abc" 1 2) (subs "abc" 3)])
+  (= "Index out of bounds: 4" (try (subs "abc" 4) (catch e e)))
+  (= ["1, 2, 3" "ab" ""] [(clojure.string/join ", " [1 2 3])
+                          (clojure.string/join '("a" "b"))
+                          (clojure.string/join ", " [])])
+  (= [["a" "b" "" "c"] ["a" "b"] ["a" "b" "c"] [""]]
+     [(clojure.string/split "a,b,,c,," ",") (clojure.string/split "a b" \space)
+      (clojure.string/split "abc" "") (clojure.string/split "" ",")])
+  (= [2 nil 4 nil 0] [(clojure.string/index-of "abcabc" "ca")
+                      (clojure.string/index-of "abc" \d)
+                      (clojure.string/index-of "abcabc" "b" 2)
+                      (clojure.string/index-of "abc" "a" 4)
+                      (clojure.string/index-of "abc" "a" -1)])
+  (= [true false] [(clojure.string/starts-with? "abc" "ab")
+                   (clojure.string/starts-with? "abc" \b)])
+  (= ["xbxb" "a-b-c"] [(clojure.string/replace "abab" "a" "x")
+                       (clojure.string/replace "a b c" \space \-)])
+  (= ["ABC" "abc" "a b"] [(clojure.string/upper-case "aBc")
+                          (clojure.string/lower-case "aBc")
+                          (clojure.string/trim " \n a b  ")])
+
+  ;; anonymous fn literals
+  (= 2 (#(inc %) 1))
+  (= 3 (#(+ %1 %2) 1 2))
+  (= [1 [2 3]] (#(vector % %&) 1 2 3))
+  (= [2 1] (#(vector %2 (#(- %) %1)) -1 2))
+  (= '(fn* [] (x %)) (quote (fn* [] (x %))))
+
+  ;; vectors
+  (= [1 2 3] (conj [1 2] 3))
+  (= [1 :x 3] (assoc [1 2 3] 1 :x))
+  (= [1 2 3 4] (assoc [1 2 3] 3 4))
+  (= [1 2] (pop [1 2 3]))
+  (= 3 (peek [1 2 3]))
+  (= '(2 3) (pop '(1 2 3)))
+  (let [v (loop [v [] i 0]
+            (if (= i 1100) v (recur (conj v i) (inc i))))
+        w (loop [w v i 0]
+            (if (= i 100) w (recur (pop w) (inc i))))]
+    (and (= 1099 (get v 1099))
+         (= 1099 (peek v))
+         (= :x (get (assoc v 1050 :x) 1050))
+         (= :x (get (assoc v 10 :x) 10))
+         (= 10 (get v 10))
+         (= 999 (peek w))
+         (= 1000 (count w))
+         (= (range 10) (take 10 w))))
+
   ;; maps
   (= 1 (get {:a 1 :b 2} :a))
   (not (get {:a 1 :b 2} :c))
   (= 3 (get {:a 1 :b 2} :c 3))
   (= {} (dissoc {:a 1} :a))
+  (= {} (dissoc (hash-map :a 1) :a))
+  (= (class {}) (class {1 1 2 2 3 3 4 4 5 5 6 6 7 7 8 8}))
+  (= (class (hash-map)) (class {1 1 2 2 3 3 4 4 5 5 6 6 7 7 8 8 9 9}))
+  (= (class (hash-map))
+     (class (assoc {1 1 2 2 3 3 4 4 5 5 6 6 7 7 8 8} 9 9)))
+  (= {1 1 2 2 3 3 4 4 5 5 6 6 7 7 8 8 9 9}
+     (assoc {1 1 2 2 3 3 4 4 5 5 6 6 7 7 8 8} 9 9))
+  (= {:a 1 :b 2} (assoc (hash-map :a 1) :b 2))
+  (let [m (hash-map 1 :a 4294967297 :b)]
+    (and (= :a (get m 1))
+         (= :b (get m 4294967297))
+         (= {1 :a} (dissoc m 4294967297))))
+  (let [m (loop [m (hash-map) i 0]
+            (if (= i 1000) m (recur (assoc m i (inc i)) (inc i))))
+        n (loop [n m i 0]
+            (if (= i 990) n (recur (dissoc n i) (inc i))))]
+    (and (= 1000 (count m))
+         (= 1000 (get m 999))
+         (= 500 (get (assoc m 499 (get m 499)) 499))
+         (not (get m 1000))
+         (= 10 (count n))
+         (= 9955 (reduce* + 0 (map (fn [[k v]] v) n)))))
+
+  ;; transients
+  (= [0 1 2] (persistent! (conj! (conj! (conj! (transient []) 0) 1) 2)))
+  (= [0 :x] (persistent! (assoc! (pop! (transient [0 1 2])) 1 :x)))
+  (let [v (loop [t (transient []) i 0]
+            (if (= i 1100) (persistent! t) (recur (conj! t i) (inc i))))
+        w (loop [t (transient v) i 0]
+            (if (= i 100) (persistent! t) (recur (pop! t) (inc i))))
+        x (persistent! (assoc! (transient v) 40 :x))]
+    (and (= 1100 (count v))
+         (= :x (get x 40))
+         (= 1099 (peek v))
+         (= 40 (get v 40))
+         (= 999 (peek w))
+         (= 1099 (peek (conj w 1099)))
+         (= 1099 (peek v))))
+  (= {:a 1 :b 2} (persistent! (assoc! (transient {:a 1}) :b 2)))
+  (= {:a 1} (persistent! (dissoc! (transient {:a 1 :b 2}) :b)))
+  (let [m (loop [t (transient {}) i 0]
+            (if (= i 100) (persistent! t) (recur (assoc! t i i) (inc i))))
+        n (persistent! (dissoc! (transient m) 50))]
+    (and (= 100 (count m))
+         (= 50 (get m 50))
+         (not (get n 50))
+         (= 99 (count n))
+         (= (class (hash-map)) (class m))))
+  (let [t (transient [])]
+    (persistent! t)
+    (try (do (conj! t 1) false)
+      (catch e true)))
+  (= [1 2 3] (into [] '(1 2 3)))
+  (= {:a 1 :b 2} (into {} [[:a 1] [:b 2]]))
+  (= '(3 2 1) (into () [1 2 3]))
+  (= [2 3 4] (mapv inc [1 2 3]))
+
+  ;; chunked seqs
+  (chunked-seq? (seq [1 2 3]))
+  (= [1 2 3] (seq [1 2 3]))
+  (not (seq []))
+  (= [2 3] (rest (seq [1 2 3])))
+  (let [v (vec (range 100))]
+    (and (= (map inc (range 100)) (map inc v))
+         (= 50 (count (filter #(< % 50) v)))
+         (= 4950 (reduce + (map identity v)))
+         (= 99 (last (map identity v)))))
+
+  ;; transducers
+  (= 13 (transduce (map inc) + [1 2 3 3]))
+  (= 15 (transduce (filter #(< 1 %)) + 7 [1 2 3 3]))
+  (= [1 2] (into [] (comp (map inc) (take 2)) (range 10)))
+  (= [2 3 4] (into [] (comp (drop 2) (take-while #(< % 5))) (range 10)))
+  (= [0 2] (into [] (remove #(= 1 %)) [0 1 2]))
+  (= '(2 1) (into () (map inc) [0 1]))
+  (= {:a 1} (into {} (filter #(= :a (first %))) {:a 1 :b 2}))
+  (= [[0 1] [2 3] [4]] (into [] (partition-all 2) (range 5)))
+  (= '((0 1) (2 3) (4)) (partition-all 2 (range 5)))
+  (= [1 2 1 3] (sequence (dedupe) [1 1 2 2 1 3 3]))
+  (= [1 2 1] (dedupe [1 1 2 1]))
+  (= [0 0 1 1] (sequence (mapcat #(list % %)) [0 1]))
+  (= [0 0 1 1] (mapcat #(list % %) [0 1]))
+  (= () (sequence (map inc) []))
+  (= [1 2 3] (take 3 (sequence (map inc) (iterate inc 0))))
+  (= [0 1] (sequence (take 2) (iterate inc 0)))
+  (= [[0 1] [2]] (sequence (partition-all 2) [0 1 2]))
+  (let [seen (atom 0)
+        s (sequence (map (fn [x] (swap! seen inc) x)) (iterate inc 0))]
+    (first s)
+    (= 1 (deref seen)))
+  (= [1 2 3] (eduction (filter #(< % 3)) (map inc) [0 1 2 3]))
+  (= 9 (reduce + 0 (eduction (map inc) [1 2 3])))
+  (= [[0 1] [2]] (reduce conj [] (eduction (partition-all 2) [0 1 2])))
+  (= 1 (reduce (fn [acc x] (+ acc x)) 0 (eduction (take 2) (iterate inc 0))))
+  (= [2 3] (into [] (map inc) (eduction (drop 1) [0 1 2])))
+  (let [seen (atom 0)
+        e (eduction (map (fn [x] (swap! seen inc) x)) [1 2])]
+    (reduce + 0 e)
+    (reduce + 0 e)
+    (= 4 (deref seen)))
+  (= [0 1] (transduce (take 2) conj (iterate inc 0)))
+  (= 6 (transduce cat (completing +) 0 [[1 2] [3]]))
 
   ;; for
   (= [[1 0] [2 0] [2 1] [3 0] [3 1] [3 2]]
      (for [x (range 4) y (range x)] [x y]))
+  (= [2 3 4] (for [x [1 2 3]] (inc x)))
+  (= [2] (for [x [1 2 3] :when (= x 2)] x))
+  (= [1 2] (for [x [1 2 3 4] :while (< x 3)] x))
+  (= [[1 :a] [1 :b] [2 :a] [2 :b]] (for [x [1 2] y [:a :b]] [x y]))
+
+  ;; calls with many args
+  (= 120 (count (eval (cons 'list (range 120)))))
+  (= 120 (last (eval (vec (map (fn [x] (list 'inc x)) (range 120))))))
+
+  ;; locals
+  (= [2 1] (let [x 1] (let [f (fn [] x) x 2] [x (f)])))
+  (= [0 1 2] (loop [i 0 fs []]
+               (if (= i 3)
+                 (map (fn [f] (f)) fs)
+                 (recur (inc i) (conj fs (fn [] i))))))
+  (= [1 2 3] (let [a 1] ((fn [b] ((fn [c] [a b c]) 3)) 2)))
+  (= [5 "boom"] (let [x 5] (try (throw "boom") (catch e [x e]))))
+
+  ;; multi-arity fns
+  (let [f (fn ([] 0) ([x] x) ([x y] (+ x y)) ([x y & more] (count more)))]
+    (= [0 1 3 1 3] [(f) (f 1) (f 1 2) (f 1 2 3) (apply f (range 5))]))
+  (let [f (fn ([[a b]] (+ a b)) ([x {:keys [y]}] [x y]))]
+    (= [3 [1 2]] [(f [1 2]) (f 1 {:y 2})]))
+  (let [f (fn fact ([n] (fact n 1)) ([n acc] (if (= n 0) acc (recur (dec n) (* n acc)))))]
+    (= 120 (f 5)))
+  (let [x 10
+        f (fn ([] x) ([y] (+ x y)))]
+    (= [10 11] [(f) (f 1)]))
+  (try
+    ((fn ([x] x) ([x y] y)) 1 2 3)
+    (catch e (= e "3 arguments given")))
+
+  ;; deep calls
+  (do
+    (defn tail-even? [n] (if (= n 0) true (tail-odd? (dec n))))
+    (defn tail-odd? [n] (if (= n 0) false (tail-even? (dec n))))
+    (tail-even? 10000))
+  (do
+    (defn depth [n] (if (= n 0) 0 (inc (depth (dec n)))))
+    (= 5000 (depth 5000)))
+
+  ;; keywords and symbols
+  (= :a (keyword "a"))
+  (= 2 ((keyword "b") {:a 1 :b 2}))
+  (= 'a (symbol "a"))
+  (= 'a (with-meta 'a {:tag :b}))
+  (= {:tag :b} (meta (with-meta 'a {:tag :b})))
+  (= nil (meta 'a))
+  (let [m (zipmap (map #(keyword (str "k" %)) (range 20)) (range 20))]
+    (and (= 13 (get m :k13)) (= 13 (:k13 m))))
+
+  ;; vars
+  (do
+    (def redefined 1)
+    (let [v (var redefined)
+          f (fn [] redefined)]
+      (def redefined 2)
+      (and (= 2 (f))
+           (= 3 (alter-var-root v (fn [x] (+ x 1))))
+           (= 3 (f))
+           (= 3 redefined))))
 
   ;; qualified symbols
 
@@ -74,6 +373,10 @@
     (f 1 2 3)
     (= [nil [3] [2 3] [1 2 3]]
        (deref xss)))
+  (= 6 ((fn [acc & xs]
+           (if xs
+             (recur (+ acc (first xs)) (next xs))
+             acc)) 1 2 3))
   (= :ok ((fn [[x & xs]]
             (if (= 3 x)
               :ok
@@ -103,4 +406,16 @@
 
   ;; quasi quoting
   (eval `(= 'a# 'a#))
-  (not (= `a# `a#)))
+  (not (= `a# `a#))
+  (= [1 [2 3]] `[1 [2 ~(+ 1 2)]])
+  (= '(a {:b (c)}) `(a {:b (c)}))
+
+  ;; literals
+  (= '[a {:b "c"}] (vector 'a {:b "c"}))
+  (let [f (fn [] [1 :a "b"])]
+    (conj (f) 3)
+    (persistent! (conj! (transient (f)) 3))
+    (= [1 :a "b"] (f)))
+  (let [f (fn [] {:a 1})]
+    (persistent! (assoc! (transient (f)) :b 2))
+    (= {:a 1} (f))))